@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+
+class _Scope:
+    def __init__(self):
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.matrix = None
+        self.matrix_ids: List[int] = []
+
+    def rebuild(self):
+        self.matrix_ids = list(self.entries)
+        self.matrix = np.vstack([self.entries[i]["vector"] for i in self.matrix_ids]) if self.matrix_ids else None
+
+
+class AnswerCache:
+    """Semantic cache of QA results.
+
+    Entries are grouped by scope (index version plus the settings that shape an answer)
+    and matched by cosine similarity between normalized question embeddings.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl_seconds: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._scopes: Dict[Hashable, _Scope] = {}
+        self._lru: "OrderedDict[int, Hashable]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: Hashable, vector, threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        threshold = self.threshold if threshold is None else threshold
+        query = self._normalize(vector)
+
+        with self._lock:
+            cache_scope = self._scopes.get(scope)
+            if cache_scope is None or not cache_scope.entries:
+                self.misses += 1
+                return None
+
+            if cache_scope.matrix is None or len(cache_scope.matrix_ids) != len(cache_scope.entries):
+                cache_scope.rebuild()
+
+            similarities = cache_scope.matrix @ query
+            best = int(np.argmax(similarities))
+            entry_id = cache_scope.matrix_ids[best]
+            entry = cache_scope.entries.get(entry_id)
+
+            if entry is not None and time.time() - entry["created"] > self.ttl_seconds:
+                self._remove(entry_id)
+                entry = None
+
+            if entry is None or similarities[best] < threshold:
+                self.misses += 1
+                return None
+
+            self._lru.move_to_end(entry_id)
+            self.hits += 1
+            return {**entry["result"], "cached_question": entry["question"],
+                    "similarity": float(similarities[best])}
+
+    def store(self, scope: Hashable, question: str, vector, result: Dict[str, Any]):
+        cached_result = {
+            "answer": result.get("answer"),
+            "source_documents": list(result.get("source_documents", []))
+        }
+
+        with self._lock:
+            cache_scope = self._scopes.setdefault(scope, _Scope())
+            entry_id = self._next_id
+            self._next_id += 1
+
+            cache_scope.entries[entry_id] = {
+                "question": question,
+                "vector": self._normalize(vector),
+                "result": cached_result,
+                "created": time.time()
+            }
+            cache_scope.matrix = None
+            self._lru[entry_id] = scope
+
+            while len(self._lru) > self.max_entries:
+                self._remove(next(iter(self._lru)))
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            for scope in [s for s in self._scopes if predicate is None or predicate(s)]:
+                for entry_id in list(self._scopes[scope].entries):
+                    self._lru.pop(entry_id, None)
+                del self._scopes[scope]
+
+    def _remove(self, entry_id: int):
+        scope = self._lru.pop(entry_id, None)
+        cache_scope = self._scopes.get(scope)
+        if cache_scope is not None:
+            cache_scope.entries.pop(entry_id, None)
+            cache_scope.matrix = None
+            if not cache_scope.entries:
+                del self._scopes[scope]
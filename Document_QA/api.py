@@ -0,0 +1,296 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from pydantic import BaseModel
+
+load_dotenv()
+
+from answer_cache import AnswerCache
+from embedding_cache import EmbeddingCache
+from page_cache import PageCache
+from index_store import IndexStore, sanitize_index_name
+from namespaces import NamespaceManager, ResidentIndex
+from vector_engines import INDEX_ENGINES
+from qa_system import DocumentQASystem, make_llm, build_embeddings, CHUNK_SIZE, CHUNK_OVERLAP, TEMPERATURE, MEMORY_TYPE
+
+API_INDEX_NAME = os.getenv("API_INDEX_NAME", "default")
+API_MODEL = os.getenv("API_MODEL", "gpt-4o-mini")
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "16"))
+API_MAX_CONVERSATIONS = int(os.getenv("API_MAX_CONVERSATIONS", "1000"))
+API_CONVERSATION_TTL = float(os.getenv("API_CONVERSATION_TTL", "3600"))
+API_LLM_MAX_CONNECTIONS = int(os.getenv("API_LLM_MAX_CONNECTIONS", "64"))
+
+
+class UploadedStream:
+    """Gives API uploads the same interface as Streamlit's UploadedFile, reading FastAPI's spooled file
+    in place instead of loading it into memory."""
+
+    def __init__(self, name: str, file):
+        self.name = name
+        self._file = file
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+
+class AskRequest(BaseModel):
+    question: str
+    conversation_id: Optional[str] = None
+    namespace: str = API_INDEX_NAME
+
+
+class Conversation:
+    def __init__(self, namespace: str, system: DocumentQASystem):
+        self.namespace = namespace
+        self.system = system
+        self.lock = asyncio.Lock()
+        # Held by the worker thread while it attaches and asks, and by eviction while it releases the index.
+        self.guard = threading.Lock()
+        # Set by an eviction that found the guard taken; the question in flight releases the index when done.
+        self.release_pending = False
+        self.last_used = time.monotonic()
+
+
+class QAService:
+    """Resident namespaces (one index per tenant), embedding cache, answer cache and pooled LLM client
+    per process, shared by every conversation; each conversation only owns its memory."""
+
+    def __init__(self):
+        self.index_store = IndexStore()
+        self.embedding_cache = EmbeddingCache()
+        self.answer_cache = AnswerCache()
+        self.page_cache = PageCache()
+        self.http_client = httpx.Client(limits=httpx.Limits(
+            max_connections=API_LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=API_LLM_MAX_CONNECTIONS
+        ))
+        self.llm = make_llm(API_MODEL, TEMPERATURE, http_client=self.http_client)
+        self.namespaces = NamespaceManager(
+            self.index_store, lambda embedding_type: build_embeddings(embedding_type, self.embedding_cache)[0]
+        )
+        self.namespaces.add_eviction_listener(self._release_namespace)
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.request_slots = asyncio.Semaphore(API_MAX_CONCURRENCY)
+        self.ingest_lock = asyncio.Lock()
+
+    def _new_system(self) -> DocumentQASystem:
+        system = DocumentQASystem()
+        system.answer_cache = self.answer_cache
+        system.page_cache = self.page_cache
+        return system
+
+    def _release_namespace(self, namespace: str):
+        # Conversations re-attach the namespace on their next question; until then they only keep their memory.
+        # A conversation busy answering is not waited for: the guard is held for a whole LLM call.
+        for conversation in list(self.conversations.values()):
+            if conversation.namespace != namespace:
+                continue
+            if conversation.guard.acquire(blocking=False):
+                try:
+                    conversation.system.release_index()
+                finally:
+                    conversation.guard.release()
+            else:
+                conversation.release_pending = True
+
+    def _attach(self, system: DocumentQASystem, resident: ResidentIndex):
+        if system.vectorstore is resident.vectorstore:
+            return
+        system.attach_vectorstore(resident.vectorstore, resident.embeddings, resident.manifest, resident.lexical_index)
+        if system.qa_chain is None:
+            system.setup_qa_chain(API_MODEL, TEMPERATURE, MEMORY_TYPE, llm=self.llm)
+
+    def answer(self, conversation: Conversation, question: str) -> Dict[str, Any]:
+        while True:
+            # Loading a cold namespace may evict others, so it happens before taking the conversation's guard.
+            resident = self.namespaces.get(conversation.namespace)
+            with conversation.guard:
+                conversation.release_pending = False
+                # Evicted in between: attaching it now would keep an index the manager no longer tracks.
+                if self.namespaces.resident(conversation.namespace) is not resident:
+                    continue
+                self._attach(conversation.system, resident)
+                try:
+                    return conversation.system.ask_question(question)
+                finally:
+                    if conversation.release_pending:
+                        conversation.system.release_index()
+                        conversation.release_pending = False
+
+    def get_conversation(self, conversation_id: Optional[str], namespace: str) -> Tuple[str, Conversation]:
+        now = time.monotonic()
+        while self.conversations:
+            oldest_id, oldest = next(iter(self.conversations.items()))
+            if now - oldest.last_used < API_CONVERSATION_TTL and len(self.conversations) < API_MAX_CONVERSATIONS:
+                break
+            del self.conversations[oldest_id]
+
+        conversation = self.conversations.get(conversation_id) if conversation_id else None
+        if conversation is not None and conversation.namespace != namespace:
+            raise HTTPException(status_code=409,
+                                detail=f"Conversation belongs to namespace {conversation.namespace}")
+        if conversation is None:
+            conversation_id = conversation_id or uuid.uuid4().hex
+            conversation = self.conversations[conversation_id] = Conversation(namespace, self._new_system())
+
+        conversation.last_used = now
+        self.conversations.move_to_end(conversation_id)
+        return conversation_id, conversation
+
+    def ingest(self, uploads: List[UploadedStream], removed_files: List[str], index_name: str,
+               embedding_type: str, vectorstore_type: str, index_engine: str = "Flat") -> Dict[str, Any]:
+        # Across processes too: the Streamlit ingestion worker and other replicas may write the same index.
+        with self.index_store.writer(index_name):
+            manifest = None
+            if self.index_store.latest_version(index_name) is not None:
+                manifest = self.index_store.read_manifest(index_name)
+            if (manifest is not None and manifest["embedding_type"] == embedding_type
+                    and manifest["vectorstore_type"] == vectorstore_type
+                    and manifest.get("index_engine", "Flat") == index_engine):
+                # The latest version, which another process may have committed since this one loaded it.
+                resident = self.namespaces.get(index_name, manifest["version"])
+                updated = self._new_system()
+                updated.attach_vectorstore(resident.vectorstore, resident.embeddings, resident.manifest,
+                                           resident.lexical_index)
+                stats = updated.update_vectorstore(uploads, removed_files, self.index_store, CHUNK_SIZE, CHUNK_OVERLAP)
+                if updated.vectorstore is not resident.vectorstore:
+                    self.namespaces.put(updated.vectorstore, updated.embeddings,
+                                        self.index_store.read_manifest(index_name, updated.active_index[1]),
+                                        updated.lexical_index)
+                return stats
+
+            version = self.index_store.allocate_version(index_name)
+            system = self._new_system()
+            try:
+                ingest_stats = system.build_vectorstore(
+                    uploads, embedding_type, vectorstore_type, CHUNK_SIZE, CHUNK_OVERLAP,
+                    embedding_cache=self.embedding_cache,
+                    persist_directory=self.index_store.chroma_directory(index_name, version),
+                    index_engine=index_engine
+                )
+                if not ingest_stats.embedded:
+                    self.index_store.discard_version(index_name, version)
+                    return {"added": 0, "errors": ingest_stats.errors, "duplicates": ingest_stats.duplicates}
+
+                manifest = system.save_vectorstore(self.index_store, index_name, version)
+            except BaseException:
+                self.index_store.discard_version(index_name, version)
+                raise
+            self.namespaces.put(system.vectorstore, system.embeddings, manifest, system.lexical_index)
+            return {"added": len(system.indexed_files), "chunks": ingest_stats.chunks, "errors": ingest_stats.errors,
+                    "duplicates": ingest_stats.duplicates}
+
+
+service: Optional[QAService] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global service
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=API_MAX_CONCURRENCY + 4))
+    service = QAService()
+    if service.index_store.latest_version(API_INDEX_NAME) is not None:
+        await asyncio.to_thread(service.namespaces.get, API_INDEX_NAME)
+    yield
+    service.http_client.close()
+
+
+app = FastAPI(title="Document Q&A API", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "resident_namespaces": [row["name"] for row in service.namespaces.report() if row["resident"]],
+        "conversations": len(service.conversations)
+    }
+
+
+@app.get("/namespaces")
+async def namespaces():
+    manager = service.namespaces
+    return {
+        "budget_bytes": manager.budget_bytes,
+        "resident_bytes": manager.total_bytes,
+        "loads": manager.loads,
+        "evictions": manager.evictions,
+        "namespaces": await asyncio.to_thread(manager.report)
+    }
+
+
+@app.delete("/namespaces/{namespace}/resident")
+async def evict_namespace(namespace: str):
+    # Eviction notifies every conversation of the namespace; that must not run on the event loop.
+    if not await asyncio.to_thread(service.namespaces.evict, sanitize_index_name(namespace)):
+        raise HTTPException(status_code=404, detail="Namespace not resident")
+    return {"evicted": namespace}
+
+
+@app.post("/ingest")
+async def ingest(files: List[UploadFile] = File(default=[]), removed_files: List[str] = Form(default=[]),
+                 index_name: str = Form(API_INDEX_NAME), embedding_type: str = Form("OpenAI"),
+                 vectorstore_type: str = Form("FAISS"), index_engine: str = Form("Flat")):
+    uploads = [UploadedStream(upload.filename, upload.file) for upload in files]
+    if not uploads and not removed_files:
+        raise HTTPException(status_code=400, detail="No files to ingest")
+    if index_engine not in INDEX_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown index engine: {index_engine}")
+
+    index_name = sanitize_index_name(index_name)
+    async with service.ingest_lock:
+        stats = await asyncio.to_thread(
+            service.ingest, uploads, removed_files, index_name, embedding_type, vectorstore_type, index_engine
+        )
+    resident = service.namespaces.resident(index_name)
+    return {"index": (resident.name, resident.version) if resident else None, **stats}
+
+
+@app.post("/ask")
+async def ask(request: AskRequest):
+    namespace = sanitize_index_name(request.namespace)
+    if service.namespaces.resident(namespace) is None and service.index_store.latest_version(namespace) is None:
+        raise HTTPException(status_code=404, detail=f"Namespace not found: {namespace}")
+
+    conversation_id, conversation = service.get_conversation(request.conversation_id, namespace)
+    async with service.request_slots:
+        async with conversation.lock:
+            result = await asyncio.to_thread(service.answer, conversation, request.question)
+
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+
+    return {
+        "conversation_id": conversation_id,
+        "answer": result.get("answer"),
+        "cached": result.get("cached", False),
+        "trace_id": result.get("trace_id"),
+        "sources": [{"content": doc.page_content, "metadata": doc.metadata}
+                    for doc in result.get("source_documents", [])]
+    }
+
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    if service.conversations.pop(conversation_id, None) is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"deleted": conversation_id}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api:app", host=os.getenv("API_HOST", "0.0.0.0"), port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,141 @@
+"""Answers a CSV or JSONL file of questions against a saved index and streams the answers to a JSONL file.
+
+    python batch_qa.py questions.csv --index default --output answers.jsonl
+    python batch_qa.py audit.jsonl --index team_a --model gpt-4o-mini --concurrency 32
+
+CSV files need a `question` column (otherwise the first column is used) and may have an `id` column;
+JSONL lines are objects with `question` and optionally `id`. Each output line holds the id, question,
+answer, sources and trace id, in completion order.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from typing import Any, Dict, IO, Iterable, List
+
+from dotenv import load_dotenv
+
+from embedding_cache import EmbeddingCache
+from index_store import IndexStore, sanitize_index_name
+from qa_system import DocumentQASystem, build_embeddings, BATCH_CONCURRENCY, TEMPERATURE, MEMORY_TYPE
+
+BATCH_FORMATS = ["csv", "jsonl"]
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", os.path.join(".cache", "batches"))
+
+
+def batch_format(name: str) -> str:
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    return "jsonl" if extension in ("jsonl", "ndjson", "json") else "csv"
+
+
+def read_questions(lines: Iterable[str], kind: str) -> List[Dict[str, Any]]:
+    """[{"id", "question"}] from CSV or JSONL lines; rows without a question are skipped."""
+    if kind == "jsonl":
+        rows = [json.loads(line) for line in lines if line.strip()]
+    else:
+        reader = csv.reader(lines)
+        header = next(reader, [])
+        columns = [column.strip().lower() for column in header]
+        if "question" not in columns:
+            # No header row: the first column holds the questions.
+            rows = [{"question": header[0]}] if header else []
+            columns = ["question"]
+        else:
+            rows = []
+        rows.extend(dict(zip(columns, row)) for row in reader if row)
+
+    items = []
+    for number, row in enumerate(rows, start=1):
+        question = str(row.get("question") or "").strip()
+        if question:
+            items.append({"id": row.get("id") or number, "question": question})
+    return items
+
+
+def result_record(item: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    record = {
+        "id": item["id"],
+        "question": item["question"],
+        "answer": result.get("answer"),
+        "cached": result.get("cached", False),
+        "trace_id": result.get("trace_id"),
+        "sources": [{"content": doc.page_content, "metadata": doc.metadata}
+                    for doc in result.get("source_documents", [])]
+    }
+    if "error" in result:
+        record["error"] = result["error"]
+    return record
+
+
+def run_batch(system: DocumentQASystem, items: List[Dict[str, Any]], output: IO[str],
+              concurrency: int = BATCH_CONCURRENCY, on_result=None) -> Dict[str, Any]:
+    """Writes one JSONL line per answered question as soon as it completes and returns a summary."""
+    started = time.perf_counter()
+    summary = {"questions": len(items), "answered": 0, "cached": 0, "errors": 0}
+
+    for result in system.ask_batch([item["question"] for item in items], concurrency):
+        record = result_record(items[result["index"]], result)
+        output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        output.flush()
+
+        if "error" in record:
+            summary["errors"] += 1
+        else:
+            summary["answered"] += 1
+            summary["cached"] += int(record["cached"])
+        if on_result:
+            on_result(record, summary)
+
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    summary["questions_per_second"] = round(len(items) / max(summary["seconds"], 1e-9), 2)
+    return summary
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="CSV or JSONL file of questions")
+    parser.add_argument("--index", default="default", help="Name of the saved index (namespace)")
+    parser.add_argument("--output", help="JSONL file for the answers (default: <questions>.answers.jsonl)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help="Concurrent LLM calls; set it near the backend's rate limit")
+    parser.add_argument("--format", choices=BATCH_FORMATS, help="Input format (default: from the file extension)")
+    parser.add_argument("--dense-only", action="store_true", help="Disable BM25 hybrid retrieval")
+    parser.add_argument("--rerank", action="store_true", help="Re-rank candidates with the local cross-encoder")
+    args = parser.parse_args()
+
+    # utf-8-sig: spreadsheet exports often start with a byte order mark.
+    with open(args.questions, encoding="utf-8-sig", newline="") as f:
+        items = read_questions(f, args.format or batch_format(args.questions))
+
+    index_store = IndexStore()
+    index_name = sanitize_index_name(args.index)
+    manifest = index_store.read_manifest(index_name)
+    embeddings, _ = build_embeddings(manifest["embedding_type"], EmbeddingCache())
+    vectorstore, manifest = index_store.load(index_name, embeddings, manifest["version"])
+    lexical_index = index_store.load_lexical(index_name, manifest["version"])
+
+    system = DocumentQASystem()
+    system.verbose = False
+    system.attach_vectorstore(vectorstore, embeddings, manifest, lexical_index)
+    system.set_hybrid_search(not args.dense_only)
+    system.set_reranking(args.rerank)
+    system.setup_qa_chain(args.model, TEMPERATURE, MEMORY_TYPE)
+
+    output_path = args.output or f"{os.path.splitext(args.questions)[0]}.answers.jsonl"
+
+    def on_result(record, summary):
+        done = summary["answered"] + summary["errors"]
+        print(f"\r{done}/{summary['questions']} answered ({summary['errors']} errors)", end="", flush=True)
+
+    with open(output_path, "w", encoding="utf-8") as output:
+        summary = run_batch(system, items, output, args.concurrency, on_result)
+    print()
+    print(json.dumps({"output": output_path, **summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
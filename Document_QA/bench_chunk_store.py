@@ -0,0 +1,169 @@
+"""Resident memory of a loaded FAISS docstore per million chunks: JSONL -> Document dict vs. the chunk store.
+
+    python bench_chunk_store.py --chunks 200000
+    python bench_chunk_store.py --chunks 1000000 --json
+
+Each layout is loaded in a fresh interpreter, so one measurement does not inherit the other's heap.
+Anonymous memory (RssAnon) is private to the process; mapped chunk texts show up as file-backed
+pages (RssFile), which the page cache shares between processes and can drop under pressure.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from langchain.schema import Document
+
+from chunk_store import ChunkStore
+from create_sample_txt import synthetic_sections
+from qa_system import CHUNK_SIZE
+
+LAYOUTS = ["jsonl", "chunk_store"]
+
+
+def synthetic_chunks(num_chunks: int, seed: int = 0):
+    """(id, Document) pairs shaped like ingested chunks: ~CHUNK_SIZE characters, metadata of a few hundred files."""
+    rng = random.Random(seed)
+    sections = synthetic_sections(seed)
+    text = ""
+    for number in range(num_chunks):
+        while len(text) < CHUNK_SIZE:
+            heading, body = next(sections)
+            text += heading + "\n" + " ".join(body) + "\n"
+        content, text = text[:CHUNK_SIZE], text[CHUNK_SIZE:]
+
+        file_number = number // 2000
+        source = f"document_{file_number:04d}.pdf"
+        chunk_id = f"{file_number:016x}-{number % 2000}"
+        yield chunk_id, Document(page_content=content, metadata={
+            "source": f"/tmp/uploads/{source}",
+            "source_file": source,
+            "upload_time": f"2024-05-{1 + file_number % 28:02d}T10:{file_number % 60:02d}:00",
+            "file_hash": f"{file_number:064x}",
+            "page": (number % 2000) // 4,
+            "start_index": rng.randint(0, 4000),
+            "end_index": rng.randint(4000, 8000),
+            "tokens": rng.randint(50, 80),
+            "section": f"BÖLÜM {number // 10}",
+            "chunk_id": chunk_id,
+        })
+
+
+def write_corpus(path: str, num_chunks: int):
+    with open(os.path.join(path, "docstore.jsonl"), "w", encoding="utf-8") as f:
+        for chunk_id, doc in synthetic_chunks(num_chunks):
+            f.write(json.dumps({"id": chunk_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                               ensure_ascii=False) + "\n")
+    store = ChunkStore.from_documents(synthetic_chunks(num_chunks))
+    store.save(path, range(store.rows))
+
+
+def _rss() -> dict:
+    fields = {}
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                fields[key] = int(value.split()[0]) * 1024
+    return fields
+
+
+def measure(layout: str, path: str, queries: int) -> dict:
+    """Runs in the child: load one layout, touch every chunk once as a full scan would, then time lookups."""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    from index_store import faiss_vectorstore
+
+    before = _rss()
+    start = time.perf_counter()
+    if layout == "jsonl":
+        docs, index_to_docstore_id = {}, {}
+        with open(os.path.join(path, "docstore.jsonl"), encoding="utf-8") as f:
+            for position, line in enumerate(f):
+                record = json.loads(line)
+                docs[record["id"]] = Document(page_content=record["page_content"], metadata=record["metadata"])
+                index_to_docstore_id[position] = record["id"]
+        vectorstore = FAISS(None, None, InMemoryDocstore(docs), index_to_docstore_id)
+    else:
+        vectorstore = faiss_vectorstore(None, None, ChunkStore.load(path))
+    load_seconds = time.perf_counter() - start
+
+    num_chunks = len(vectorstore.index_to_docstore_id)
+    text_bytes = sum(len(vectorstore.docstore.search(vectorstore.index_to_docstore_id[p]).page_content)
+                     for p in range(num_chunks))
+    after = _rss()
+
+    rng = random.Random(1)
+    positions = [rng.randrange(num_chunks) for _ in range(queries)]
+    start = time.perf_counter()
+    for position in positions:
+        vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+    lookup_us = (time.perf_counter() - start) / queries * 1e6
+
+    return {
+        "layout": layout,
+        "chunks": num_chunks,
+        "text_bytes": text_bytes,
+        "load_seconds": round(load_seconds, 2),
+        "rss_bytes": after["VmRSS"] - before["VmRSS"],
+        "anon_bytes": after["RssAnon"] - before["RssAnon"],
+        "file_bytes": after["RssFile"] - before["RssFile"],
+        "lookup_us": round(lookup_us, 2),
+    }
+
+
+def run(num_chunks: int, queries: int, corpus_dir: str = None):
+    path = corpus_dir or tempfile.mkdtemp(prefix="bench_chunk_store_")
+    try:
+        if not os.path.exists(os.path.join(path, "docstore.jsonl")):
+            os.makedirs(path, exist_ok=True)
+            write_corpus(path, num_chunks)
+
+        results = []
+        for layout in LAYOUTS:
+            output = subprocess.run([sys.executable, __file__, "--measure", layout, "--corpus-dir", path,
+                                     "--queries", str(queries)], check=True, capture_output=True, text=True).stdout
+            row = json.loads(output)
+            scale = 1_000_000 / row["chunks"]
+            for key in ("rss_bytes", "anon_bytes", "file_bytes"):
+                row[key.replace("_bytes", "_mb_per_million")] = round(row.pop(key) * scale / (1024 * 1024), 1)
+            results.append(row)
+        return results
+    finally:
+        if corpus_dir is None:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("--corpus-dir", help="Reuse (or create) the generated corpus here")
+    parser.add_argument("--measure", choices=LAYOUTS, help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.corpus_dir, args.queries)))
+        return
+
+    results = run(args.chunks, args.queries, args.corpus_dir)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.chunks} chunks of ~{CHUNK_SIZE} characters, per million chunks:")
+    for row in results:
+        print(f"{row['layout']:<12} RSS {row['rss_mb_per_million']:>7.1f} MB  (anon {row['anon_mb_per_million']:>7.1f}"
+              f"  file {row['file_mb_per_million']:>6.1f})  load {row['load_seconds']:.1f}s  "
+              f"lookup {row['lookup_us']:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
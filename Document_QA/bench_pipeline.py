@@ -0,0 +1,326 @@
+"""Benchmark of the load -> split -> embed -> index -> query pipeline with offline fake models.
+
+    python bench_pipeline.py --size 10MB --format txt --output bench.json
+    python bench_pipeline.py --size 1GB --format both --corpus-dir corpus --queries 500
+
+Corpora are generated deterministically into --corpus-dir and reused by later runs, so results
+from different commits measure the same input. The JSON keys are stable across runs.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List
+
+import numpy as np
+
+from bm25 import BM25Index
+from create_sample_txt import create_large_txt, synthetic_sections
+from fake_models import (FAKE_EMBEDDING_DIMENSIONS, FAKE_EMBEDDING_CALL_LATENCY, FAKE_EMBEDDING_TEXT_LATENCY,
+                         FAKE_LLM_LATENCY)
+from index_store import VectorstoreWriter
+from ingest import EMBED_BATCH_SIZE
+from tracing import Tracer
+from qa_system import DocumentQASystem, build_embeddings, CHUNK_SIZE, CHUNK_OVERLAP, TEMPERATURE, MEMORY_TYPE
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCHEMA_VERSION = 1
+CORPUS_FILE_BYTES = 10 * 1024 * 1024
+_SIZE_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit, factor in _SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+class CorpusFile:
+    """A generated corpus file with the interface of Streamlit's UploadedFile."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def create_corpus(directory: str, total_bytes: int, kind: str) -> List[CorpusFile]:
+    os.makedirs(directory, exist_ok=True)
+
+    # Files alternate txt/pdf for "both"; up to two files' worth is split in half so each format gets one.
+    max_file_bytes = CORPUS_FILE_BYTES if kind != "both" else min(CORPUS_FILE_BYTES, -(-total_bytes // 2))
+    files = []
+    remaining = total_bytes
+    number = 0
+    while remaining > 0:
+        file_bytes = min(max_file_bytes, remaining)
+        extension = kind if kind != "both" else ("txt", "pdf")[number % 2]
+        path = os.path.join(directory, f"corpus_{number:05d}_{file_bytes}.{extension}")
+
+        # Files are deterministic in (number, size), so an existing one is the same input.
+        if not os.path.exists(path):
+            if extension == "pdf":
+                from create_sample_pdf import create_large_pdf
+                create_large_pdf(path, file_bytes, seed=number)
+            else:
+                create_large_txt(path, file_bytes, seed=number)
+
+        files.append(CorpusFile(path))
+        remaining -= file_bytes
+        number += 1
+    return files
+
+
+def make_questions(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    sections = synthetic_sections(seed)
+    questions = []
+    while len(questions) < count:
+        heading, body = next(sections)
+        words = rng.choice(body).split()
+        start = rng.randrange(max(1, len(words) - 8))
+        questions.append(" ".join(words[start:start + rng.randint(4, 8)]) + " nedir?")
+    return questions
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS; the parse worker pool counts as children.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / scale, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs in a fresh interpreter, since this script has already imported everything.
+_IMPORT_PROBE = """
+import importlib, json, sys, time
+
+def timed(load):
+    started = time.perf_counter()
+    try:
+        load()
+    except ImportError:
+        return None
+    return time.perf_counter() - started
+
+timings = {"app_modules": timed(lambda: [importlib.import_module(m) for m in ("qa_system", "chat_store")])}
+backend = {"FAISS": ("langchain_community.vectorstores.faiss", "faiss"),
+           "Chroma": ("langchain_community.vectorstores.chroma", "chromadb")}[sys.argv[1]]
+timings["vectorstore"] = timed(lambda: [importlib.import_module(m) for m in backend])
+timings["chains"] = timed(lambda: [importlib.import_module(m) for m in ("langchain.chains", "langchain.memory")])
+timings["openai"] = timed(lambda: importlib.import_module("langchain_openai"))
+timings["huggingface"] = timed(lambda: importlib.import_module("sentence_transformers"))
+print(json.dumps(timings))
+"""
+
+
+def measure_imports(vectorstore_type: str) -> Dict[str, Any]:
+    """Cold import seconds: the modules the app loads at startup, then each backend it loads on demand."""
+    try:
+        output = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, vectorstore_type], capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    return {name: round(seconds, 3) if seconds is not None else None for name, seconds in json.loads(output).items()}
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+
+    def report(self, stage: str, **units: float) -> Dict[str, Any]:
+        samples = np.array(self.samples.get(stage, [0.0]))
+        seconds = float(samples.sum())
+        return {
+            "seconds": round(seconds, 4),
+            "throughput": {f"{unit}_per_second": round(amount / seconds, 2) if seconds else None
+                           for unit, amount in units.items()},
+            "latency_ms": {
+                "count": int(len(samples)),
+                "p50": round(float(np.percentile(samples, 50)) * 1000, 3),
+                "p95": round(float(np.percentile(samples, 95)) * 1000, 3),
+                "p99": round(float(np.percentile(samples, 99)) * 1000, 3),
+                "max": round(float(samples.max()) * 1000, 3)
+            },
+            "peak_rss_mb": peak_rss_mb()
+        }
+
+
+def run(files: List[CorpusFile], vectorstore_type: str, index_engine: str, num_queries: int,
+        concurrent_ingest: bool) -> Dict[str, Any]:
+    timer = StageTimer()
+    corpus_mb = sum(f.size for f in files) / (1024 * 1024)
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    results: Dict[str, Any] = {}
+
+    try:
+        system = DocumentQASystem()
+        embeddings, _ = build_embeddings("Fake")
+        writer = VectorstoreWriter(vectorstore_type, embeddings, persist_directory=persist_directory,
+                                   lexical_index=BM25Index(), index_engine=index_engine)
+
+        # Stage by stage, one file at a time, so memory stays bounded by the index rather than the corpus.
+        pages = chunks = 0
+        for corpus_file in files:
+            with timer.measure("load"):
+                documents = system.load_documents([corpus_file])
+            with timer.measure("split"):
+                split_docs = system.split_documents(documents, CHUNK_SIZE, CHUNK_OVERLAP)
+            pages += len(documents)
+            chunks += len(split_docs)
+
+            for start in range(0, len(split_docs), EMBED_BATCH_SIZE):
+                batch = split_docs[start:start + EMBED_BATCH_SIZE]
+                with timer.measure("embed"):
+                    vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+                with timer.measure("index"):
+                    writer(batch, vectors)
+        with timer.measure("index"):
+            writer.close()
+
+        results["stages"] = {
+            "load": timer.report("load", mb=corpus_mb, pages=pages),
+            "split": timer.report("split", chunks=chunks),
+            "embed": timer.report("embed", chunks=chunks),
+            "index": timer.report("index", chunks=chunks)
+        }
+        results["corpus"] = {"files": len(files), "mb": round(corpus_mb, 2), "pages": pages, "chunks": chunks}
+
+        system.vectorstore = writer.vectorstore
+        system.lexical_index = writer.lexical_index
+        system.embeddings = embeddings
+        system.vectorstore_type = vectorstore_type
+        system.verbose = False
+        system.tracer = Tracer()
+        system.setup_qa_chain("fake", TEMPERATURE, MEMORY_TYPE)
+
+        questions = make_questions(num_queries)
+        retriever = system._make_retriever()
+        for question in questions:
+            with timer.measure("retrieve"):
+                retriever.invoke(question)
+
+        for question in questions:
+            conversation = system.fork()
+            with timer.measure("answer"):
+                result = conversation.ask_question(question)
+            if "error" in result:
+                raise RuntimeError(result["error"])
+
+        results["stages"]["retrieve"] = timer.report("retrieve", queries=num_queries)
+        results["stages"]["answer"] = timer.report("answer", queries=num_queries)
+        results["answer_spans"] = system.tracer.stage_summary()
+
+        if concurrent_ingest:
+            del system, writer
+            pipeline_system = DocumentQASystem()
+            shutil.rmtree(persist_directory, ignore_errors=True)
+            with timer.measure("ingest_pipeline"):
+                stats = pipeline_system.build_vectorstore(
+                    files, "Fake", vectorstore_type, CHUNK_SIZE, CHUNK_OVERLAP,
+                    persist_directory=persist_directory, index_engine=index_engine
+                )
+            results["stages"]["ingest_pipeline"] = timer.report("ingest_pipeline", mb=corpus_mb, chunks=stats.chunks)
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="10MB", help="Corpus size, e.g. 10MB, 1GB, 10GB")
+    parser.add_argument("--format", choices=["txt", "pdf", "both"], default="txt")
+    parser.add_argument("--corpus-dir", default=os.path.join(".cache", "bench_corpus"))
+    parser.add_argument("--vectorstore", choices=["FAISS", "Chroma"], default="FAISS")
+    parser.add_argument("--index-engine", default="Flat")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--no-ingest-pipeline", action="store_true",
+                        help="Skip the end-to-end run through the concurrent ingestion pipeline")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    total_bytes = parse_size(args.size)
+    started = time.perf_counter()
+    files = create_corpus(os.path.join(args.corpus_dir, args.format), total_bytes, args.format)
+    generation_seconds = time.perf_counter() - started
+
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {
+            "size": args.size,
+            "format": args.format,
+            "vectorstore": args.vectorstore,
+            "index_engine": args.index_engine,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embed_batch_size": EMBED_BATCH_SIZE,
+            "embedding_dimensions": FAKE_EMBEDDING_DIMENSIONS,
+            "embedding_call_latency": FAKE_EMBEDDING_CALL_LATENCY,
+            "embedding_text_latency": FAKE_EMBEDDING_TEXT_LATENCY,
+            "llm_latency": FAKE_LLM_LATENCY,
+            "queries": args.queries
+        },
+        "corpus_generation_seconds": round(generation_seconds, 2),
+        "import_seconds": measure_imports(args.vectorstore),
+        **run(files, args.vectorstore, args.index_engine, args.queries, not args.no_ingest_pipeline),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
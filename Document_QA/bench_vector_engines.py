@@ -0,0 +1,83 @@
+"""Recall@k vs. latency vs. memory for each FAISS index engine on a synthetic clustered corpus.
+
+    python bench_vector_engines.py --vectors 200000 --dimensions 384
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from vector_engines import INDEX_ENGINES, QUANTIZED_ENGINES, index_memory_bytes, make_faiss_index
+
+
+def synthetic_corpus(num_vectors: int, dimensions: int, num_queries: int, seed: int = 0):
+    # Embeddings cluster by topic, so sample around random centroids rather than uniformly.
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((max(1, num_vectors // 500), dimensions)).astype(np.float32)
+    labels = rng.integers(0, len(centroids), num_vectors + num_queries)
+    vectors = centroids[labels] + 0.35 * rng.standard_normal((len(labels), dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors[:num_vectors], vectors[num_vectors:]
+
+
+def run(num_vectors: int, dimensions: int, num_queries: int, k: int):
+    corpus, queries = synthetic_corpus(num_vectors, dimensions, num_queries)
+
+    exact = faiss.IndexFlatL2(dimensions)
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for engine in INDEX_ENGINES:
+        for exact_rerank in ([False, True] if engine in QUANTIZED_ENGINES else [False]):
+            start = time.perf_counter()
+            index, used_engine = make_faiss_index(engine, corpus, exact_rerank)
+            index.add(corpus)
+            build_seconds = time.perf_counter() - start
+
+            latencies = []
+            found = np.empty_like(truth)
+            for i, query in enumerate(queries):
+                start = time.perf_counter()
+                _, found[i:i + 1] = index.search(query[None, :], k)
+                latencies.append(time.perf_counter() - start)
+
+            recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(num_queries)])
+            results.append({
+                "engine": used_engine,
+                "exact_rerank": exact_rerank,
+                f"recall@{k}": round(float(recall), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+                "bytes_per_vector": round(index_memory_bytes(index) / num_vectors, 1),
+                "build_seconds": round(build_seconds, 2)
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.vectors, args.dimensions, args.queries, args.k)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.vectors} vectors x {args.dimensions} dims, {args.queries} queries")
+    for row in results:
+        engine = row["engine"] + (" + rerank" if row["exact_rerank"] else "")
+        print(f"{engine:<18} recall@{args.k} {row[f'recall@{args.k}']:.3f}  p50 {row['p50_ms']:>7.3f} ms  "
+              f"p95 {row['p95_ms']:>7.3f} ms  {row['bytes_per_vector']:>7.1f} B/vector  "
+              f"build {row['build_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
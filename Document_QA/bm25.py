@@ -0,0 +1,225 @@
+import json
+import re
+import sys
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Keeps error codes, version and section numbers ("E-1042", "3.2.1") as single terms.
+_TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+# Compact once this share of rows belongs to removed documents.
+_COMPACT_RATIO = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.casefold())
+
+
+class BM25Index:
+    """Okapi BM25 over a column-compressed (term -> postings) inverted index held in NumPy arrays.
+
+    Raw term frequencies are appended cheaply; BM25 weights are precomputed for every
+    posting the first time a query runs after a change, so a query only sums the
+    postings of its own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._dead = set()
+
+        self._rows = np.empty(0, dtype=np.int64)
+        self._cols = np.empty(0, dtype=np.int64)
+        self._tfs = np.empty(0, dtype=np.float32)
+        self._doc_len = np.empty(0, dtype=np.float32)
+        self._pending = []
+
+        self._postings = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    def add(self, ids: Sequence[str], texts: Sequence[str]):
+        rows, cols, tfs, lengths = [], [], [], []
+
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                previous = self._id_to_row.get(doc_id)
+                if previous is not None:
+                    self._dead.add(previous)
+
+                row = len(self.doc_ids)
+                self.doc_ids.append(doc_id)
+                self._id_to_row[doc_id] = row
+
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    col = self.vocabulary.setdefault(term, len(self.vocabulary))
+                    rows.append(row)
+                    cols.append(col)
+                    tfs.append(tf)
+                lengths.append(sum(counts.values()))
+
+            self._pending.append((
+                np.asarray(rows, dtype=np.int64),
+                np.asarray(cols, dtype=np.int64),
+                np.asarray(tfs, dtype=np.float32),
+                np.asarray(lengths, dtype=np.float32)
+            ))
+            self._postings = None
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size: the posting arrays plus the vocabulary and document id tables."""
+        with self._lock:
+            arrays = [self._rows, self._cols, self._tfs, self._doc_len, *(self._postings or ())]
+            arrays.extend(array for pending in self._pending for array in pending)
+            total = sum(array.nbytes for array in arrays)
+            total += sys.getsizeof(self.vocabulary) + sum(map(sys.getsizeof, self.vocabulary))
+            total += sys.getsizeof(self.doc_ids) + sum(map(sys.getsizeof, self.doc_ids))
+            total += sys.getsizeof(self._id_to_row)
+        return total
+
+    def remove(self, ids: Sequence[str]):
+        with self._lock:
+            for doc_id in ids:
+                row = self._id_to_row.pop(doc_id, None)
+                if row is not None:
+                    self._dead.add(row)
+            self._postings = None
+
+    def row_mask(self, ids: Sequence[str]) -> np.ndarray:
+        """Bitmap over rows of the given chunk ids, for `search(mask=...)`."""
+        with self._lock:
+            self._flush()
+            mask = np.zeros(len(self.doc_ids), dtype=bool)
+            rows = [self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row]
+        mask[rows] = True
+        return mask
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Top-k chunk ids by BM25; with a `mask` over rows only those chunks are ranked."""
+        with self._lock:
+            if self._postings is None:
+                self._build()
+            indptr, indices, weights = self._postings
+            doc_ids = self.doc_ids
+
+        cols = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+        if not cols:
+            return []
+
+        rows = np.concatenate([indices[indptr[c]:indptr[c + 1]] for c in cols])
+        row_weights = np.concatenate([weights[indptr[c]:indptr[c + 1]] for c in cols])
+        scores = np.bincount(rows, weights=row_weights, minlength=len(doc_ids))
+
+        candidates = np.unique(rows)
+        candidates = candidates[scores[candidates] > 0]
+        if mask is not None:
+            candidates = candidates[candidates < len(mask)]
+            candidates = candidates[mask[candidates]]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [(doc_ids[row], float(scores[row])) for row in candidates]
+
+    def _flush(self):
+        if self._pending:
+            rows, cols, tfs, lengths = zip(*self._pending)
+            self._rows = np.concatenate([self._rows, *rows])
+            self._cols = np.concatenate([self._cols, *cols])
+            self._tfs = np.concatenate([self._tfs, *tfs])
+            self._doc_len = np.concatenate([self._doc_len, *lengths])
+            self._pending = []
+
+        if self.doc_ids and len(self._dead) > _COMPACT_RATIO * len(self.doc_ids):
+            self._compact()
+
+    def _compact(self):
+        alive = self._alive_mask()
+        new_row = np.cumsum(alive) - 1
+        keep = alive[self._rows]
+
+        self._rows = new_row[self._rows[keep]]
+        self._cols = self._cols[keep]
+        self._tfs = self._tfs[keep]
+        self._doc_len = self._doc_len[alive]
+        self.doc_ids = [doc_id for doc_id, is_alive in zip(self.doc_ids, alive) if is_alive]
+        self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        self._dead = set()
+
+    def _alive_mask(self) -> np.ndarray:
+        alive = np.ones(len(self.doc_ids), dtype=bool)
+        if self._dead:
+            alive[np.fromiter(self._dead, dtype=np.int64)] = False
+        return alive
+
+    def _build(self):
+        self._flush()
+        n_terms = len(self.vocabulary)
+        alive = self._alive_mask()
+        live_postings = alive[self._rows]
+
+        n_docs = max(int(alive.sum()), 1)
+        avg_len = float(self._doc_len[alive].mean()) if alive.any() else 1.0
+        df = np.bincount(self._cols[live_postings], minlength=n_terms)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len[self._rows] / max(avg_len, 1e-9))
+        weights = idf[self._cols] * self._tfs * (self.k1 + 1) / (self._tfs + norm)
+        weights = np.where(live_postings, weights, 0.0).astype(np.float32)
+
+        order = np.argsort(self._cols, kind="stable")
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._cols, minlength=n_terms), out=indptr[1:])
+        self._postings = (indptr, self._rows[order], weights[order])
+
+    def copy(self) -> "BM25Index":
+        with self._lock:
+            self._flush()
+            clone = BM25Index(self.k1, self.b)
+            clone.vocabulary = dict(self.vocabulary)
+            clone.doc_ids = list(self.doc_ids)
+            clone._id_to_row = dict(self._id_to_row)
+            clone._dead = set(self._dead)
+            clone._rows = self._rows.copy()
+            clone._cols = self._cols.copy()
+            clone._tfs = self._tfs.copy()
+            clone._doc_len = self._doc_len.copy()
+        return clone
+
+    def save(self, path: str):
+        with self._lock:
+            self._flush()
+            if self._dead:
+                self._compact()
+            np.savez(f"{path}.npz", rows=self._rows, cols=self._cols, tfs=self._tfs, doc_len=self._doc_len)
+            with open(f"{path}.json", "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "vocabulary": list(self.vocabulary),
+                           "doc_ids": self.doc_ids}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        try:
+            with open(f"{path}.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = np.load(f"{path}.npz", allow_pickle=False)
+        except FileNotFoundError:
+            return None
+
+        index = cls(meta["k1"], meta["b"])
+        index.vocabulary = {term: col for col, term in enumerate(meta["vocabulary"])}
+        index.doc_ids = meta["doc_ids"]
+        index._id_to_row = {doc_id: row for row, doc_id in enumerate(index.doc_ids)}
+        index._rows = arrays["rows"]
+        index._cols = arrays["cols"]
+        index._tfs = arrays["tfs"]
+        index._doc_len = arrays["doc_len"]
+        return index
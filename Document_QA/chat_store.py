@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHAT_STORE_PATH = os.getenv("CHAT_STORE_PATH", "chat_history.sqlite3")
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+CHAT_TURN_PAGE_SIZE = int(os.getenv("CHAT_TURN_PAGE_SIZE", "50"))
+CHAT_WINDOW_SIZE = int(os.getenv("CHAT_WINDOW_SIZE", "20"))
+
+_TURN_COLUMNS = ("question", "answer", "sources", "timestamp", "position")
+
+
+class ChatStore:
+    """Append-only conversation store: one SQLite row per question/answer turn, searchable with FTS5."""
+
+    def __init__(self, path: str = CHAT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL DEFAULT '',
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                turn_count INTEGER NOT NULL DEFAULT 0,
+                source TEXT UNIQUE
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at);
+
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY,
+                conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                extra TEXT NOT NULL,
+                UNIQUE (conversation_id, position)
+            );
+        """)
+
+        try:
+            self._conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts
+                    USING fts5 (question, answer, content='turns', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+                    INSERT INTO turns_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer);
+                END;
+                CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+                    INSERT INTO turns_fts (turns_fts, rowid, question, answer)
+                        VALUES ('delete', old.id, old.question, old.answer);
+                END;
+            """)
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE scans.
+            self.full_text_search = False
+
+    def create_conversation(self, title: str = "", created_at: str = None, source: str = None) -> int:
+        created_at = created_at or datetime.now().isoformat()
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO conversations (title, created_at, updated_at, source) VALUES (?, ?, ?, ?)",
+                (title, created_at, created_at, source)
+            ).lastrowid
+
+    def append_turn(self, conversation_id: int, chat: Dict[str, Any]) -> int:
+        return self.append_turns(conversation_id, [chat])
+
+    def append_turns(self, conversation_id: int, chats: List[Dict[str, Any]]) -> int:
+        if not chats:
+            return 0
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                position, title = self._conn.execute(
+                    "SELECT turn_count, title FROM conversations WHERE id = ?", (conversation_id,)
+                ).fetchone()
+
+                rows = []
+                for offset, chat in enumerate(chats):
+                    timestamp = chat.get("timestamp") or datetime.now().isoformat()
+                    extra = {k: v for k, v in chat.items() if k not in _TURN_COLUMNS}
+                    rows.append((conversation_id, position + offset, chat.get("question", ""),
+                                 chat.get("answer", ""), json.dumps(chat.get("sources", []), ensure_ascii=False),
+                                 timestamp, json.dumps(extra, ensure_ascii=False, default=str)))
+                self._conn.executemany(
+                    "INSERT INTO turns (conversation_id, position, question, answer, sources, timestamp, extra) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+                self._conn.execute(
+                    "UPDATE conversations SET turn_count = ?, updated_at = ?, title = ? WHERE id = ?",
+                    (position + len(rows), rows[-1][5], title or rows[0][2][:80], conversation_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return position + len(rows)
+
+    def list_conversations(self, query: str = None, offset: int = 0,
+                           limit: int = CHAT_PAGE_SIZE) -> List[Dict[str, Any]]:
+        where, params = self._search_filter(query)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, title, created_at, updated_at, turn_count FROM conversations {where} "
+                "ORDER BY updated_at DESC, id DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset]
+            ).fetchall()
+        return [dict(zip(("id", "title", "created_at", "updated_at", "turn_count"), row)) for row in rows]
+
+    def count_conversations(self, query: str = None) -> int:
+        where, params = self._search_filter(query)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM conversations {where}", params).fetchone()[0]
+
+    def _search_filter(self, query: Optional[str]):
+        query = (query or "").strip()
+        if not query:
+            return "WHERE turn_count > 0", []
+        if self.full_text_search:
+            # Every word must match as a prefix; quoting keeps FTS5 operators in user input literal.
+            match = " ".join('"' + word.replace('"', '""') + '"*' for word in query.split())
+            return ("WHERE id IN (SELECT conversation_id FROM turns "
+                    "WHERE id IN (SELECT rowid FROM turns_fts WHERE turns_fts MATCH ?))"), [match]
+        pattern = f"%{query}%"
+        return ("WHERE id IN (SELECT conversation_id FROM turns "
+                "WHERE question LIKE ? OR answer LIKE ?)"), [pattern, pattern]
+
+    def load_turns(self, conversation_id: int, before: int = None,
+                   limit: int = CHAT_TURN_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """The latest `limit` turns before position `before` (all of them when limit is None), oldest first."""
+        before = before if before is not None else 2 ** 62
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, question, answer, sources, timestamp, extra FROM turns "
+                "WHERE conversation_id = ? AND position < ? ORDER BY position DESC LIMIT ?",
+                (conversation_id, before, -1 if limit is None else limit)
+            ).fetchall()
+
+        turns = []
+        for position, question, answer, sources, timestamp, extra in reversed(rows):
+            turns.append({**json.loads(extra), "question": question, "answer": answer,
+                          "sources": json.loads(sources), "timestamp": timestamp, "position": position})
+        return turns
+
+    def delete_conversation(self, conversation_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def migrate_pickles(self, directory: str = ".") -> int:
+        """Imports chat_history*.pkl files written by earlier versions; each file is imported once and left in place."""
+        try:
+            names = sorted(f for f in os.listdir(directory) if f.startswith("chat_history") and f.endswith(".pkl"))
+        except OSError:
+            return 0
+
+        with self._lock:
+            migrated = {row[0] for row in self._conn.execute("SELECT source FROM conversations WHERE source IS NOT NULL")}
+
+        imported = 0
+        for name in names:
+            if name in migrated:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, "rb") as f:
+                    history = pickle.load(f)
+            except Exception as e:
+                logger.warning("Could not migrate %s: %s", path, e)
+                continue
+
+            created_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+            conversation_id = self.create_conversation(created_at=created_at, source=name)
+            self.append_turns(conversation_id, [chat for chat in history if isinstance(chat, dict)])
+            imported += 1
+        return imported
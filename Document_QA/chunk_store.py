@@ -0,0 +1,415 @@
+import json
+import mmap
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+# Ids added since the sorted lookup arrays were last rebuilt stay in a dict until there are this many.
+_LOOKUP_MERGE_MIN = 4096
+_MISSING = -(2 ** 63)
+_ID_KEY = "chunk_id"
+
+_TEXTS_FILE = "chunks.bin"
+_ARRAYS_FILE = "chunks.npz"
+_COLUMNS_FILE = "chunks.json"
+
+
+def _sorted_lookup(hashes: np.ndarray, rows: np.ndarray) -> Tuple[array, array]:
+    # array("q") rather than numpy: bisect on it is several times faster than a scalar np.searchsorted.
+    order = np.argsort(hashes, kind="stable")
+    return array("q", hashes[order].tobytes()), array("q", rows[order].tobytes())
+
+
+class _Column:
+    """One metadata key over all rows: integers as int64, everything else as codes into interned values."""
+
+    def __init__(self, kind: str, values: List[Any] = None):
+        self.kind = kind
+        self.data = array("q")
+        self.values = values or []
+        self._codes = {self._intern_key(value): code for code, value in enumerate(self.values)}
+
+    @staticmethod
+    def kind_of(value) -> str:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return "int"
+        return "str" if isinstance(value, str) else "json"
+
+    def _intern_key(self, value):
+        return json.dumps(value, sort_keys=True) if self.kind == "json" else value
+
+    def encode(self, value) -> int:
+        if self.kind == "int":
+            return value
+        key = self._intern_key(value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, stored: int):
+        return stored if self.kind == "int" else self.values[stored]
+
+    def widen(self):
+        """Re-encodes the column as interned JSON values once a value of another type shows up."""
+        stored = [_MISSING if value == _MISSING else self.decode(value) for value in self.data]
+        self.kind = "json"
+        self.data = array("q")
+        self.values = []
+        self._codes = {}
+        for value in stored:
+            self.data.append(_MISSING if value is _MISSING else self.encode(value))
+
+    def copy(self) -> "_Column":
+        column = _Column(self.kind, list(self.values))
+        column.data = array("q", self.data)
+        return column
+
+    def memory_bytes(self) -> int:
+        return (self.data.itemsize * len(self.data) + sys.getsizeof(self.values) + sys.getsizeof(self._codes)
+                + sum(sys.getsizeof(value) for value in self.values))
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """Compact FAISS docstore: chunk texts in one offset-indexed buffer, metadata in columnar arrays.
+
+    A loaded store memory-maps the text file of its index version, so the texts live in the OS page
+    cache shared by every process instead of in Python strings. Metadata values that repeat across
+    chunks (source file, upload time, file hash, section) are interned once per store and each row
+    keeps an integer code. Rows are appended and tombstoned, never rewritten; `save` compacts.
+    `Document` objects are only built by `search`, i.e. for the hits of a query.
+    """
+
+    def __init__(self):
+        self._base = b""
+        self._base_size = 0
+        self._tail = bytearray()
+        self._text_offsets = array("q", [0])
+        self._ids = bytearray()
+        self._id_offsets = array("q", [0])
+        self._alive = bytearray()
+        self._has_chunk_id = bytearray()
+        self._columns: Dict[str, _Column] = {}
+        self._live_count = 0
+
+        self._lookup = (array("q"), array("q"))
+        self._recent: Dict[str, int] = {}
+        self._lookup_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    @property
+    def rows(self) -> int:
+        """Rows ever added, including deleted ones until the next save."""
+        return len(self._alive)
+
+    # Rows
+
+    def chunk_id(self, row: int) -> str:
+        return self._ids[self._id_offsets[row]:self._id_offsets[row + 1]].decode("utf-8")
+
+    def text(self, row: int) -> str:
+        start, end = self._text_offsets[row], self._text_offsets[row + 1]
+        if end <= self._base_size:
+            return self._base[start:end].decode("utf-8")
+        return self._tail[start - self._base_size:end - self._base_size].decode("utf-8")
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        metadata = {}
+        for key, column in self._columns.items():
+            stored = column.data[row]
+            if stored != _MISSING:
+                metadata[key] = column.decode(stored)
+        if self._has_chunk_id[row]:
+            metadata[_ID_KEY] = self.chunk_id(row)
+        return metadata
+
+    def alive(self) -> np.ndarray:
+        """Bitmap over rows of the chunks not deleted."""
+        return np.frombuffer(bytes(self._alive), dtype=bool).copy()
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row), metadata=self.metadata(row))
+
+    def column(self, key: str) -> Optional[Tuple[str, np.ndarray, List[Any]]]:
+        """(kind, per-row values or codes with -2**63 for missing, interned values) of a metadata key."""
+        column = self._columns.get(key)
+        if column is None:
+            return None
+        return column.kind, np.array(column.data, dtype=np.int64), column.values
+
+    def _append(self, chunk_id: str, doc: Document):
+        row = len(self._alive)
+        text = doc.page_content.encode("utf-8")
+        self._tail += text
+        self._text_offsets.append(self._text_offsets[-1] + len(text))
+        encoded_id = chunk_id.encode("utf-8")
+        self._ids += encoded_id
+        self._id_offsets.append(self._id_offsets[-1] + len(encoded_id))
+        self._alive.append(1)
+        self._has_chunk_id.append(int(doc.metadata.get(_ID_KEY) == chunk_id))
+
+        for key, value in doc.metadata.items():
+            if key == _ID_KEY and value == chunk_id:
+                continue
+            column = self._columns.get(key)
+            kind = _Column.kind_of(value)
+            if column is None:
+                column = self._columns[key] = _Column(kind)
+                column.data.extend([_MISSING] * row)
+            elif column.kind != kind and column.kind != "json":
+                column.widen()
+            column.data.append(column.encode(value))
+        for column in self._columns.values():
+            if len(column.data) == row:
+                column.data.append(_MISSING)
+
+        self._recent[chunk_id] = row
+        self._live_count += 1
+        return row
+
+    # Id lookup: sorted (hash, row) arrays plus a dict of recent additions, instead of a dict over all ids.
+
+    def row_of(self, chunk_id: str) -> Optional[int]:
+        row = self._recent.get(chunk_id)
+        if row is not None and self._alive[row]:
+            return row
+        hashes, rows = self._lookup
+        key = hash(chunk_id)
+        position = bisect_left(hashes, key)
+        # Hashes can collide, and a deleted id can be added again, leaving the same id on a dead row too.
+        while position < len(hashes) and hashes[position] == key:
+            row = rows[position]
+            if self._alive[row] and self.chunk_id(row) == chunk_id:
+                return row
+            position += 1
+        return None
+
+    def _merge_lookup(self):
+        with self._lookup_lock:
+            if len(self._recent) < max(_LOOKUP_MERGE_MIN, len(self._lookup[1]) // 8):
+                return
+            recent = self._recent
+            hashes = np.fromiter((hash(chunk_id) for chunk_id in recent), dtype=np.int64, count=len(recent))
+            rows = np.fromiter(recent.values(), dtype=np.int64, count=len(recent))
+            hashes = np.concatenate([np.frombuffer(self._lookup[0], dtype=np.int64), hashes])
+            rows = np.concatenate([np.frombuffer(self._lookup[1], dtype=np.int64), rows])
+            self._lookup = _sorted_lookup(hashes, rows)
+            self._recent = {}
+
+    # Docstore interface
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [chunk_id for chunk_id in texts if self.row_of(chunk_id) is not None]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for chunk_id, doc in texts.items():
+            self._append(chunk_id, doc)
+        self._merge_lookup()
+
+    def delete(self, ids: List) -> None:
+        rows = [self.row_of(chunk_id) for chunk_id in ids]
+        missing = [chunk_id for chunk_id, row in zip(ids, rows) if row is None]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for row in rows:
+            self._alive[row] = 0
+        self._live_count -= len(rows)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.row_of(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    # Copies and persistence
+
+    def copy(self) -> "ChunkStore":
+        """An independent store for a new version; the memory-mapped texts are shared, not copied."""
+        store = ChunkStore()
+        store._base, store._base_size = self._base, self._base_size
+        store._tail = bytearray(self._tail)
+        store._text_offsets = array("q", self._text_offsets)
+        store._ids = bytearray(self._ids)
+        store._id_offsets = array("q", self._id_offsets)
+        store._alive = bytearray(self._alive)
+        store._has_chunk_id = bytearray(self._has_chunk_id)
+        store._columns = {key: column.copy() for key, column in self._columns.items()}
+        store._live_count = self._live_count
+        store._lookup = self._lookup
+        store._recent = dict(self._recent)
+        return store
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Tuple[str, Document]]) -> "ChunkStore":
+        store = cls()
+        for chunk_id, doc in documents:
+            store._append(chunk_id, doc)
+            if len(store._recent) >= _LOOKUP_MERGE_MIN:
+                store._merge_lookup()
+        return store
+
+    def save(self, path: str, rows: Iterable[int]):
+        """Writes `rows`, in that order, as the chunks of a version directory; a load numbers them from 0."""
+        rows = np.fromiter(rows, dtype=np.int64)
+        text_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        id_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        ids = bytearray()
+
+        with open(os.path.join(path, _TEXTS_FILE), "wb") as f:
+            for position, row in enumerate(rows.tolist()):
+                text = self.text(row).encode("utf-8")
+                f.write(text)
+                text_offsets[position + 1] = text_offsets[position] + len(text)
+                ids += self._ids[self._id_offsets[row]:self._id_offsets[row + 1]]
+                id_offsets[position + 1] = len(ids)
+
+        arrays = {"text_offsets": text_offsets, "id_offsets": id_offsets,
+                  "ids": np.frombuffer(bytes(ids), dtype=np.uint8),
+                  "has_chunk_id": np.frombuffer(bytes(self._has_chunk_id), dtype=np.uint8)[rows],
+                  # Deleted chunks still in an HNSW/IVF index keep their position until it is compacted.
+                  "alive": np.frombuffer(bytes(self._alive), dtype=np.uint8)[rows]}
+        columns = {}
+        for number, (key, column) in enumerate(self._columns.items()):
+            arrays[f"column_{number}"] = np.array(column.data, dtype=np.int64)[rows]
+            columns[key] = {"kind": column.kind, "array": f"column_{number}", "values": column.values}
+
+        np.savez(os.path.join(path, _ARRAYS_FILE), **arrays)
+        with open(os.path.join(path, _COLUMNS_FILE), "w", encoding="utf-8") as f:
+            json.dump(columns, f, ensure_ascii=False)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, _COLUMNS_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkStore":
+        store = cls()
+        with open(os.path.join(path, _TEXTS_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                store._base = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                store._base_size = size
+
+        with np.load(os.path.join(path, _ARRAYS_FILE)) as arrays:
+            store._text_offsets = array("q", arrays["text_offsets"].tobytes())
+            store._id_offsets = array("q", arrays["id_offsets"].tobytes())
+            store._ids = bytearray(arrays["ids"].tobytes())
+            store._has_chunk_id = bytearray(arrays["has_chunk_id"].tobytes())
+            count = len(store._id_offsets) - 1
+            store._alive = bytearray(arrays["alive"].tobytes() if "alive" in arrays else b"\x01" * count)
+            with open(os.path.join(path, _COLUMNS_FILE), encoding="utf-8") as f:
+                for key, spec in json.load(f).items():
+                    column = store._columns[key] = _Column(spec["kind"], spec["values"])
+                    column.data = array("q", arrays[spec["array"]].tobytes())
+
+        store._live_count = store._alive.count(1)
+        hashes = np.fromiter((hash(store.chunk_id(row)) for row in range(count)), dtype=np.int64, count=count)
+        store._lookup = _sorted_lookup(hashes, np.arange(count, dtype=np.int64))
+        return store
+
+    def memory_bytes(self) -> int:
+        """Bytes held in process memory; the memory-mapped texts are file-backed and not included."""
+        total = (len(self._tail) + len(self._ids) + len(self._alive) + len(self._has_chunk_id)
+                 + self._text_offsets.itemsize * len(self._text_offsets)
+                 + self._id_offsets.itemsize * len(self._id_offsets)
+                 + 8 * (len(self._lookup[0]) + len(self._lookup[1])) + sys.getsizeof(self._recent))
+        return total + sum(column.memory_bytes() for column in self._columns.values())
+
+    def mapped_bytes(self) -> int:
+        return self._base_size
+
+
+class PositionMap:
+    """FAISS position -> chunk id, as an int64 array of store rows instead of a dict of strings.
+
+    Implements the parts of the dict interface that LangChain's FAISS wrapper uses.
+    """
+
+    def __init__(self, store: ChunkStore, rows: array = None):
+        self.store = store
+        self.rows = rows if rows is not None else array("q")
+        self._alive_key = None
+        self._alive_cache = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < len(self.rows):
+            raise KeyError(position)
+        return self.store.chunk_id(self.rows[position])
+
+    def __contains__(self, position) -> bool:
+        return isinstance(position, (int, np.integer)) and 0 <= position < len(self.rows)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self.rows)))
+
+    def get(self, position: int, default=None):
+        return self[position] if position in self else default
+
+    def keys(self):
+        return range(len(self.rows))
+
+    def values(self) -> Iterator[str]:
+        return (self.store.chunk_id(row) for row in self.rows)
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        return ((position, self.store.chunk_id(row)) for position, row in enumerate(self.rows))
+
+    def update(self, mapping: Dict[int, str]):
+        # FAISS.add_embeddings appends positions len(self).. for the ids it just added to the store.
+        for position, chunk_id in sorted(mapping.items()):
+            if position != len(self.rows):
+                raise ValueError(f"Positions must be appended in order, got {position} at {len(self.rows)}")
+            row = self.store.row_of(chunk_id)
+            if row is None:
+                raise KeyError(chunk_id)
+            self.rows.append(row)
+
+    def positions(self, ids: List[str]) -> np.ndarray:
+        rows = np.array([self.store.row_of(chunk_id) for chunk_id in ids if self.store.row_of(chunk_id) is not None],
+                        dtype=np.int64)
+        position_of_row = np.full(self.store.rows, -1, dtype=np.int64)
+        position_of_row[np.array(self.rows, dtype=np.int64)] = np.arange(len(self.rows))
+        positions = position_of_row[rows]
+        return positions[positions >= 0]
+
+    def remove(self, positions: np.ndarray):
+        """Drops positions; the remaining ones are renumbered in order, like the index they mirror."""
+        keep = np.ones(len(self.rows), dtype=bool)
+        keep[positions] = False
+        self.rows = array("q", np.array(self.rows, dtype=np.int64)[keep].tobytes())
+
+    def alive(self) -> Optional[np.ndarray]:
+        """Bitmap of the positions whose chunk is live, or None when all of them are.
+
+        delete_vectors tombstones the chunks of graph and IVF indexes instead of removing their vectors,
+        so their positions stay in the index until it is compacted.
+        """
+        key = (len(self.rows), self.store.rows, len(self.store))
+        if self._alive_key != key:
+            alive = self.store.alive()[np.frombuffer(self.rows, dtype=np.int64)] if self.rows else None
+            self._alive_cache = None if alive is None or alive.all() else alive
+            self._alive_key = key
+        return self._alive_cache
+
+    def dead_count(self) -> int:
+        alive = self.alive()
+        return 0 if alive is None else len(alive) - int(np.count_nonzero(alive))
+
+    def copy(self, store: ChunkStore) -> "PositionMap":
+        return PositionMap(store, array("q", self.rows))
+
+    def memory_bytes(self) -> int:
+        return self.rows.itemsize * len(self.rows)
@@ -0,0 +1,48 @@
+"""The FAISS vector store over a ChunkStore; imported only when a FAISS index is opened or built."""
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from vector_engines import search_positions
+
+
+class ChunkStoreFAISS(FAISS):
+    """FAISS over a ChunkStore whose searches skip the positions of tombstoned (deleted) chunks."""
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Union[Callable, Dict[str, Any]]] = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        alive = self.index_to_docstore_id.alive()
+        if alive is None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter, fetch_k, **kwargs)
+
+        import faiss
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, positions = search_positions(self.index, vector, k if filter is None else fetch_k, alive)
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        docs = []
+        for score, position in zip(scores[0].tolist(), positions[0].tolist()):
+            if position == -1:
+                continue
+            doc = self.docstore.document(self.index_to_docstore_id.rows[position])
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, score))
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            similar_above = self.distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+            cmp = operator.ge if similar_above else operator.le
+            docs = [(doc, score) for doc, score in docs if cmp(score, score_threshold)]
+        return docs[:k]
@@ -0,0 +1,238 @@
+"""Conversation memory that keeps per-turn cost flat: question condensation is skipped for self-contained
+questions and cached otherwise, and the history is a token-bounded window whose evicted turns are folded
+into a running summary on a background thread instead of on the request path.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.chains import LLMChain
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.pydantic_v1 import PrivateAttr
+
+from embedding_scheduler import make_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Tokens of recent messages kept verbatim; older turns are summarized.
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", "1000"))
+CONDENSE_CACHE_SIZE = int(os.getenv("CONDENSE_CACHE_SIZE", "1024"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+# Shorter follow-ups ("and the second one?", "neden?") lean on the conversation for their meaning.
+SELF_CONTAINED_MIN_WORDS = 4
+
+# Words that point back into the conversation (English and Turkish).
+_REFERRING_WORDS = {
+    "it", "its", "they", "them", "their", "theirs", "this", "that", "these", "those", "he", "she", "him", "her", "his",
+    "there", "here", "former", "latter", "above", "aforementioned", "previous", "earlier", "same", "else",
+    "bu", "şu", "o", "bunu", "şunu", "onu", "bunun", "şunun", "onun", "bunlar", "şunlar", "onlar", "bunları",
+    "onları", "bunda", "onda", "burada", "orada", "aynı", "yukarıdaki", "önceki", "öbürü", "diğeri"
+}
+# Openings of follow-ups that continue the previous answer.
+_CONTINUATIONS = (
+    "and ", "but ", "also ", "so ", "then ", "what about", "how about", "why not", "more ", "tell me more",
+    "elaborate", "continue", "go on", "ve ", "ama ", "peki", "ya ", "ayrıca", "daha fazla", "devam"
+)
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def is_self_contained(question: str) -> bool:
+    """Whether the question can be answered without the conversation, so it needs no condensation.
+
+    Conservative: a question is only treated as standalone when it is long enough and has no
+    pronouns, back references or continuation openings; anything else is condensed as before.
+    """
+    text = question.strip().lower()
+    words = _WORD.findall(text)
+    if len(words) < SELF_CONTAINED_MIN_WORDS:
+        return False
+    if text.startswith(_CONTINUATIONS):
+        return False
+    return not any(word in _REFERRING_WORDS for word in words)
+
+
+class CondensedQuestionCache:
+    """Standalone questions keyed by the chat history and follow-up they were condensed from (LRU)."""
+
+    def __init__(self, max_entries: int = CONDENSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(chat_history: str, question: str) -> str:
+        normalized = " ".join(question.lower().split())
+        return hashlib.sha256(f"{chat_history}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, chat_history: str, question: str) -> Optional[str]:
+        key = self._key(chat_history, question)
+        with self._lock:
+            standalone = self._entries.get(key)
+            if standalone is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return standalone
+
+    def put(self, chat_history: str, question: str, standalone: str):
+        with self._lock:
+            self._entries[self._key(chat_history, question)] = standalone
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_condense_cache = None
+_condense_cache_lock = threading.Lock()
+
+
+def get_condense_cache() -> CondensedQuestionCache:
+    # One cache per process: sessions that start alike (e.g. from a cached first answer) share follow-ups.
+    global _condense_cache
+    with _condense_cache_lock:
+        if _condense_cache is None:
+            _condense_cache = CondensedQuestionCache()
+        return _condense_cache
+
+
+class CondenseQuestionChain(LLMChain):
+    """The question generator of ConversationalRetrievalChain, calling the LLM only when it has to."""
+
+    cache: Any = None
+
+    def _call(self, inputs: Dict[str, Any], run_manager=None) -> Dict[str, str]:
+        question = inputs["question"]
+        if is_self_contained(question):
+            return {self.output_key: question}
+
+        chat_history = inputs["chat_history"]
+        standalone = self.cache.get(chat_history, question) if self.cache is not None else None
+        if standalone is not None:
+            return {self.output_key: standalone}
+
+        output = super()._call(inputs, run_manager)
+        if self.cache is not None:
+            self.cache.put(chat_history, question, output[self.output_key].strip())
+        return output
+
+
+_summary_executor = None
+_summary_executor_lock = threading.Lock()
+
+
+def _get_summary_executor() -> ThreadPoolExecutor:
+    global _summary_executor
+    with _summary_executor_lock:
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="memory-summary")
+        return _summary_executor
+
+
+class RollingSummaryMemory(BaseChatMemory):
+    """Recent messages up to `max_token_limit` tokens, preceded by a summary of everything older.
+
+    Turns pushed out of the window are handed to a background thread that folds them into the
+    summary, so saving a turn and loading the history never wait for an LLM call. Until a fold
+    finishes, the history simply lacks the evicted turns.
+    """
+
+    llm: Any = None
+    max_token_limit: int = MEMORY_TOKEN_LIMIT
+    memory_key: str = "chat_history"
+    summary: str = ""
+    count_tokens: Callable[[str], int] = None
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _backlog: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _summarizing: bool = PrivateAttr(default=False)
+    _generation: int = PrivateAttr(default=0)
+    _summarized: Any = PrivateAttr(default_factory=threading.Event)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.count_tokens is None:
+            self.count_tokens = make_token_counter()
+        self._summarized.set()
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            messages = list(self.chat_memory.messages)
+            summary = self.summary
+        if summary:
+            messages = [SystemMessage(content=summary)] + messages
+        return {self.memory_key: messages if self.return_messages else get_buffer_string(messages)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]):
+        with self._lock:
+            super().save_context(inputs, outputs)
+            evicted = self._prune()
+            if not evicted or self.llm is None:
+                return
+            self._backlog.extend(evicted)
+            if self._summarizing:
+                return
+            self._summarizing = True
+            self._summarized.clear()
+        _get_summary_executor().submit(self._summarize)
+
+    def _prune(self) -> List[BaseMessage]:
+        messages = self.chat_memory.messages
+        evicted = []
+        # Whole turns leave the window, and the latest turn always stays.
+        while len(messages) > 2 and self.count_tokens(get_buffer_string(messages)) > self.max_token_limit:
+            evicted.extend(messages[:2])
+            del messages[:2]
+        return evicted
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                batch, self._backlog = self._backlog, []
+                if not batch:
+                    self._summarizing = False
+                    self._summarized.set()
+                    return
+                summary = self.summary
+                generation = self._generation
+
+            try:
+                prompt = SUMMARY_PROMPT.format(summary=summary, new_lines=get_buffer_string(batch))
+                result = self.llm.invoke(prompt)
+                new_summary = str(getattr(result, "content", result)).strip()
+            except Exception as e:
+                # The turns drop out of the history; the conversation itself goes on.
+                logger.warning("Conversation summary failed: %s", e)
+                continue
+
+            with self._lock:
+                if generation == self._generation:
+                    self.summary = new_summary
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until pending summaries are folded in; for tests and shutdown."""
+        return self._summarized.wait(timeout)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.summary = ""
+            self._backlog = []
+            # A summary still running for the old conversation is discarded when it returns.
+            self._generation += 1
@@ -152,6 +152,35 @@ def create_sample_pdf():
     return filename
 
 
+def create_large_pdf(filename: str = None, target_bytes: int = 10 * 1024 * 1024, seed: int = 0):
+    """Yaklaşık target_bytes kadar metin içeren sentetik PDF dosyası oluşturur"""
+
+    from xml.sax.saxutils import escape
+    from create_sample_txt import synthetic_sections
+
+    filename = filename or f"buyuk_dokuman_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    styles = getSampleStyleSheet()
+
+    story = []
+    written = 0
+    for number, (heading, body) in enumerate(synthetic_sections(seed), start=1):
+        story.append(Paragraph(escape(heading), styles['Heading2']))
+        for paragraph in body:
+            story.append(Paragraph(escape(paragraph), styles['Normal']))
+            story.append(Spacer(1, 6))
+            written += len(paragraph.encode('utf-8'))
+
+        # Her üç bölümde bir yeni sayfa
+        if number % 3 == 0:
+            story.append(PageBreak())
+        if written >= target_bytes:
+            break
+
+    doc.build(story)
+    return filename
+
+
 if __name__ == "__main__":
     # PDF oluştur
     try:
@@ -1,13 +1,9 @@
 # Örnek TXT dosyası oluşturucu
+import random
 from datetime import datetime
 
 
-def create_sample_txt():
-    """Test için örnek TXT dosyası oluşturur"""
-
-    filename = f"ornek_metin_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-
-    content = """PYTHON PROGRAMLAMA DİLİ HAKKINDA
+SAMPLE_TEXT = """PYTHON PROGRAMLAMA DİLİ HAKKINDA
 
 Python, 1991 yılında Guido van Rossum tarafından geliştirilen yüksek seviyeli bir programlama dilidir. 
 Basit sözdizimi ve güçlü kütüphaneleri sayesinde hem yeni başlayanlar hem de profesyoneller 
@@ -121,7 +117,15 @@ geniş bir yelpazede kullanım alanı bulur.
 Bu döküman, Python programlama dili hakkında temel bilgileri içermektedir 
 ve soru-cevap sisteminizi test etmek için hazırlanmıştır.
 
-Oluşturulma Tarihi: """ + datetime.now().strftime('%d.%m.%Y %H:%M') + """
+"""
+
+
+def create_sample_txt():
+    """Test için örnek TXT dosyası oluşturur"""
+
+    filename = f"ornek_metin_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+
+    content = SAMPLE_TEXT + """Oluşturulma Tarihi: """ + datetime.now().strftime('%d.%m.%Y %H:%M') + """
 Test Amaçlı Doküman
 """
 
@@ -131,6 +135,42 @@ Test Amaçlı Doküman
     return filename
 
 
+def synthetic_sections(seed: int = 0):
+    """Örnek metnin cümlelerinden sınırsız sayıda benzersiz bölüm üretir (büyük test korpusları için)"""
+
+    rng = random.Random(seed)
+    paragraphs = [p.strip() for p in SAMPLE_TEXT.split("\n\n") if p.strip()]
+    headings = [p for p in paragraphs if p.isupper()]
+    sentences = [sentence.strip() for p in paragraphs if not p.isupper()
+                 for sentence in p.replace("\n", " ").split(". ") if sentence.strip()]
+
+    number = 0
+    while True:
+        number += 1
+        body = []
+        for _ in range(rng.randint(3, 6)):
+            chosen = rng.sample(sentences, rng.randint(2, 5))
+            body.append(". ".join(c.rstrip(".") for c in chosen) + f". (Kayıt {number}-{rng.randint(1000, 999999)})")
+        yield f"BÖLÜM {number}: {rng.choice(headings)}", body
+
+
+def create_large_txt(filename: str = None, target_bytes: int = 10 * 1024 * 1024, seed: int = 0):
+    """Yaklaşık target_bytes boyutunda sentetik TXT dosyası oluşturur"""
+
+    filename = filename or f"buyuk_metin_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+
+    written = 0
+    with open(filename, 'w', encoding='utf-8') as f:
+        for heading, body in synthetic_sections(seed):
+            section = heading + "\n\n" + "\n\n".join(body) + "\n\n"
+            f.write(section)
+            written += len(section.encode('utf-8'))
+            if written >= target_bytes:
+                break
+
+    return filename
+
+
 if __name__ == "__main__":
     filename = create_sample_txt()
     print(f"✅ Örnek TXT dosyası oluşturuldu: {filename}")
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "64000"))
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "1000000"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_LOCAL_WORKERS = int(os.getenv("EMBEDDING_LOCAL_WORKERS", "2"))
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def make_token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return lambda text: max(1, len(text) // 4)
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute token bucket, shared by every scheduler on one key."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+            if now < self._blocked_until:
+                return self._blocked_until - now
+
+            # A batch larger than the whole budget still has to be sent eventually.
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0.0
+
+            return max((1 - self._requests) * 60 / self.requests_per_minute,
+                       (tokens - self._tokens) * 60 / self.tokens_per_minute)
+
+    async def acquire(self, tokens: int):
+        while True:
+            delay = self._reserve(tokens)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def block(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(key: str, requests_per_minute: int, tokens_per_minute: int) -> RateLimiter:
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return limiter
+
+
+class ScheduledEmbeddings(Embeddings):
+    """Embeds large chunk lists as token-budgeted batches, several at a time.
+
+    Remote models are called through their async API under a shared RPM/TPM budget;
+    local models run on a thread pool. Failed batches are retried on their own with
+    exponential backoff instead of failing the whole corpus.
+    """
+
+    def __init__(self, underlying: Embeddings, rate_limiter: Optional[RateLimiter] = None,
+                 max_concurrency: int = EMBEDDING_CONCURRENCY, max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_batch_tokens: int = EMBEDDING_BATCH_TOKENS, max_retries: int = EMBEDDING_MAX_RETRIES,
+                 local_workers: Optional[int] = None):
+        self.underlying = underlying
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.count_tokens = make_token_counter()
+        self.executor = ThreadPoolExecutor(max_workers=local_workers) if local_workers else None
+
+        self.chunks_embedded = 0
+        self.busy_seconds = 0.0
+        self.retries = 0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks_embedded / self.busy_seconds if self.busy_seconds else 0.0
+
+    def make_batches(self, texts: List[str]) -> List[Tuple[List[int], int]]:
+        batches = []
+        current = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if current and (len(current) >= self.max_batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append((current, current_tokens))
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    async def _embed_batch(self, texts: List[str], tokens: int, semaphore: asyncio.Semaphore) -> List[List[float]]:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(tokens)
+                try:
+                    if self.executor is not None:
+                        loop = asyncio.get_running_loop()
+                        return await loop.run_in_executor(self.executor, self.underlying.embed_documents, texts)
+                    return await self.underlying.aembed_documents(texts)
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    delay = _retry_after(e) or min(60.0, 2 ** attempt) * (0.5 + random.random())
+                    if _is_rate_limit(e) and self.rate_limiter is not None:
+                        self.rate_limiter.block(delay)
+                    await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(*[
+            self._embed_batch([texts[i] for i in indices], tokens, semaphore) for indices, tokens in batches
+        ])
+
+        vectors = [None] * len(texts)
+        for (indices, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+
+        self.chunks_embedded += len(texts)
+        self.busy_seconds += time.perf_counter() - started
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_documents(texts))
+
+        # Called from inside a running event loop: run on a helper thread with its own loop.
+        with ThreadPoolExecutor(max_workers=1) as helper:
+            return helper.submit(asyncio.run, self.aembed_documents(texts)).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.executor is not None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.underlying.embed_query, text)
+        return await self.underlying.aembed_query(text)
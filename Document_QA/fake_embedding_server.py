@@ -0,0 +1,94 @@
+# Local OpenAI-compatible embedding server for testing the embedding scheduler offline.
+#
+#   python fake_embedding_server.py --port 8765 --rate-limit-every 10
+#   OPENAI_BASE_URL=http://localhost:8765/v1 OPENAI_API_KEY=fake streamlit run main.py
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(value, dimensions: int):
+    seed = hashlib.sha256(json.dumps(value).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def make_handler(dimensions: int, latency: float, rate_limit_every: int):
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                self._reply(404, {"error": {"message": "not found"}})
+                return
+
+            with lock:
+                counter["requests"] += 1
+                request_number = counter["requests"]
+
+            if rate_limit_every and request_number % rate_limit_every == 0:
+                self._reply(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                            headers={"retry-after": "1"})
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = body["input"]
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+
+            time.sleep(latency)
+
+            data = []
+            for i, value in enumerate(inputs):
+                vector = fake_vector(value, dimensions)
+                if body.get("encoding_format") == "base64":
+                    vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+                data.append({"object": "embedding", "index": i, "embedding": vector})
+
+            tokens = sum(len(v) if isinstance(v, list) else len(v) // 4 for v in inputs)
+            self._reply(200, {
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "fake"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+
+        def _reply(self, status: int, payload: dict, headers: dict = None):
+            content = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeEmbeddingHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI embedding server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with 429")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port),
+                                 make_handler(args.dimensions, args.latency, args.rate_limit_every))
+    print(f"Fake embedding server: http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,49 @@
+import os
+import time
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from bm25 import tokenize
+
+FAKE_EMBEDDING_DIMENSIONS = int(os.getenv("FAKE_EMBEDDING_DIMENSIONS", "384"))
+# Simulated model cost: seconds per embedding call plus seconds per text in it.
+FAKE_EMBEDDING_CALL_LATENCY = float(os.getenv("FAKE_EMBEDDING_CALL_LATENCY", "0"))
+FAKE_EMBEDDING_TEXT_LATENCY = float(os.getenv("FAKE_EMBEDDING_TEXT_LATENCY", "0"))
+# Seconds per streamed character of the fake answer.
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))
+
+FAKE_ANSWER = ("Bu cevap, performans ölçümü için sahte dil modeli tarafından üretilmiştir; "
+               "ilgili bilgiler kaynak dokümanlarda yer almaktadır.")
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embeddings: a feature-hashed bag of words, so texts sharing words stay close."""
+
+    def __init__(self, dimensions: int = FAKE_EMBEDDING_DIMENSIONS, call_latency: float = FAKE_EMBEDDING_CALL_LATENCY,
+                 text_latency: float = FAKE_EMBEDDING_TEXT_LATENCY):
+        self.dimensions = dimensions
+        self.call_latency = call_latency
+        self.text_latency = text_latency
+
+    def _embed(self, text: str) -> List[float]:
+        hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokenize(text)), dtype=np.uint32)
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        np.add.at(vector, hashes % self.dimensions, np.where(hashes & 0x80000000, 1.0, -1.0))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.call_latency or self.text_latency:
+            time.sleep(self.call_latency + self.text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def make_fake_llm(latency: float = FAKE_LLM_LATENCY):
+    return FakeListChatModel(responses=[FAKE_ANSWER], sleep=latency or None)
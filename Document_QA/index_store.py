@@ -0,0 +1,385 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from bm25 import BM25Index
+from chunk_store import ChunkStore, PositionMap
+from vector_engines import TRAIN_SIZE, make_faiss_index, requires_training, tune_index
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INDEX_ROOT = os.getenv("INDEX_ROOT", "indexes")
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+
+_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_.-]+")
+_VERSION_PATTERN = re.compile(r"^v(\d+)$")
+
+# Chroma rejects oversized add/upsert calls.
+_CHROMA_BATCH = 5000
+
+
+def vectorstore_class(vectorstore_type: str):
+    """The LangChain class of the selected vector database, imported on first use."""
+    if vectorstore_type == "FAISS":
+        from langchain_community.vectorstores import FAISS
+        return FAISS
+    from langchain_community.vectorstores import Chroma
+    return Chroma
+
+
+def faiss_vectorstore(embeddings, index, store: ChunkStore = None, index_to_docstore_id: PositionMap = None):
+    store = store if store is not None else ChunkStore()
+    if index_to_docstore_id is None:
+        index_to_docstore_id = PositionMap(store, array("q", range(store.rows)))
+    # Imported here, so the Chroma path never loads the FAISS wrapper.
+    from chunk_store_faiss import ChunkStoreFAISS
+    return ChunkStoreFAISS(embeddings, index, store, index_to_docstore_id)
+
+
+def sanitize_index_name(name: str) -> str:
+    cleaned = _NAME_PATTERN.sub("_", name.strip()).strip("._")
+    return cleaned or "default"
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ChunkIdAssigner:
+    """Derives chunk ids from (file name, content hash) so a file's chunks can be removed as a unit."""
+
+    def __init__(self):
+        self.files = {}
+        self._prefixes = {}
+
+    def assign(self, chunk: Document) -> str:
+        source = chunk.metadata.get("source_file", "")
+        entry = self.files.get(source)
+        if entry is None:
+            digest = chunk.metadata.get("file_hash", "")
+            self._prefixes[source] = hashlib.sha1(f"{source}\0{digest}".encode("utf-8")).hexdigest()[:16]
+            entry = self.files[source] = {"hash": digest, "upload_time": chunk.metadata.get("upload_time"),
+                                          "chunk_ids": []}
+
+        chunk_id = f"{self._prefixes[source]}-{len(entry['chunk_ids'])}"
+        entry["chunk_ids"].append(chunk_id)
+        chunk.metadata["chunk_id"] = chunk_id
+        return chunk_id
+
+
+def assign_chunk_ids(chunks: List[Document]) -> Tuple[List[str], Dict[str, Dict[str, Any]]]:
+    assigner = ChunkIdAssigner()
+    ids = [assigner.assign(chunk) for chunk in chunks]
+    return ids, assigner.files
+
+
+def add_embedded_documents(vectorstore, vectorstore_type: str, documents: List[Document],
+                           vectors: List[List[float]], ids: List[str]):
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+
+    if vectorstore_type == "FAISS":
+        vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        return
+
+    for start in range(0, len(ids), _CHROMA_BATCH):
+        end = start + _CHROMA_BATCH
+        vectorstore._collection.upsert(
+            ids=ids[start:end],
+            embeddings=vectors[start:end],
+            metadatas=metadatas[start:end],
+            documents=texts[start:end]
+        )
+
+
+class VectorstoreWriter:
+    """Pipeline sink that appends embedded chunks to a vector store (creating it on the first batch)
+    and, when given one, to the BM25 index kept alongside it.
+
+    For trained FAISS engines (IVF) batches are held back until enough vectors have arrived to train
+    on; call close() once the pipeline is done to flush them.
+    """
+
+    def __init__(self, vectorstore_type: str, embeddings, vectorstore=None, persist_directory: str = None,
+                 lexical_index: Optional[BM25Index] = None, index_engine: str = "Flat", exact_rerank: bool = False):
+        self.vectorstore_type = vectorstore_type
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self.persist_directory = persist_directory
+        self.lexical_index = lexical_index
+        self.index_engine = index_engine
+        self.exact_rerank = exact_rerank
+        self.engine_used = None
+        self.ids = ChunkIdAssigner()
+        self._pending = []
+        self._pending_count = 0
+
+    @property
+    def files(self) -> Dict[str, Dict[str, Any]]:
+        return self.ids.files
+
+    def __call__(self, chunks: List[Document], vectors: List[List[float]]):
+        ids = [self.ids.assign(chunk) for chunk in chunks]
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, [chunk.page_content for chunk in chunks])
+
+        if self.vectorstore is None:
+            if self.vectorstore_type != "FAISS":
+                self.vectorstore = vectorstore_class("Chroma")(persist_directory=self.persist_directory,
+                                                               embedding_function=self.embeddings)
+            else:
+                self._pending.append((chunks, vectors, ids))
+                self._pending_count += len(ids)
+                if not requires_training(self.index_engine) or self._pending_count >= TRAIN_SIZE:
+                    self.close()
+                return
+
+        add_embedded_documents(self.vectorstore, self.vectorstore_type, chunks, vectors, ids)
+
+    def close(self):
+        if not self._pending:
+            return
+
+        training_vectors = np.array([v for _, vectors, _ in self._pending for v in vectors], dtype=np.float32)
+        index, self.engine_used = make_faiss_index(self.index_engine, training_vectors, self.exact_rerank)
+        self.vectorstore = faiss_vectorstore(self.embeddings, index)
+
+        pending, self._pending, self._pending_count = self._pending, [], 0
+        for chunks, vectors, ids in pending:
+            add_embedded_documents(self.vectorstore, self.vectorstore_type, chunks, vectors, ids)
+
+
+def _atomic_write(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read_faiss_index(path: str):
+    import faiss
+
+    # Map the vectors instead of copying them so sessions and processes share the page cache.
+    flags = faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+class IndexStore:
+    """Named, versioned vector indexes on disk.
+
+    Layout: <root>/<name>/v0001/{manifest.json, bm25.*, index.faiss, chunks.{bin,npz,json} | chroma/}
+    plus a LATEST pointer that is swapped atomically once a version is complete.
+    Versions written before the chunk store keep a docstore.jsonl, which is still read.
+    """
+
+    def __init__(self, root: str = INDEX_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # Indexes whose writer lock this process holds.
+        self._writing = set()
+        self._writing_lock = threading.Lock()
+
+    @contextmanager
+    def writer(self, name: str):
+        """Exclusive write access to one index, across threads and processes (Streamlit, the ingestion
+        worker, API replicas), from reading the version to build on through `commit`.
+
+        Without it, a commit's prune could remove a version another writer is still building, and the
+        later of two concurrent updates would drop the changes of the earlier one.
+        """
+        os.makedirs(self.index_dir(name), exist_ok=True)
+        with open(os.path.join(self.index_dir(name), ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._writing_lock:
+                self._writing.add(sanitize_index_name(name))
+            try:
+                yield
+            finally:
+                with self._writing_lock:
+                    self._writing.discard(sanitize_index_name(name))
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def index_dir(self, name: str) -> str:
+        return os.path.join(self.root, sanitize_index_name(name))
+
+    def version_dir(self, name: str, version: int) -> str:
+        return os.path.join(self.index_dir(name), f"v{version:04d}")
+
+    def chroma_directory(self, name: str, version: int) -> str:
+        return os.path.join(self.version_dir(name, version), "chroma")
+
+    def list_indexes(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.root) if self.latest_version(name) is not None)
+
+    def _version_dirs(self, name: str) -> List[int]:
+        index_dir = self.index_dir(name)
+        if not os.path.isdir(index_dir):
+            return []
+
+        versions = []
+        for entry in os.listdir(index_dir):
+            match = _VERSION_PATTERN.match(entry)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def versions(self, name: str) -> List[int]:
+        return [v for v in self._version_dirs(name)
+                if os.path.exists(os.path.join(self.version_dir(name, v), "manifest.json"))]
+
+    def latest_version(self, name: str) -> Optional[int]:
+        try:
+            with open(os.path.join(self.index_dir(name), "LATEST"), encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def allocate_version(self, name: str) -> int:
+        os.makedirs(self.index_dir(name), exist_ok=True)
+        version = max(self._version_dirs(name), default=0) + 1
+        while True:
+            try:
+                os.makedirs(self.version_dir(name, version))
+                return version
+            except FileExistsError:
+                version += 1
+
+    def read_manifest(self, name: str, version: Optional[int] = None) -> Dict[str, Any]:
+        if version is None:
+            version = self.latest_version(name)
+        if version is None:
+            raise FileNotFoundError(f"Index not found: {name}")
+
+        with open(os.path.join(self.version_dir(name, version), "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def commit(self, name: str, version: int, vectorstore, vectorstore_type: str,
+               embedding_type: str, embedding_model: str, extra: Dict[str, Any] = None,
+               lexical_index: Optional[BM25Index] = None) -> Dict[str, Any]:
+        path = self.version_dir(name, version)
+        if lexical_index is not None:
+            lexical_index.save(os.path.join(path, "bm25"))
+
+        if vectorstore_type == "FAISS":
+            num_chunks = self._write_faiss(vectorstore, path)
+        else:
+            persist = getattr(vectorstore, "persist", None)
+            if callable(persist):
+                persist()
+            num_chunks = vectorstore._collection.count()
+
+        manifest = {
+            "name": sanitize_index_name(name),
+            "version": version,
+            "vectorstore_type": vectorstore_type,
+            "embedding_type": embedding_type,
+            "embedding_model": embedding_model,
+            "num_chunks": num_chunks,
+            "created_at": datetime.now().isoformat(),
+        }
+        if extra:
+            manifest.update(extra)
+
+        _atomic_write(os.path.join(path, "manifest.json"), json.dumps(manifest, indent=2))
+        _atomic_write(os.path.join(self.index_dir(name), "LATEST"), str(version))
+        self.prune(name)
+        return manifest
+
+    def load(self, name: str, embeddings, version: Optional[int] = None) -> Tuple[Any, Dict[str, Any]]:
+        manifest = self.read_manifest(name, version)
+        path = self.version_dir(name, manifest["version"])
+
+        if manifest["vectorstore_type"] == "FAISS":
+            vectorstore = self._read_faiss(path, embeddings)
+        else:
+            vectorstore = vectorstore_class("Chroma")(
+                persist_directory=os.path.join(path, "chroma"),
+                embedding_function=embeddings
+            )
+        return vectorstore, manifest
+
+    def load_lexical(self, name: str, version: int) -> Optional[BM25Index]:
+        return BM25Index.load(os.path.join(self.version_dir(name, version), "bm25"))
+
+    def clone(self, vectorstore, vectorstore_type: str, embeddings, name: str,
+              source_version: int, version: int):
+        # Copy-on-write: the new version is built beside the live one, which keeps serving queries.
+        if vectorstore_type == "FAISS":
+            import faiss
+
+            # clone_index would share the read-only mmap of a loaded index; a serialized copy owns its data.
+            store = vectorstore.docstore.copy()
+            return faiss_vectorstore(
+                embeddings,
+                tune_index(faiss.deserialize_index(faiss.serialize_index(vectorstore.index))),
+                store,
+                vectorstore.index_to_docstore_id.copy(store)
+            )
+
+        target = self.chroma_directory(name, version)
+        shutil.copytree(self.chroma_directory(name, source_version), target)
+        return vectorstore_class("Chroma")(persist_directory=target, embedding_function=embeddings)
+
+    def discard_version(self, name: str, version: int):
+        """Removes an allocated version that was never committed."""
+        shutil.rmtree(self.version_dir(name, version), ignore_errors=True)
+
+    def prune(self, name: str, keep: int = KEEP_VERSIONS):
+        latest = self.latest_version(name)
+        complete = [v for v in self.versions(name) if v != latest]
+        for version in complete[:max(0, len(complete) - (keep - 1))]:
+            shutil.rmtree(self.version_dir(name, version), ignore_errors=True)
+
+        # Under the writer lock, versions without a manifest were left by a build or update that was killed
+        # before it could discard them; without the lock they may belong to a writer still running.
+        with self._writing_lock:
+            writing = sanitize_index_name(name) in self._writing
+        if latest is not None and writing and fcntl is not None:
+            for version in set(self._version_dirs(name)) - set(self.versions(name)):
+                if version < latest:
+                    self.discard_version(name, version)
+
+    def delete(self, name: str):
+        shutil.rmtree(self.index_dir(name), ignore_errors=True)
+
+    @staticmethod
+    def _write_faiss(vectorstore, path: str) -> int:
+        import faiss
+
+        faiss.write_index(vectorstore.index, os.path.join(path, "index.faiss"))
+
+        # Rows in position order, so the loaded store numbers them like the index does.
+        vectorstore.docstore.save(path, vectorstore.index_to_docstore_id.rows)
+        return len(vectorstore.docstore)
+
+    @staticmethod
+    def _read_faiss(path: str, embeddings):
+        index = tune_index(_read_faiss_index(os.path.join(path, "index.faiss")))
+        if ChunkStore.exists(path):
+            return faiss_vectorstore(embeddings, index, ChunkStore.load(path))
+
+        with open(os.path.join(path, "docstore.jsonl"), encoding="utf-8") as f:
+            records = (json.loads(line) for line in f)
+            store = ChunkStore.from_documents(
+                (record["id"], Document(page_content=record["page_content"], metadata=record["metadata"]))
+                for record in records
+            )
+        return faiss_vectorstore(embeddings, index, store)
@@ -0,0 +1,329 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+PAGES_PER_TASK = 16
+QUEUE_DEPTH = 256
+# Large enough for the embedding scheduler to run several API batches concurrently.
+EMBED_BATCH_SIZE = 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+_SENTINEL = object()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    # Worker processes are expensive to spawn, so one pool is kept for the whole process.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _parse_task(path: str, kind: str, start: int, end: int) -> List[Tuple[str, Optional[int]]]:
+    if kind == "pdf":
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        return [(reader.pages[i].extract_text(), i) for i in range(start, end)]
+
+    with open(path, encoding="utf-8") as f:
+        return [(f.read(), None)]
+
+
+def spool_upload(uploaded_file) -> Tuple[str, str, bool]:
+    """Returns (path, sha256, owned) for an upload, hashing it in chunks while it is copied to disk.
+
+    Uploads that already live on disk (a `path` attribute) are hashed in place instead of copied;
+    `owned` says whether the path is a temporary file the caller has to delete.
+    """
+    digest = hashlib.sha256()
+    path = getattr(uploaded_file, "path", None)
+    if path:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+                digest.update(block)
+        return path, digest.hexdigest(), False
+
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
+        try:
+            for block in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_BYTES), b""):
+                digest.update(block)
+                tmp_file.write(block)
+        except BaseException:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise
+    uploaded_file.seek(0)
+    return tmp_file.name, digest.hexdigest(), True
+
+
+class IngestFile:
+    def __init__(self, path: str, name: str, metadata: Dict, owned: bool = True,
+                 pages: Optional[List[Tuple[str, Optional[int]]]] = None):
+        self.path = path
+        self.name = name
+        self.metadata = metadata
+        self.kind = "pdf" if name.endswith(".pdf") else "txt"
+        self.owned = owned
+        # Page text from the page cache; such files skip parsing altogether.
+        self.pages = pages
+        self.tasks = 0
+        self.parsed = 0
+        self.failed = False
+
+    def release(self):
+        if self.owned and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class IngestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_tasks = 0
+        self.done_tasks = 0
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.errors = []
+        # (name, identical earlier upload) pairs skipped before parsing.
+        self.duplicates = []
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started, 1e-9)
+
+    @property
+    def fraction(self) -> float:
+        if not self.total_tasks:
+            return 0.0
+        parsed = self.done_tasks / self.total_tasks
+        embedded = self.embedded / self.chunks if self.chunks else 0.0
+        return min(1.0, parsed * embedded)
+
+    def summary(self) -> str:
+        return (f"Parse: {self.pages} pages ({self.pages / self.elapsed:.1f}/s) · "
+                f"Split: {self.chunks} chunks ({self.chunks / self.elapsed:.1f}/s) · "
+                f"Embed: {self.embedded} chunks ({self.embedded / self.elapsed:.1f}/s)")
+
+
+class IngestionPipeline:
+    """Streams pages through parse (process pool) -> split (thread) -> embed (caller thread).
+
+    Stages are connected by bounded queues, so memory is capped by the queue depths
+    instead of the corpus size. Embedding runs on the calling thread so progress
+    callbacks can safely touch Streamlit elements.
+    """
+
+    def __init__(self, text_splitter, embeddings, batch_size: int = EMBED_BATCH_SIZE,
+                 queue_depth: int = QUEUE_DEPTH, pages_per_task: int = PAGES_PER_TASK, page_cache=None):
+        self.text_splitter = text_splitter
+        self.embeddings = embeddings
+        self.page_cache = page_cache
+        self.batch_size = batch_size
+        self.queue_depth = queue_depth
+        self.pages_per_task = pages_per_task
+
+    def run(self, files: List[IngestFile], sink: Callable[[List[Document], List[List[float]]], None],
+            on_progress: Callable[[IngestStats], None] = None) -> IngestStats:
+        stats = IngestStats()
+        page_queue = queue.Queue(maxsize=self.queue_depth)
+        chunk_queue = queue.Queue(maxsize=self.queue_depth)
+        failures = []
+        self._cancelled = threading.Event()
+
+        parser = threading.Thread(target=self._guard, args=(self._parse_stage, failures, files, page_queue, stats),
+                                  daemon=True)
+        splitter = threading.Thread(target=self._guard, args=(self._split_stage, failures, page_queue, chunk_queue,
+                                                              stats), daemon=True)
+        parser.start()
+        splitter.start()
+
+        batch = []
+        finished = False
+        try:
+            # A failed stage cancels the run, which stops the other stages and ends this loop.
+            while not finished and not self._cancelled.is_set():
+                try:
+                    item = chunk_queue.get(timeout=0.25)
+                except queue.Empty:
+                    if on_progress:
+                        on_progress(stats)
+                    continue
+
+                if item is _SENTINEL:
+                    finished = True
+                else:
+                    batch.append(item)
+
+                if batch and (finished or len(batch) >= self.batch_size):
+                    vectors = self.embeddings.embed_documents([chunk.page_content for chunk in batch])
+                    sink(batch, vectors)
+                    stats.embedded += len(batch)
+                    batch = []
+                    if on_progress:
+                        on_progress(stats)
+        except BaseException:
+            self._cancelled.set()
+            raise
+
+        parser.join()
+        splitter.join()
+        if failures:
+            raise failures[0]
+        return stats
+
+    def _guard(self, stage, failures: list, *args):
+        # A failing stage cancels the run: the stage feeding it would otherwise block on a full queue forever.
+        try:
+            stage(*args)
+        except Exception as e:
+            failures.append(e)
+            self._cancelled.set()
+
+    def _put(self, target: queue.Queue, item):
+        while not self._cancelled.is_set():
+            try:
+                target.put(item, timeout=0.25)
+                return
+            except queue.Full:
+                continue
+
+    def _tasks(self, files: List[IngestFile], stats: IngestStats):
+        """Yields (file, start, end, pages); tasks with pages already known are not sent to the pool."""
+        for ingest_file in files:
+            try:
+                if ingest_file.pages is not None:
+                    stats.total_tasks += 1
+                    yield ingest_file, 0, None, ingest_file.pages
+                elif ingest_file.kind == "pdf":
+                    from pypdf import PdfReader
+                    page_count = len(PdfReader(ingest_file.path).pages)
+                    starts = range(0, page_count, self.pages_per_task)
+                    ingest_file.tasks = len(starts)
+                    # Tasks an interrupted run already parsed, for files the page cache only partly holds.
+                    digest = ingest_file.metadata.get("file_hash")
+                    parsed = self.page_cache.get_tasks(digest) if self.page_cache is not None and digest else {}
+                    for start in starts:
+                        stats.total_tasks += 1
+                        yield ingest_file, start, min(start + self.pages_per_task, page_count), parsed.get(start)
+                else:
+                    ingest_file.tasks = 1
+                    stats.total_tasks += 1
+                    yield ingest_file, 0, 1, None
+            except Exception as e:
+                stats.errors.append((ingest_file.name, str(e)))
+
+    def _parse_stage(self, files: List[IngestFile], page_queue: queue.Queue, stats: IngestStats):
+        pool = get_parse_pool()
+        max_inflight = PARSE_WORKERS * 2
+        inflight = {}
+        # Parsed tasks are emitted in task order, so the splitter sees each file's pages in sequence and
+        # can carry the open section from one task into the next.
+        ready = {}
+        submitted = emitted = 0
+        tasks = self._tasks(files, stats)
+        exhausted = False
+
+        while (inflight or ready or not exhausted) and not self._cancelled.is_set():
+            while not exhausted and len(inflight) + len(ready) < max_inflight:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                ingest_file, start, end, pages = task
+                number, submitted = submitted, submitted + 1
+                if pages is not None:
+                    stats.done_tasks += 1
+                    if end is not None:
+                        self._parsed(ingest_file)
+                    ready[number] = ingest_file, pages
+                    continue
+                future = pool.submit(_parse_task, ingest_file.path, ingest_file.kind, start, end)
+                inflight[future] = ingest_file, start, number
+
+            if emitted not in ready:
+                if not inflight:
+                    break
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ingest_file, start, number = inflight.pop(future)
+                    stats.done_tasks += 1
+                    try:
+                        pages = future.result()
+                    except Exception as e:
+                        stats.errors.append((ingest_file.name, str(e)))
+                        self._uncache(ingest_file)
+                        ready[number] = ingest_file, None
+                        continue
+
+                    self._cache(ingest_file, start, pages)
+                    ready[number] = ingest_file, pages
+
+            while emitted in ready:
+                ingest_file, pages = ready.pop(emitted)
+                emitted += 1
+                if pages is not None:
+                    self._emit(ingest_file, pages, page_queue, stats)
+
+        self._put(page_queue, _SENTINEL)
+
+    def _emit(self, ingest_file: IngestFile, pages: List[Tuple[str, Optional[int]]], page_queue: queue.Queue,
+              stats: IngestStats):
+        documents = []
+        for text, page in pages:
+            metadata = {"source": ingest_file.name, **ingest_file.metadata}
+            if page is not None:
+                metadata["page"] = page
+            documents.append(Document(page_content=text, metadata=metadata))
+        # The pages of one task travel together so the splitter can process them as a batch.
+        self._put(page_queue, documents)
+        stats.pages += len(documents)
+
+    def _cache(self, ingest_file: IngestFile, start: int, pages: List[Tuple[str, Optional[int]]]):
+        digest = ingest_file.metadata.get("file_hash")
+        if self.page_cache is None or not digest or ingest_file.failed:
+            return
+        self.page_cache.put_task(digest, start, pages)
+        self._parsed(ingest_file)
+
+    def _parsed(self, ingest_file: IngestFile):
+        ingest_file.parsed += 1
+        if ingest_file.parsed == ingest_file.tasks:
+            self.page_cache.complete(ingest_file.metadata["file_hash"], ingest_file.kind)
+
+    def _uncache(self, ingest_file: IngestFile):
+        ingest_file.failed = True
+        digest = ingest_file.metadata.get("file_hash")
+        if self.page_cache is not None and digest:
+            self.page_cache.discard(digest)
+
+    def _split_stage(self, page_queue: queue.Queue, chunk_queue: queue.Queue, stats: IngestStats):
+        # Open section per source file, carried from one task of a file to the next.
+        sections = {}
+        while not self._cancelled.is_set():
+            try:
+                pages = page_queue.get(timeout=0.25)
+            except queue.Empty:
+                continue
+            if pages is _SENTINEL:
+                break
+            for chunk in self.text_splitter.split_documents(pages, sections):
+                self._put(chunk_queue, chunk)
+                stats.chunks += 1
+
+        self._put(chunk_queue, _SENTINEL)
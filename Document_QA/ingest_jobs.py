@@ -0,0 +1,444 @@
+"""Local ingestion job queue and the worker process that runs it.
+
+    python ingest_jobs.py            # process jobs until stopped
+    python ingest_jobs.py --once     # exit when the queue is empty
+
+The Streamlit app queues uploads here and starts a worker when none is alive; the worker builds or
+updates the index, commits a new version to the IndexStore and records progress the app polls.
+A worker that dies leaves its job "running" with a stale heartbeat; the next worker queues it again.
+Parsed pages (page cache) and embedded batches (embedding cache) of the earlier attempt are reused,
+so a resumed job only repeats splitting and indexing.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from ingest import IngestStats, UPLOAD_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+JOBS_PATH = os.getenv("INGEST_JOBS_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOBS_UPLOAD_DIR = os.getenv("INGEST_JOBS_UPLOAD_DIR", os.path.join(".cache", "jobs"))
+JOB_POLL_SECONDS = float(os.getenv("INGEST_JOB_POLL_SECONDS", "1"))
+# A running job whose worker has not reported for this long is queued again.
+JOB_LEASE_SECONDS = float(os.getenv("INGEST_JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+HEARTBEAT_SECONDS = min(5.0, JOB_LEASE_SECONDS / 4)
+PROGRESS_SECONDS = 0.5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_JOB_COLUMNS = ("id", "kind", "index_name", "params", "files", "removed_files", "status", "attempts", "progress",
+                "result", "error", "cancel_requested", "created_at", "started_at", "finished_at", "heartbeat")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobUpload:
+    """A queued upload on disk; `spool_upload` hashes it in place instead of copying it again."""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+
+def estimate_eta(progress: Dict[str, Any]) -> Optional[float]:
+    """Seconds left, extrapolated from the fraction done so far."""
+    fraction = progress.get("fraction") or 0.0
+    if fraction <= 0.0 or fraction >= 1.0:
+        return None
+    return progress["elapsed"] * (1.0 - fraction) / fraction
+
+
+class JobQueue:
+    """Ingestion jobs in SQLite, shared by the app processes and the workers.
+
+    Jobs of one index run one at a time and in order, so an update always starts from the version
+    the previous job committed.
+    """
+
+    def __init__(self, path: str = JOBS_PATH, upload_dir: str = JOBS_UPLOAD_DIR):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.upload_dir = upload_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                index_name TEXT NOT NULL,
+                params TEXT NOT NULL,
+                files TEXT NOT NULL,
+                removed_files TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                progress TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat REAL,
+                credentials TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+
+            CREATE TABLE IF NOT EXISTS workers (
+                pid INTEGER PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+        """)
+        try:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN credentials TEXT")
+        except sqlite3.OperationalError:
+            pass  # Queues created with the column already.
+
+    def submit(self, kind: str, index_name: str, uploaded_files: List, removed_files: List[str] = None,
+               params: Dict[str, Any] = None, credentials: Dict[str, str] = None) -> int:
+        """Copies the uploads next to the queue and queues a "build" or "update" job for `index_name`.
+
+        `credentials` (e.g. {"openai_api_key": ...}) are the submitter's own; only the worker that claims the
+        job reads them, and they are cleared when it ends.
+        """
+        with self._lock:
+            job_id = self._conn.execute(
+                "INSERT INTO jobs (kind, index_name, params, files, removed_files, status, created_at, credentials) "
+                "VALUES (?, ?, ?, '[]', ?, 'submitting', ?, ?)",
+                (kind, index_name, json.dumps(params or {}), json.dumps(removed_files or []), time.time(),
+                 json.dumps(credentials or {}))
+            ).lastrowid
+
+        directory = os.path.join(self.upload_dir, str(job_id))
+        files = []
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for number, uploaded_file in enumerate(uploaded_files):
+                path = os.path.join(directory, f"{number}{os.path.splitext(uploaded_file.name)[1]}")
+                uploaded_file.seek(0)
+                with open(path, "wb") as f:
+                    for block in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_BYTES), b""):
+                        f.write(block)
+                uploaded_file.seek(0)
+                files.append({"name": uploaded_file.name, "path": path})
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            with self._lock:
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            raise
+
+        # Workers only see the job once all of its files are on disk.
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET files = ?, status = 'queued' WHERE id = ?",
+                               (json.dumps(files), job_id))
+        return job_id
+
+    def _row(self, row) -> Dict[str, Any]:
+        job = dict(zip(_JOB_COLUMNS, row))
+        for key in ("params", "files", "removed_files", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        return self._row(row) if row is not None else None
+
+    def list_jobs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE status != 'submitting' "
+                "ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancels a queued job at once; a running one stops at its next progress report."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, credentials = NULL "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            if cursor.rowcount:
+                self._remove_uploads(job_id)
+                return True
+            cursor = self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+            )
+            return bool(cursor.rowcount)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically takes the oldest queued job whose index has no running job."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs of workers that stopped reporting: retried, up to JOB_MAX_ATTEMPTS runs.
+                self._conn.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                    "error = CASE WHEN attempts >= ? THEN 'Worker stopped responding' ELSE error END "
+                    "WHERE status = 'running' AND heartbeat < ?",
+                    (JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, now - JOB_LEASE_SECONDS)
+                )
+                row = self._conn.execute(
+                    f"SELECT {', '.join(_JOB_COLUMNS)}, credentials FROM jobs WHERE status = 'queued' "
+                    "AND index_name NOT IN "
+                    "(SELECT index_name FROM jobs WHERE status = 'running') ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                        "heartbeat = ? WHERE id = ?", (now, now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._row(row[:-1])
+        job["credentials"] = json.loads(row[-1]) if row[-1] else {}
+        job["status"] = "running"
+        job["attempts"] += 1
+        return job
+
+    def report(self, job_id: int, progress: Dict[str, Any]) -> bool:
+        """Records progress; returns whether the job was asked to cancel."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET progress = ?, heartbeat = ? WHERE id = ?",
+                               (json.dumps(progress), time.time(), job_id))
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id: int, status: str, result: Dict[str, Any] = None, error: str = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, credentials = NULL WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._remove_uploads(job_id)
+
+    def _remove_uploads(self, job_id: int):
+        shutil.rmtree(os.path.join(self.upload_dir, str(job_id)), ignore_errors=True)
+
+    def heartbeat(self, pid: int, job_id: Optional[int] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO workers (pid, heartbeat) VALUES (?, ?)", (pid, now))
+            if job_id is not None:
+                self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (now, job_id))
+
+    def unregister(self, pid: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+    def worker_alive(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM workers WHERE heartbeat >= ? LIMIT 1",
+                                     (time.time() - JOB_LEASE_SECONDS,)).fetchone()
+        return row is not None
+
+
+def start_worker(job_queue: JobQueue = None, log_path: str = None) -> Optional[subprocess.Popen]:
+    """Starts a detached worker process unless one is alive; it outlives the app session that started it."""
+    job_queue = job_queue or JobQueue()
+    if job_queue.worker_alive():
+        return None
+    log_path = log_path or os.path.join(JOBS_UPLOAD_DIR, "worker.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    # Jobs carry their submitter's credentials; the worker must not run them with this session's key.
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], cwd=os.getcwd(), env=env,
+                                   stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    # The worker registers itself once it runs, so one that dies on startup does not block the next start.
+    return process
+
+
+class IngestWorker:
+    """Runs queued jobs one after another in this process."""
+
+    def __init__(self, job_queue: JobQueue = None, index_store=None, embedding_cache=None, page_cache=None):
+        from embedding_cache import EmbeddingCache
+        from index_store import IndexStore
+        from page_cache import PageCache
+
+        self.queue = job_queue or JobQueue()
+        self.index_store = index_store or IndexStore()
+        # Both caches are the checkpoints a retried job resumes from.
+        self.embedding_cache = embedding_cache or EmbeddingCache()
+        self.page_cache = page_cache or PageCache()
+        self.pid = os.getpid()
+        self._job_id = None
+        self._stopped = threading.Event()
+
+    def _heartbeat(self):
+        # Separate from progress reports, which stall while a large batch is being embedded.
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                self.queue.heartbeat(self.pid, self._job_id)
+            except sqlite3.Error as e:
+                logger.warning("Heartbeat failed: %s", e)
+
+    def run(self, once: bool = False):
+        self.queue.heartbeat(self.pid)
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            while True:
+                job = self.queue.claim()
+                if job is None:
+                    if once:
+                        return
+                    time.sleep(JOB_POLL_SECONDS)
+                    continue
+                self.run_job(job)
+        finally:
+            self._stopped.set()
+            self.queue.unregister(self.pid)
+
+    def run_job(self, job: Dict[str, Any]):
+        self._job_id = job["id"]
+        logger.info("Running job %d (%s %s, attempt %d)", job["id"], job["kind"], job["index_name"],
+                    job["attempts"])
+        try:
+            if job["kind"] == "build":
+                result = self._build(job)
+            else:
+                result = self._update(job)
+            self.queue.finish(job["id"], "done", result)
+        except JobCancelled:
+            self.queue.finish(job["id"], "cancelled")
+        except Exception as e:
+            logger.exception("Job %d failed", job["id"])
+            self.queue.finish(job["id"], "failed", error=str(e))
+        finally:
+            self._job_id = None
+
+    def _api_key(self, job: Dict[str, Any], embedding_type: str) -> Optional[str]:
+        if embedding_type != "OpenAI":
+            return None
+        api_key = job["credentials"].get("openai_api_key")
+        if not api_key:
+            raise ValueError("Job has no OpenAI API key; queue it again from a session with a key")
+        return api_key
+
+    def _progress_callback(self, job: Dict[str, Any]):
+        last_report = 0.0
+
+        def on_progress(stats: IngestStats):
+            nonlocal last_report
+            now = time.perf_counter()
+            if now - last_report < PROGRESS_SECONDS:
+                return
+            last_report = now
+            progress = {"fraction": stats.fraction, "elapsed": stats.elapsed, "pages": stats.pages,
+                        "chunks": stats.chunks, "embedded": stats.embedded, "summary": stats.summary()}
+            progress["eta"] = estimate_eta(progress)
+            if self.queue.report(job["id"], progress):
+                raise JobCancelled()
+
+        return on_progress
+
+    def _new_system(self):
+        from qa_system import DocumentQASystem
+
+        system = DocumentQASystem()
+        system.verbose = False
+        system.page_cache = self.page_cache
+        return system
+
+    def _uploads(self, job: Dict[str, Any]) -> List[JobUpload]:
+        return [JobUpload(entry["name"], entry["path"]) for entry in job["files"]]
+
+    def _build(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        from qa_system import CHUNK_SIZE, CHUNK_OVERLAP
+
+        params = job["params"]
+        index_name = job["index_name"]
+        api_key = self._api_key(job, params["embedding_type"])
+        system = self._new_system()
+        # Held until the commit, so no other process builds or prunes this index meanwhile.
+        with self.index_store.writer(index_name):
+            version = self.index_store.allocate_version(index_name)
+            try:
+                stats = system.build_vectorstore(
+                    self._uploads(job), params["embedding_type"], params["vectorstore_type"],
+                    params.get("chunk_size", CHUNK_SIZE), params.get("chunk_overlap", CHUNK_OVERLAP),
+                    embedding_cache=self.embedding_cache,
+                    persist_directory=self.index_store.chroma_directory(index_name, version),
+                    on_progress=self._progress_callback(job),
+                    index_engine=params.get("index_engine", "Flat"), exact_rerank=params.get("exact_rerank", False),
+                    api_key=api_key
+                )
+                if not stats.embedded:
+                    errors = "; ".join(f"{name}: {error}" for name, error in stats.errors)
+                    raise RuntimeError(f"No documents could be loaded{': ' + errors if errors else ''}")
+
+                system.save_vectorstore(self.index_store, index_name, version)
+            except BaseException:
+                # Failed and cancelled builds (JobCancelled) leave no half-written version behind.
+                self.index_store.discard_version(index_name, version)
+                raise
+        return {"version": version, "pages": stats.pages, "chunks": stats.chunks, "seconds": stats.elapsed,
+                "errors": stats.errors, "duplicates": stats.duplicates}
+
+    def _update(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        from qa_system import build_embeddings, CHUNK_SIZE, CHUNK_OVERLAP
+
+        params = job["params"]
+        index_name = job["index_name"]
+        with self.index_store.writer(index_name):
+            # The latest version, read under the writer lock, so the update applies on top of every earlier commit.
+            manifest = self.index_store.read_manifest(index_name)
+            embeddings, _ = build_embeddings(manifest["embedding_type"], self.embedding_cache,
+                                             self._api_key(job, manifest["embedding_type"]))
+            vectorstore, manifest = self.index_store.load(index_name, embeddings, manifest["version"])
+
+            system = self._new_system()
+            system.attach_vectorstore(vectorstore, embeddings, manifest,
+                                      self.index_store.load_lexical(index_name, manifest["version"]))
+            started = time.perf_counter()
+            stats = system.update_vectorstore(
+                self._uploads(job), job["removed_files"], self.index_store,
+                params.get("chunk_size", CHUNK_SIZE), params.get("chunk_overlap", CHUNK_OVERLAP),
+                on_progress=self._progress_callback(job)
+            )
+        return {"version": system.active_index[1], "seconds": time.perf_counter() - started, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs queued ingestion jobs")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    # Registered before the slow imports, so submits made meanwhile do not start another worker.
+    job_queue = JobQueue()
+    job_queue.heartbeat(os.getpid())
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    IngestWorker(job_queue).run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,35 @@
 import streamlit as st
+import html
+import io
 import os
-import tempfile
-from typing import List, Dict, Any
-import pickle
-from datetime import datetime
+import threading
+import time
+import weakref
+from functools import lru_cache
+from typing import Dict
+from datetime import date, datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI, OpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS, Chroma
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
 from langchain_community.callbacks import StreamlitCallbackHandler
-from langchain.schema import Document
+from langchain_core.callbacks import BaseCallbackHandler
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_scheduler import ScheduledEmbeddings
+from index_store import IndexStore, sanitize_index_name
+from namespaces import NamespaceManager
+from ingest_jobs import JobQueue, ACTIVE_STATUSES, JOB_POLL_SECONDS, start_worker
+from answer_cache import AnswerCache, ANSWER_CACHE_THRESHOLD
+from metadata_filter import RetrievalScope
+from page_cache import PageCache
+from chat_store import ChatStore, CHAT_PAGE_SIZE, CHAT_WINDOW_SIZE
+from retrievers import CONTEXT_TOKEN_BUDGET
+from reranker import RERANK_FETCH_K, RERANK_TOP_N
+from vector_engines import INDEX_ENGINES, INDEX_ENGINE_LABELS, QUANTIZED_ENGINES
+from qa_system import (DocumentQASystem, build_embeddings, BATCH_CONCURRENCY, CHUNK_SIZE, CHUNK_OVERLAP, TEMPERATURE,
+                       MEMORY_TYPE)
+from batch_qa import BATCH_FORMATS, BATCH_OUTPUT_DIR, batch_format, read_questions, run_batch
 
 st.set_page_config(
     page_title="Document Q&A System",
@@ -69,169 +82,383 @@ st.markdown("""
     border-radius: 0.5rem;
     border-left: 4px solid #FFC107;
 }
+.chat-caption {
+    color: #6C757D;
+    font-size: 0.85rem;
+    margin: -0.5rem 0 0.5rem 0;
+}
+.chat-sources {
+    margin-bottom: 1rem;
+}
+.chat-sources p {
+    font-size: 0.85rem;
+}
 </style>
 """, unsafe_allow_html=True)
 
 
-class DocumentQASystem:
-    def __init__(self):
-        self.vectorstore = None
-        self.qa_chain = None
-        self.memory = None
+def render_user_message(question: str) -> str:
+    return f"""
+    <div class="chat-message user-message">
+        <strong>You:</strong> {question}
+    </div>
+    """
+
+
+def render_bot_message(answer: str, cached: bool = False) -> str:
+    return f"""
+    <div class="chat-message bot-message">
+        <strong>Assistant{' (cached)' if cached else ''}:</strong> {answer}
+    </div>
+    """
+
+
+def turn_caption(chat: Dict) -> str:
+    if chat.get('ttft') is None:
+        return ""
+    caption = f"First token: {chat['ttft']:.2f}s · Total: {chat['total_time']:.2f}s"
+    if chat.get('cost'):
+        caption += f" · ${chat['cost']:.4f}"
+    return caption
+
+
+@lru_cache(maxsize=1024)
+def render_turn(question: str, answer: str, cached: bool, caption: str, sources: tuple) -> str:
+    # Unindented so that fragments of many turns can be joined into one markdown block.
+    parts = [render_user_message(question), render_bot_message(answer, cached)]
+    if caption:
+        parts.append(f'<div class="chat-caption">{caption}</div>')
+    if sources:
+        items = "".join(f"<p>Source {j + 1}: {html.escape(source)}</p>".replace("\n", "<br>")
+                        for j, source in enumerate(sources))
+        parts.append(f'<details class="chat-sources"><summary>Sources ({len(sources)})</summary>{items}</details>')
+    return "\n\n".join("\n".join(line.strip() for line in part.strip().splitlines()) for part in parts)
+
+
+def render_chat_window(history) -> str:
+    return "\n\n".join(
+        render_turn(chat['question'], chat['answer'], chat.get('cached', False), turn_caption(chat),
+                    tuple(chat.get('sources') or ()))
+        for chat in history
+    )
+
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+    def __init__(self, placeholder, started: float):
+        self.placeholder = placeholder
+        self.started = started
+        self.first_token_at = None
+        self.text = ""
+        self._answering = False
+
+    @property
+    def time_to_first_token(self):
+        return self.first_token_at - self.started if self.first_token_at else None
+
+    def on_retriever_end(self, documents, **kwargs):
+        # Tokens before retrieval belong to question condensation, not to the answer.
+        self._answering = True
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if not self._answering:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.text += token
+        self.placeholder.markdown(render_bot_message(self.text + "▌"), unsafe_allow_html=True)
+
+
+@st.cache_resource
+def get_chat_store() -> ChatStore:
+    chat_store = ChatStore()
+    chat_store.migrate_pickles()
+    return chat_store
+
+
+def save_chat_turn(chat_entry: Dict):
+    try:
+        chat_store = get_chat_store()
+        if st.session_state.conversation_id is None:
+            st.session_state.conversation_id = chat_store.create_conversation()
+        chat_entry["position"] = chat_store.append_turn(st.session_state.conversation_id, chat_entry) - 1
+    except Exception as e:
+        st.error(f"Error saving chat history: {str(e)}")
 
-    def load_documents(self, uploaded_files: List) -> List[Document]:
-        documents = []
 
-        for uploaded_file in uploaded_files:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.read())
-                tmp_file_path = tmp_file.name
+def reset_chat():
+    st.session_state.chat_history = []
+    st.session_state.conversation_id = None
+    st.session_state.has_earlier_turns = False
+    st.session_state.chat_window = CHAT_WINDOW_SIZE
 
-            try:
-                if uploaded_file.name.endswith('.pdf'):
-                    loader = PyPDFLoader(tmp_file_path)
-                elif uploaded_file.name.endswith('.txt'):
-                    loader = TextLoader(tmp_file_path, encoding='utf-8')
-                else:
-                    st.warning(f"Unsupported file format: {uploaded_file.name}")
-                    continue
+    if st.session_state.qa_system.memory:
+        st.session_state.qa_system.memory.clear()
 
-                file_documents = loader.load()
 
-                for doc in file_documents:
-                    doc.metadata['source_file'] = uploaded_file.name
-                    doc.metadata['upload_time'] = datetime.now().isoformat()
+def start_new_chat():
+    reset_chat()
+    st.success("New chat started!")
+    return True
 
-                documents.extend(file_documents)
 
-            except Exception as e:
-                st.error(f"Error loading file: {uploaded_file.name} - {str(e)}")
-            finally:
-                if os.path.exists(tmp_file_path):
-                    os.unlink(tmp_file_path)
-
-        return documents
-
-    def split_documents(self, documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+def load_conversation(conversation_id: int):
+    try:
+        turns = get_chat_store().load_turns(conversation_id)
+    except Exception as e:
+        st.error(f"Error loading chat history: {str(e)}")
+        return
 
-        split_docs = text_splitter.split_documents(documents)
-        return split_docs
+    reset_chat()
+    st.session_state.conversation_id = conversation_id
+    st.session_state.chat_history = turns
+    st.session_state.has_earlier_turns = bool(turns) and turns[0]["position"] > 0
 
-    def create_vectorstore(self, documents: List[Document], embedding_type: str, vectorstore_type: str):
-        if embedding_type == "OpenAI":
-            embeddings = OpenAIEmbeddings()
-        else:
-            embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
 
-        if vectorstore_type == "FAISS":
-            self.vectorstore = FAISS.from_documents(documents, embeddings)
-        else:
-            self.vectorstore = Chroma.from_documents(documents, embeddings)
-
-    def setup_qa_chain(self, model_name: str, temperature: float, memory_type: str):
-        if model_name.startswith("gpt-3.5") or model_name.startswith("gpt-4"):
-            llm = ChatOpenAI(
-                model_name=model_name,
-                temperature=temperature,
-                streaming=True
-            )
-        else:
-            llm = OpenAI(
-                model_name=model_name,
-                temperature=temperature,
-                streaming=True
-            )
+def load_earlier_turns():
+    history = st.session_state.chat_history
+    earlier = get_chat_store().load_turns(st.session_state.conversation_id, before=history[0]["position"])
+    st.session_state.chat_history = earlier + history
+    st.session_state.has_earlier_turns = bool(earlier) and earlier[0]["position"] > 0
 
-        if memory_type == "Buffer":
-            self.memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer"
-            )
-        else:
-            self.memory = ConversationSummaryBufferMemory(
-                llm=llm,
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer",
-                max_token_limit=1000
-            )
 
-        self.qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=self.vectorstore.as_retriever(search_kwargs={"k": 4}),
-            memory=self.memory,
-            return_source_documents=True,
-            verbose=True
-        )
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
 
-    def ask_question(self, question: str, callback_handler) -> Dict[str, Any]:
-        if not self.qa_chain:
-            return {"error": "QA system not initialized"}
 
-        try:
-            result = self.qa_chain(
-                {"question": question},
-                callbacks=[callback_handler]
-            )
-            return result
-        except Exception as e:
-            return {"error": f"Error asking question: {str(e)}"}
+def show_ingest_errors(errors):
+    for name, error in errors:
+        st.error(f"Error loading file: {name} - {error}")
 
 
-def save_chat_history(history: List[Dict], filename: str = None):
-    try:
-        if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"chat_history_{timestamp}.pkl"
+def show_duplicates(duplicates):
+    for name, original in duplicates:
+        st.info(f"Skipped {name}: identical to {original}")
 
-        with open(filename, 'wb') as f:
-            pickle.dump(history, f)
-        return True, filename
-    except Exception as e:
-        st.error(f"Error saving chat history: {str(e)}")
-        return False, None
 
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    return AnswerCache()
 
-def start_new_chat():
-    if st.session_state.chat_history:
-        success, filename = save_chat_history(st.session_state.chat_history)
-        if success:
-            st.success(f"Previous chat saved: {filename}")
 
-    st.session_state.chat_history = []
+@st.cache_resource
+def get_page_cache() -> PageCache:
+    return PageCache()
 
-    if st.session_state.qa_system.memory:
-        st.session_state.qa_system.memory.clear()
 
-    st.success("New chat started!")
-    return True
+@st.cache_resource
+def get_index_store() -> IndexStore:
+    return IndexStore()
+
+
+class AttachedSessions:
+    """The QA systems of all sessions, so an evicted namespace can be released from every session holding it."""
+
+    def __init__(self):
+        self._systems = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def add(self, qa_system: DocumentQASystem):
+        with self._lock:
+            self._systems.add(qa_system)
+
+    def release(self, namespace: str):
+        with self._lock:
+            systems = list(self._systems)
+        for qa_system in systems:
+            if qa_system.active_index is not None and qa_system.active_index[0] == namespace:
+                qa_system.release_index()
 
 
-def load_chat_history(filename: str = "chat_history.pkl") -> List[Dict]:
+@st.cache_resource
+def get_attached_sessions() -> AttachedSessions:
+    return AttachedSessions()
+
+
+@st.cache_resource
+def get_namespace_manager() -> NamespaceManager:
+    # One read-only copy of each resident index per process, shared by every Streamlit session attached to it.
+    manager = NamespaceManager(
+        get_index_store(), lambda embedding_type: build_embeddings(embedding_type, get_embedding_cache())[0]
+    )
+    # Sessions drop an evicted index at once and load it again on their next run (reattach_namespace).
+    manager.add_eviction_listener(get_attached_sessions().release)
+    return manager
+
+
+def track_namespace(name: str):
+    st.session_state.namespace = name
+    get_attached_sessions().add(st.session_state.qa_system)
+
+
+def reattach_namespace(selected_model: str):
+    """Loads the session's namespace again if it was evicted since the last run, keeping the conversation."""
+    namespace = st.session_state.get("namespace")
+    qa_system = st.session_state.qa_system
+    if namespace is None or qa_system.vectorstore is not None:
+        return
     try:
-        if os.path.exists(filename):
-            with open(filename, 'rb') as f:
-                return pickle.load(f)
+        resident = get_namespace_manager().get(namespace)
     except Exception as e:
-        st.error(f"Error loading chat history: {str(e)}")
-    return []
+        st.session_state.namespace = None
+        st.session_state.documents_processed = False
+        st.error(f"Error loading index: {str(e)}")
+        return
+    qa_system.swap_index(resident.vectorstore, resident.embeddings, resident.manifest, resident.lexical_index)
+    if qa_system.qa_chain is None:
+        qa_system.setup_qa_chain(selected_model, TEMPERATURE, MEMORY_TYPE)
+
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    return JobQueue()
+
+
+def swap_finished_jobs(selected_model: str) -> bool:
+    """Switches the session to the versions its finished jobs committed; returns whether any are still active."""
+    job_queue = get_job_queue()
+    active = False
+    for job_id in list(st.session_state.ingest_jobs):
+        job = job_queue.get(job_id)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
+            active = True
+            continue
+        st.session_state.ingest_jobs.remove(job_id)
+        if job is None or job["status"] == "cancelled":
+            continue
+        if job["status"] == "failed":
+            st.error(f"Job #{job_id} failed: {job['error']}")
+            continue
+
+        result = job["result"]
+        show_ingest_errors(result["errors"])
+        show_duplicates(result["duplicates"])
+        try:
+            resident = get_namespace_manager().get(job["index_name"], result["version"])
+        except Exception as e:
+            st.error(f"Error loading index: {str(e)}")
+            continue
+
+        qa_system = st.session_state.qa_system
+        qa_system.swap_index(resident.vectorstore, resident.embeddings, resident.manifest, resident.lexical_index)
+        if qa_system.qa_chain is None:
+            qa_system.setup_qa_chain(selected_model, TEMPERATURE, MEMORY_TYPE)
+        st.session_state.documents_processed = True
+        track_namespace(resident.name)
+        if job["kind"] == "build":
+            st.success(f"{result['pages']} pages processed ({result['chunks']} chunks) in {result['seconds']:.1f}s")
+        else:
+            st.success(f"Index updated: {result['added']} added, {result['updated']} updated, "
+                       f"{result['removed']} removed, {result['unchanged']} unchanged")
+    return active
+
+
+def render_ingest_jobs():
+    job_queue = get_job_queue()
+    jobs = job_queue.list_jobs()
+    if not jobs:
+        return
+
+    with st.expander("Ingestion Jobs", expanded=bool(st.session_state.ingest_jobs)):
+        for job in jobs:
+            label = f"#{job['id']} {job['kind']} · {job['index_name']} · {job['status']}"
+            if job["attempts"] > 1:
+                label += f" (attempt {job['attempts']})"
+            progress = job["progress"] or {}
+
+            if job["status"] == "running":
+                st.progress(progress.get("fraction", 0.0), text=label)
+                eta = progress.get("eta")
+                st.caption(progress.get("summary", "Starting...") + (f" · ETA {eta:.0f}s" if eta is not None else ""))
+            else:
+                st.caption(label)
+                if job["status"] == "failed":
+                    st.caption(job["error"])
+
+            if job["status"] in ACTIVE_STATUSES and not job["cancel_requested"]:
+                if st.button("Cancel", key=f"cancel_job_{job['id']}"):
+                    job_queue.cancel(job["id"])
+                    st.rerun()
+
+
+def render_scope_picker(qa_system: DocumentQASystem):
+    indexed_files = qa_system.indexed_files
+    if not indexed_files:
+        return
+
+    st.subheader("Search Scope")
+    files = sorted(indexed_files)
+    # A file removed from the index (or another index loaded) must not stay selected.
+    if "scope_files" in st.session_state:
+        st.session_state.scope_files = [name for name in st.session_state.scope_files if name in indexed_files]
+    selected_files = st.multiselect("Files", files, key="scope_files", placeholder="All files",
+                                    help="Answer only from these files")
+
+    uploaded_from = uploaded_to = None
+    if st.checkbox("Filter by upload date", key="scope_by_date"):
+        upload_days = sorted(entry["upload_time"][:10] for entry in indexed_files.values() if entry.get("upload_time"))
+        first = date.fromisoformat(upload_days[0]) if upload_days else date.today()
+        last = date.fromisoformat(upload_days[-1]) if upload_days else date.today()
+        days = st.date_input("Uploaded between", value=(first, last), key="scope_dates")
+        # While the second day is being picked the range has one end.
+        uploaded_from = days[0] if days else None
+        uploaded_to = days[1] if len(days) > 1 else None
+
+    page_from = page_to = None
+    if st.checkbox("Filter by page", key="scope_by_page", help="PDF pages; text files have no pages"):
+        col1, col2 = st.columns(2)
+        page_from = int(col1.number_input("From page", min_value=1, value=1, step=1, key="scope_page_from"))
+        page_to = int(col2.number_input("To page", min_value=1, value=10, step=1, key="scope_page_to"))
+        page_from, page_to = min(page_from, page_to), max(page_from, page_to)
+
+    scope = RetrievalScope(selected_files or None, uploaded_from, uploaded_to, page_from, page_to) or None
+    if scope != qa_system.scope:
+        qa_system.set_scope(scope)
+    if qa_system.scope is not None:
+        st.caption(f"Searching {qa_system.scope.describe()}")
+
+
+def render_batch_questions():
+    with st.expander("Batch Questions"):
+        batch_file = st.file_uploader("Questions (CSV or JSONL)", type=BATCH_FORMATS, key="batch_file")
+        concurrency = st.slider("Concurrent Requests", min_value=1, max_value=64, value=BATCH_CONCURRENCY,
+                                help="Questions sent to the LLM at the same time")
+
+        if batch_file is not None and st.button("Run Batch", use_container_width=True):
+            lines = io.StringIO(batch_file.getvalue().decode("utf-8-sig"), newline="")
+            items = read_questions(lines, batch_format(batch_file.name))
+            if not items:
+                st.error("No questions found in the file!")
+                return
+
+            os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+            output_path = os.path.join(
+                BATCH_OUTPUT_DIR, f"{os.path.splitext(batch_file.name)[0]}-{datetime.now():%Y%m%d-%H%M%S}.jsonl"
+            )
+            progress_bar = st.progress(0.0)
+            progress_text = st.empty()
 
+            def on_result(record, summary):
+                done = summary["answered"] + summary["errors"]
+                progress_bar.progress(done / summary["questions"])
+                progress_text.caption(f"{done}/{summary['questions']} answered ({summary['errors']} errors)")
 
-def get_saved_chat_files() -> List[str]:
-    try:
-        files = [f for f in os.listdir('.') if f.startswith('chat_history_') and f.endswith('.pkl')]
-        return sorted(files, reverse=True)
-    except:
-        return []
+            try:
+                with open(output_path, "w", encoding="utf-8") as output:
+                    summary = run_batch(st.session_state.qa_system, items, output, concurrency, on_result)
+            except Exception as e:
+                st.error(f"Batch failed: {str(e)}")
+                return
+            st.session_state.batch_result = (output_path, summary)
+
+        if st.session_state.get("batch_result"):
+            output_path, summary = st.session_state.batch_result
+            st.success(f"{summary['answered']} answered, {summary['errors']} errors in {summary['seconds']}s "
+                       f"({summary['questions_per_second']} questions/s)")
+            if os.path.exists(output_path):
+                with open(output_path, "rb") as f:
+                    st.download_button("Download Answers (JSONL)", f, file_name=os.path.basename(output_path),
+                                       mime="application/jsonl", use_container_width=True)
 
 
 def main():
@@ -239,10 +466,17 @@ def main():
 
     if 'qa_system' not in st.session_state:
         st.session_state.qa_system = DocumentQASystem()
+        st.session_state.qa_system.answer_cache = get_answer_cache()
+        st.session_state.qa_system.page_cache = get_page_cache()
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = load_chat_history()
+        st.session_state.chat_history = []
+        st.session_state.conversation_id = None
+        st.session_state.has_earlier_turns = False
+        st.session_state.chat_window = CHAT_WINDOW_SIZE
     if 'documents_processed' not in st.session_state:
         st.session_state.documents_processed = False
+    if 'ingest_jobs' not in st.session_state:
+        st.session_state.ingest_jobs = []
 
     with st.sidebar:
         st.header("API Settings")
@@ -286,6 +520,7 @@ def main():
             "gpt-4"
         ]
         selected_model = st.selectbox("AI Model", model_options)
+        reattach_namespace(selected_model)
 
         embedding_options = ["OpenAI", "HuggingFace (Free)"]
         embedding_type = st.selectbox("Embedding", embedding_options)
@@ -294,41 +529,142 @@ def main():
         vectorstore_options = ["FAISS", "Chroma"]
         vectorstore_type = st.selectbox("Vector Database", vectorstore_options)
 
-        if uploaded_files:
+        index_engine, exact_rerank = "Flat", False
+        if vectorstore_type == "FAISS":
+            index_engine = st.selectbox(
+                "Index Engine", INDEX_ENGINES, format_func=INDEX_ENGINE_LABELS.get,
+                help="Approximate engines search large corpora faster; int8/PQ store vectors 4-16x smaller"
+            )
+            if index_engine in QUANTIZED_ENGINES:
+                exact_rerank = st.checkbox("Exact Re-ranking", value=False,
+                                           help="Re-score approximate candidates with full-precision vectors")
+
+        index_name = sanitize_index_name(st.text_input("Index Name", value="default"))
+
+        hybrid_search = st.checkbox("Hybrid Search (BM25 + Vector)", value=True)
+        qa_system = st.session_state.qa_system
+        if hybrid_search != qa_system.hybrid_search:
+            qa_system.set_hybrid_search(hybrid_search)
+
+        reranking = st.checkbox("Cross-Encoder Re-ranking", value=qa_system.reranker is not None,
+                                help=f"Re-score the top {RERANK_FETCH_K} chunks with a local cross-encoder "
+                                     f"and keep the best {RERANK_TOP_N}")
+        if reranking != (qa_system.reranker is not None):
+            try:
+                with st.spinner("Loading re-ranking model..."):
+                    qa_system.set_reranking(reranking)
+            except Exception as e:
+                st.error(f"Error loading re-ranking model: {str(e)}")
+
+        context_token_budget = st.slider(
+            "Context Token Budget", min_value=300, max_value=6000,
+            value=CONTEXT_TOKEN_BUDGET, step=100,
+            help="Retrieved chunks are de-duplicated and packed into at most this many prompt tokens"
+        )
+        if context_token_budget != qa_system.context_token_budget:
+            qa_system.set_context_token_budget(context_token_budget)
+
+        qa_system.answer_cache_threshold = st.slider(
+            "Answer Cache Similarity", min_value=0.80, max_value=1.0,
+            value=ANSWER_CACHE_THRESHOLD, step=0.01,
+            help="Questions at least this similar to an earlier one reuse its answer"
+        )
+
+        incremental = (qa_system.active_index is not None
+                       and qa_system.active_index[0] == index_name
+                       and qa_system.vectorstore_type == vectorstore_type
+                       and qa_system.index_engine == index_engine
+                       and qa_system.exact_rerank == exact_rerank
+                       and qa_system.embedding_type == embedding_type)
+
+        removed_files = []
+        if incremental and qa_system.indexed_files:
+            removed_files = st.multiselect("Remove from Index", sorted(qa_system.indexed_files))
+
+        if uploaded_files or removed_files:
             st.write("")
             if st.button("Process Documents", type="primary", use_container_width=True):
                 if not api_key_available and embedding_type == "OpenAI":
                     st.error("OpenAI API key required!")
                 else:
-                    with st.spinner("Processing documents..."):
-                        chunk_size = 1000
-                        chunk_overlap = 200
-                        temperature = 0.7
-                        memory_type = "Buffer"
-
-                        documents = st.session_state.qa_system.load_documents(uploaded_files)
-
-                        if documents:
-                            split_docs = st.session_state.qa_system.split_documents(
-                                documents, chunk_size, chunk_overlap
-                            )
-
-                            st.session_state.qa_system.create_vectorstore(
-                                split_docs, embedding_type, vectorstore_type
-                            )
-
-                            st.session_state.qa_system.setup_qa_chain(
-                                selected_model, temperature, memory_type
-                            )
-
-                            st.session_state.documents_processed = True
-                            st.balloons()
-                            st.success(f"{len(documents)} documents processed!")
-                        else:
-                            st.error("No documents could be loaded!")
+                    # The worker builds a new version in the background; this session switches to it when done.
+                    params = {"embedding_type": embedding_type, "vectorstore_type": vectorstore_type,
+                              "index_engine": index_engine, "exact_rerank": exact_rerank,
+                              "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+                    try:
+                        # The worker embeds with this session's key, not whatever its own environment holds.
+                        credentials = None
+                        if embedding_type == "OpenAI":
+                            credentials = {"openai_api_key": os.environ["OPENAI_API_KEY"]}
+                        job_id = get_job_queue().submit("update" if incremental else "build", index_name,
+                                                        uploaded_files or [], removed_files, params, credentials)
+                        start_worker(get_job_queue())
+                        st.session_state.ingest_jobs.append(job_id)
+                        st.success(f"Job #{job_id} queued")
+                    except Exception as e:
+                        st.error(f"Error queueing documents: {str(e)}")
         else:
             st.info("Please upload files first")
 
+        jobs_active = swap_finished_jobs(selected_model)
+        render_ingest_jobs()
+
+        saved_indexes = get_index_store().list_indexes()
+        if saved_indexes:
+            st.subheader("Saved Indexes")
+            selected_index = st.selectbox("Index", saved_indexes, key="index_selector")
+            index_manifest = get_index_store().read_manifest(selected_index)
+            st.caption(
+                f"v{index_manifest['version']} · {index_manifest['vectorstore_type']} "
+                f"({index_manifest.get('index_engine', 'Flat')}) · "
+                f"{index_manifest['embedding_type']} · {index_manifest['num_chunks']} chunks"
+            )
+
+            if st.button("Load Index", use_container_width=True):
+                if not api_key_available and index_manifest["embedding_type"] == "OpenAI":
+                    st.error("OpenAI API key required!")
+                else:
+                    try:
+                        resident = get_namespace_manager().get(selected_index, index_manifest["version"])
+                        st.session_state.qa_system.attach_vectorstore(
+                            resident.vectorstore, resident.embeddings, resident.manifest, resident.lexical_index
+                        )
+                        st.session_state.qa_system.setup_qa_chain(selected_model, TEMPERATURE, MEMORY_TYPE)
+                        st.session_state.documents_processed = True
+                        track_namespace(resident.name)
+                        st.success(f"Index loaded: {resident.name} (v{resident.version})")
+                    except Exception as e:
+                        st.error(f"Error loading index: {str(e)}")
+
+            manager = get_namespace_manager()
+            measured_rows = [row for row in manager.report() if row["memory_bytes"] is not None]
+            if measured_rows:
+                with st.expander("Index Memory"):
+                    st.caption(f"Resident: {manager.total_bytes / (1024 * 1024):.1f} MB of "
+                               f"{manager.budget_bytes / (1024 * 1024):.0f} MB · "
+                               f"{manager.loads} loads · {manager.evictions} evictions")
+                    st.table([{
+                        "Index": row["name"],
+                        "Version": row["version"],
+                        "MB": round(row["memory_bytes"] / (1024 * 1024), 1),
+                        "Resident": "yes" if row["resident"] else "no"
+                    } for row in measured_rows])
+
+        render_scope_picker(st.session_state.qa_system)
+
+        embeddings = st.session_state.qa_system.embeddings
+        if isinstance(embeddings, CachedEmbeddings):
+            st.subheader("Embedding Cache")
+            col1, col2 = st.columns(2)
+            col1.metric("Hits", embeddings.hits)
+            col2.metric("Misses", embeddings.misses)
+            st.caption(f"Cache size: {embeddings.cache.total_bytes / (1024 * 1024):.1f} MB")
+
+            if isinstance(embeddings.underlying, ScheduledEmbeddings) and embeddings.underlying.chunks_embedded:
+                scheduler = embeddings.underlying
+                st.caption(f"Embedding throughput: {scheduler.chunks_per_second:.1f} chunks/s "
+                           f"({scheduler.retries} retries)")
+
         st.divider()
 
         st.subheader("Chat Management")
@@ -341,41 +677,62 @@ def main():
 
         with col2:
             if st.button("Clear"):
-                st.session_state.chat_history = []
-                if st.session_state.qa_system.memory:
-                    st.session_state.qa_system.memory.clear()
+                reset_chat()
                 st.success("Cleared!")
                 st.rerun()
 
-        saved_files = get_saved_chat_files()
-        if saved_files:
-            st.write("**Saved Chats:**")
+        chat_store = get_chat_store()
+        chat_query = st.text_input("Search chats", placeholder="Search questions and answers")
+        if st.session_state.get("chat_query") != chat_query:
+            st.session_state.chat_query = chat_query
+            st.session_state.chat_page = 0
 
-            if 'selected_chat_file' not in st.session_state:
-                st.session_state.selected_chat_file = ""
+        total_chats = chat_store.count_conversations(chat_query)
+        if total_chats:
+            st.write(f"**Saved Chats:** {total_chats}")
 
-            selected_file = st.selectbox(
+            if 'selected_conversation' not in st.session_state:
+                st.session_state.selected_conversation = None
+
+            page_count = (total_chats + CHAT_PAGE_SIZE - 1) // CHAT_PAGE_SIZE
+            page = min(st.session_state.chat_page, page_count - 1)
+            conversations = {chat["id"]: chat for chat in chat_store.list_conversations(
+                chat_query, offset=page * CHAT_PAGE_SIZE
+            )}
+
+            selected_conversation = st.selectbox(
                 "Select chat:",
-                [""] + saved_files[:5],
-                format_func=lambda x: "Select..." if x == "" else x.replace('chat_history_', '').replace('.pkl', ''),
+                [None] + list(conversations),
+                format_func=lambda x: "Select..." if x is None else (
+                    f"{conversations[x]['title'][:40]} · {conversations[x]['updated_at'][:16].replace('T', ' ')} "
+                    f"({conversations[x]['turn_count']})"
+                ),
                 key="chat_selector"
             )
 
-            if selected_file and selected_file != st.session_state.selected_chat_file:
-                st.session_state.selected_chat_file = selected_file
-
-                if st.session_state.chat_history:
-                    save_chat_history(st.session_state.chat_history)
-
-                loaded_history = load_chat_history(selected_file)
-                st.session_state.chat_history = loaded_history
-
-                if st.session_state.qa_system.memory:
-                    st.session_state.qa_system.memory.clear()
-
+            if page_count > 1:
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                if prev_col.button("‹", disabled=page == 0):
+                    st.session_state.chat_page = page - 1
+                    st.rerun()
+                page_col.caption(f"Page {page + 1} / {page_count}")
+                if next_col.button("›", disabled=page >= page_count - 1):
+                    st.session_state.chat_page = page + 1
+                    st.rerun()
+
+            if selected_conversation is not None and selected_conversation != st.session_state.selected_conversation:
+                st.session_state.selected_conversation = selected_conversation
+                load_conversation(selected_conversation)
                 st.success("Chat loaded!")
                 st.rerun()
 
+            if selected_conversation is not None and st.button("Delete Chat"):
+                chat_store.delete_conversation(selected_conversation)
+                if st.session_state.conversation_id == selected_conversation:
+                    reset_chat()
+                st.session_state.selected_conversation = None
+                st.rerun()
+
     col1, col2 = st.columns([2, 1])
 
     with col1:
@@ -383,23 +740,18 @@ def main():
 
         chat_container = st.container()
         with chat_container:
-            for i, chat in enumerate(st.session_state.chat_history):
-                st.markdown(f"""
-                <div class="chat-message user-message">
-                    <strong>You:</strong> {chat['question']}
-                </div>
-                """, unsafe_allow_html=True)
-
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <strong>Assistant:</strong> {chat['answer']}
-                </div>
-                """, unsafe_allow_html=True)
-
-                if 'sources' in chat and chat['sources']:
-                    with st.expander(f"Sources ({len(chat['sources'])})"):
-                        for j, source in enumerate(chat['sources']):
-                            st.text(f"Source {j + 1}: {source}")
+            history = st.session_state.chat_history
+            if len(history) > st.session_state.chat_window or st.session_state.has_earlier_turns:
+                if st.button("Load earlier messages"):
+                    if len(history) <= st.session_state.chat_window:
+                        load_earlier_turns()
+                    st.session_state.chat_window += CHAT_WINDOW_SIZE
+                    st.rerun()
+
+            # Only the visible window is rendered, as a single element built from cached per-turn fragments.
+            if history:
+                visible = history[-st.session_state.chat_window:]
+                st.markdown(render_chat_window(visible), unsafe_allow_html=True)
 
         if st.session_state.documents_processed:
             with st.form("question_form", clear_on_submit=True):
@@ -411,26 +763,42 @@ def main():
                 submitted = st.form_submit_button("Send", type="primary")
 
                 if submitted and question.strip():
-                    with st.spinner("Generating answer..."):
+                    started = time.perf_counter()
+                    with chat_container:
+                        st.markdown(render_user_message(question), unsafe_allow_html=True)
+                        answer_placeholder = st.empty()
+                        answer_placeholder.markdown(render_bot_message("▌"), unsafe_allow_html=True)
+                        streaming_handler = StreamingAnswerHandler(answer_placeholder, started)
                         callback_handler = StreamlitCallbackHandler(st.container())
 
-                        result = st.session_state.qa_system.ask_question(
-                            question, callback_handler
-                        )
-
-                        if "error" in result:
-                            st.error(result["error"])
-                        else:
-                            chat_entry = {
-                                "question": question,
-                                "answer": result.get("answer", "No answer received"),
-                                "sources": [doc.page_content[:200] + "..."
-                                            for doc in result.get("source_documents", [])],
-                                "timestamp": datetime.now().isoformat()
-                            }
-
-                            st.session_state.chat_history.append(chat_entry)
-                            st.rerun()
+                    result = st.session_state.qa_system.ask_question(
+                        question, [streaming_handler, callback_handler]
+                    )
+                    total_time = time.perf_counter() - started
+
+                    if "error" in result:
+                        st.error(result["error"])
+                    else:
+                        ttft = streaming_handler.time_to_first_token
+                        last_trace = st.session_state.qa_system.tracer.last_trace
+                        chat_entry = {
+                            "question": question,
+                            "answer": result.get("answer", "No answer received"),
+                            "sources": [doc.page_content[:200] + "..."
+                                        for doc in result.get("source_documents", [])],
+                            "timestamp": datetime.now().isoformat(),
+                            "cached": result.get("cached", False),
+                            "ttft": ttft if ttft is not None else total_time,
+                            "total_time": total_time,
+                            "cost": last_trace["cost_usd"] if last_trace else None
+                        }
+
+                        save_chat_turn(chat_entry)
+                        st.session_state.chat_history.append(chat_entry)
+                        st.session_state.chat_window = CHAT_WINDOW_SIZE
+                        st.rerun()
+
+            render_batch_questions()
         else:
             st.info("Please upload and process documents first to start asking questions.")
 
@@ -440,6 +808,40 @@ def main():
         if st.session_state.documents_processed:
             st.markdown('<div class="success-box">System Ready</div>', unsafe_allow_html=True)
             st.metric("Chat Count", len(st.session_state.chat_history))
+
+            last_timed = next((chat for chat in reversed(st.session_state.chat_history)
+                               if chat.get('ttft') is not None), None)
+            if last_timed:
+                latency_col1, latency_col2 = st.columns(2)
+                latency_col1.metric("Time to First Token", f"{last_timed['ttft']:.2f}s")
+                latency_col2.metric("Answer Time", f"{last_timed['total_time']:.2f}s")
+            if st.session_state.qa_system.active_index:
+                index_name, index_version = st.session_state.qa_system.active_index
+                st.caption(f"Index: {index_name} (v{index_version})")
+
+            answer_cache = st.session_state.qa_system.answer_cache
+            if answer_cache is not None and (answer_cache.hits or answer_cache.misses):
+                cache_col1, cache_col2 = st.columns(2)
+                cache_col1.metric("Answer Cache Hits", answer_cache.hits)
+                cache_col2.metric("Cached Answers", len(answer_cache))
+
+            tracer = st.session_state.qa_system.tracer
+            stage_summary = tracer.stage_summary()
+            if stage_summary:
+                st.write("**Latency by Stage**")
+                st.table([{
+                    "Stage": row["stage"],
+                    "Last (ms)": row["last_ms"],
+                    "p50 (ms)": row["p50_ms"],
+                    "p95 (ms)": row["p95_ms"]
+                } for row in stage_summary])
+
+                last_trace = tracer.last_trace
+                cost_col1, cost_col2 = st.columns(2)
+                cost_col1.metric("Question Cost", f"${last_trace['cost_usd']:.4f}")
+                cost_col2.metric("Session Cost", f"${tracer.total_cost:.4f}")
+                st.caption(f"Last question: {last_trace['prompt_tokens']} prompt + "
+                           f"{last_trace['completion_tokens']} completion tokens")
         else:
             st.markdown('<div class="warning-box">Upload Documents</div>', unsafe_allow_html=True)
 
@@ -460,6 +862,11 @@ def main():
         - Auto-save
         """)
 
+    if jobs_active:
+        # Poll the queue while this session's jobs run; the page stays usable between reruns.
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
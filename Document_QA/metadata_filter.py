@@ -0,0 +1,256 @@
+"""Retrieval restricted to a scope: some source files, an upload date range and/or a page range.
+
+A scope is resolved to a bitmap of chunks before any vector is compared, from posting lists per source
+file and per upload time and from the page column of the chunk store. FAISS searches with the bitmap
+as an IDSelector, BM25 only ranks the chunks in it, and Chroma receives the scope as a where clause.
+"""
+import threading
+import weakref
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from chunk_store import ChunkStore
+from vector_engines import search_positions
+
+_MISSING = -(2 ** 63)
+
+
+class RetrievalScope:
+    """Which chunks retrieval may return; attributes left as None are not filtered on.
+
+    Dates are inclusive calendar days of `upload_time`. Pages are 1-based and inclusive, as shown to
+    users (the PDF loader numbers them from 0); chunks without a page, from text files, fall outside
+    any page range.
+    """
+
+    def __init__(self, source_files: Optional[Iterable[str]] = None, uploaded_from: Optional[date] = None,
+                 uploaded_to: Optional[date] = None, page_from: Optional[int] = None, page_to: Optional[int] = None):
+        self.source_files = frozenset(source_files) if source_files is not None else None
+        self.uploaded_from = uploaded_from
+        self.uploaded_to = uploaded_to
+        self.page_from = page_from
+        self.page_to = page_to
+
+    def __bool__(self) -> bool:
+        return any(value is not None for value in
+                   (self.source_files, self.uploaded_from, self.uploaded_to, self.page_from, self.page_to))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RetrievalScope) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def key(self) -> tuple:
+        return (tuple(sorted(self.source_files)) if self.source_files is not None else None,
+                self.uploaded_from.isoformat() if self.uploaded_from else None,
+                self.uploaded_to.isoformat() if self.uploaded_to else None,
+                self.page_from, self.page_to)
+
+    @property
+    def filters_upload_time(self) -> bool:
+        return self.uploaded_from is not None or self.uploaded_to is not None
+
+    @property
+    def filters_page(self) -> bool:
+        return self.page_from is not None or self.page_to is not None
+
+    def uploaded_in_range(self, upload_time: Any) -> bool:
+        if not isinstance(upload_time, str) or len(upload_time) < 10:
+            return False
+        day = upload_time[:10]
+        return ((self.uploaded_from is None or day >= self.uploaded_from.isoformat())
+                and (self.uploaded_to is None or day <= self.uploaded_to.isoformat()))
+
+    def page_bounds(self):
+        """Inclusive bounds on the 0-based `page` metadata."""
+        low = self.page_from - 1 if self.page_from is not None else None
+        high = self.page_to - 1 if self.page_to is not None else None
+        return low, high
+
+    def allowed_files(self, indexed_files: Dict[str, Dict[str, Any]]) -> Optional[List[str]]:
+        """The files that may contribute chunks, from the index manifest, or None when every file may."""
+        if self.source_files is None and not self.filters_upload_time:
+            return None
+        names = self.source_files if self.source_files is not None else indexed_files
+        return sorted(name for name in names if name in indexed_files and (
+            not self.filters_upload_time or self.uploaded_in_range(indexed_files[name].get("upload_time"))))
+
+    def describe(self) -> str:
+        parts = []
+        if self.source_files is not None:
+            parts.append(f"{len(self.source_files)} file(s)")
+        if self.filters_upload_time:
+            parts.append(f"uploaded {self.uploaded_from or '…'} – {self.uploaded_to or '…'}")
+        if self.filters_page:
+            parts.append(f"pages {self.page_from or 1} – {self.page_to or '…'}")
+        return ", ".join(parts) or "all documents"
+
+
+class MetadataIndex:
+    """Posting lists of chunk store rows per source file and per upload time, plus the page column."""
+
+    def __init__(self, store: ChunkStore):
+        self.rows = store.rows
+        self.live = len(store)
+        self._alive = store.alive()
+        self._postings = {key: self._posting_lists(store, key) for key in ("source_file", "upload_time")}
+        self._pages = self._int_column(store, "page")
+        # BM25 row -> chunk store row, per lexical index.
+        self._lexical_rows = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _posting_lists(store: ChunkStore, key: str) -> Dict[str, np.ndarray]:
+        column = store.column(key)
+        if column is None:
+            return {}
+        kind, data, values = column
+        present = np.flatnonzero(data != _MISSING)
+        codes = data[present]
+        if kind == "int":
+            unique, codes = np.unique(codes, return_inverse=True)
+            values = unique.tolist()
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        return {str(value): present[order[bounds[code]:bounds[code + 1]]]
+                for code, value in enumerate(values) if bounds[code] < bounds[code + 1]}
+
+    @staticmethod
+    def _int_column(store: ChunkStore, key: str) -> np.ndarray:
+        column = store.column(key)
+        if column is None:
+            return np.full(store.rows, _MISSING, dtype=np.int64)
+        kind, data, values = column
+        if kind == "int":
+            return data
+        # Codes of interned values; only the integer ones are pages.
+        lookup = np.array([value if isinstance(value, int) and not isinstance(value, bool) else _MISSING
+                           for value in values] + [_MISSING], dtype=np.int64)
+        return lookup[np.where(data == _MISSING, -1, data)]
+
+    def _union(self, key: str, values: Iterable[str]) -> np.ndarray:
+        selected = np.zeros(self.rows, dtype=bool)
+        postings = self._postings[key]
+        for value in values:
+            rows = postings.get(value)
+            if rows is not None:
+                selected[rows] = True
+        return selected
+
+    def mask(self, scope: RetrievalScope) -> np.ndarray:
+        """Bitmap over chunk store rows of the live chunks within the scope."""
+        mask = self._alive.copy()
+        if scope.source_files is not None:
+            mask &= self._union("source_file", scope.source_files)
+        if scope.filters_upload_time:
+            mask &= self._union("upload_time", [value for value in self._postings["upload_time"]
+                                                if scope.uploaded_in_range(value)])
+        if scope.filters_page:
+            low, high = scope.page_bounds()
+            pages = self._pages
+            mask &= pages != _MISSING
+            if low is not None:
+                mask &= pages >= low
+            if high is not None:
+                mask &= pages <= high
+        return mask
+
+    def lexical_rows(self, store: ChunkStore, lexical_index) -> np.ndarray:
+        # The store is passed in rather than kept: the cache of indexes holds it only weakly.
+        with self._lock:
+            rows = self._lexical_rows.get(lexical_index)
+            if rows is None or len(rows) != len(lexical_index.doc_ids):
+                rows = np.fromiter((_row_or_missing(store, chunk_id) for chunk_id in lexical_index.doc_ids),
+                                   dtype=np.int64, count=len(lexical_index.doc_ids))
+                self._lexical_rows[lexical_index] = rows
+            return rows
+
+
+def _row_or_missing(store: ChunkStore, chunk_id: str) -> int:
+    row = store.row_of(chunk_id)
+    return -1 if row is None else row
+
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def metadata_index(store: ChunkStore) -> MetadataIndex:
+    """The metadata index of a store, built on first use and again once chunks were added or deleted."""
+    with _indexes_lock:
+        index = _indexes.get(store)
+        if index is None or index.rows != store.rows or index.live != len(store):
+            index = _indexes[store] = MetadataIndex(store)
+        return index
+
+
+class ScopeFilter:
+    """A scope bound to one loaded index, resolved once into what each search engine consumes."""
+
+    def __init__(self, scope: RetrievalScope, vectorstore, lexical_index=None,
+                 indexed_files: Dict[str, Dict[str, Any]] = None):
+        self.scope = scope
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.indexed_files = indexed_files or {}
+        self._positions = None
+        self._lexical_mask = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_faiss(self) -> bool:
+        return isinstance(getattr(self.vectorstore, "docstore", None), ChunkStore)
+
+    def positions(self) -> np.ndarray:
+        """Bitmap over FAISS positions."""
+        with self._lock:
+            if self._positions is None:
+                store = self.vectorstore.docstore
+                rows = np.array(self.vectorstore.index_to_docstore_id.rows, dtype=np.int64)
+                self._positions = metadata_index(store).mask(self.scope)[rows]
+            return self._positions
+
+    def lexical_mask(self) -> np.ndarray:
+        """Bitmap over BM25 rows."""
+        with self._lock:
+            if self._lexical_mask is None:
+                if self.is_faiss:
+                    store = self.vectorstore.docstore
+                    index = metadata_index(store)
+                    rows = index.lexical_rows(store, self.lexical_index)
+                    allowed = index.mask(self.scope)
+                    self._lexical_mask = np.where(rows >= 0, allowed[np.maximum(rows, 0)], False)
+                else:
+                    # Chroma's own metadata index answers the where clause; BM25 keeps the matching ids.
+                    ids = self.vectorstore._collection.get(where=self.where(), include=[])["ids"]
+                    self._lexical_mask = self.lexical_index.row_mask(ids)
+            return self._lexical_mask
+
+    def where(self) -> Optional[Dict[str, Any]]:
+        """Chroma where clause; upload dates are resolved to files through the index manifest."""
+        conditions = []
+        files = self.scope.allowed_files(self.indexed_files)
+        if files is not None:
+            if not files:
+                # No file is in scope; a where clause that matches nothing.
+                return {"source_file": {"$in": [""]}}
+            conditions.append({"source_file": {"$in": files}})
+        low, high = self.scope.page_bounds()
+        if low is not None:
+            conditions.append({"page": {"$gte": low}})
+        if high is not None:
+            conditions.append({"page": {"$lte": high}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def search_faiss(self, index, vectors: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k nearest in-scope vectors for every row of `vectors`, padded with -1.
+
+        Scopes of at most `vector_engines.FILTER_EXACT_MAX` chunks are searched exactly over just their vectors.
+        """
+        _, positions = search_positions(index, vectors, k, self.positions())
+        return positions
@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from index_store import IndexStore
+
+logger = logging.getLogger(__name__)
+
+# Estimated bytes all resident namespaces may use together; the least recently used ones are evicted beyond it.
+NAMESPACE_MEMORY_BUDGET = int(os.getenv("NAMESPACE_MEMORY_BUDGET", str(2 * 1024 * 1024 * 1024)))
+
+
+def _directory_bytes(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def measure_memory(index_store: IndexStore, vectorstore, manifest: Dict[str, Any],
+                   lexical_index=None) -> Dict[str, int]:
+    """Estimated resident bytes of a loaded index, by component."""
+    path = index_store.version_dir(manifest["name"], manifest["version"])
+    if manifest["vectorstore_type"] == "FAISS":
+        # The index file is the serialized index, so its size is what the mapped or loaded index occupies.
+        # Chunk texts are memory-mapped too and count separately from the ids and metadata columns.
+        memory = {"vectors": os.path.getsize(os.path.join(path, "index.faiss")),
+                  "docstore": vectorstore.docstore.memory_bytes() + vectorstore.index_to_docstore_id.memory_bytes(),
+                  "texts": vectorstore.docstore.mapped_bytes()}
+    else:
+        memory = {"vectors": _directory_bytes(os.path.join(path, "chroma")), "docstore": 0, "texts": 0}
+    memory["lexical"] = lexical_index.memory_bytes() if lexical_index is not None else 0
+    return memory
+
+
+class ResidentIndex:
+    """A loaded namespace: its vector store, embeddings, manifest and lexical index."""
+
+    def __init__(self, vectorstore, embeddings, manifest: Dict[str, Any], lexical_index, memory: Dict[str, int]):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.manifest = manifest
+        self.lexical_index = lexical_index
+        self.memory = memory
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.hits = 0
+
+    @property
+    def name(self) -> str:
+        return self.manifest["name"]
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"]
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(self.memory.values())
+
+
+class NamespaceManager:
+    """Keeps the recently used namespaces (named indexes of the IndexStore) resident under a RAM budget.
+
+    A namespace is loaded on first use and shared by every session and conversation of the process.
+    Once the estimated memory of all resident namespaces exceeds `budget_bytes`, the least recently
+    used ones are evicted; the namespace just loaded is always kept, even when it alone exceeds the
+    budget. Eviction only drops the manager's reference: listeners are told so they can release
+    theirs, and the next `get` loads the namespace again.
+    """
+
+    def __init__(self, index_store: IndexStore, load_embeddings: Callable[[str], Any],
+                 budget_bytes: int = NAMESPACE_MEMORY_BUDGET):
+        self.index_store = index_store
+        self.load_embeddings = load_embeddings
+        self.budget_bytes = budget_bytes
+        self.loads = 0
+        self.evictions = 0
+        self._resident: "OrderedDict[str, ResidentIndex]" = OrderedDict()
+        # Last measured size of every namespace seen, resident or not, for capacity planning.
+        self._measured: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(resident.memory_bytes for resident in self._resident.values())
+
+    def add_eviction_listener(self, listener: Callable[[str], None]):
+        self._listeners.append(listener)
+
+    def resident(self, name: str) -> Optional[ResidentIndex]:
+        with self._lock:
+            return self._resident.get(name)
+
+    def _lookup(self, name: str, version: Optional[int]) -> Optional[ResidentIndex]:
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is None or (version is not None and resident.version != version):
+                return None
+            self._resident.move_to_end(name)
+            resident.last_used = time.time()
+            resident.hits += 1
+            return resident
+
+    def get(self, name: str, version: Optional[int] = None) -> ResidentIndex:
+        """The resident namespace, loading `version` (default: the latest) from disk when it is not resident."""
+        resident = self._lookup(name, version)
+        if resident is not None:
+            return resident
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        # Concurrent requests for a cold namespace wait for one load instead of each reading it.
+        with load_lock:
+            resident = self._lookup(name, version)
+            if resident is not None:
+                return resident
+
+            started = time.perf_counter()
+            manifest = self.index_store.read_manifest(name, version)
+            embeddings = self.load_embeddings(manifest["embedding_type"])
+            vectorstore, manifest = self.index_store.load(name, embeddings, manifest["version"])
+            lexical_index = self.index_store.load_lexical(name, manifest["version"])
+            resident = self.put(vectorstore, embeddings, manifest, lexical_index)
+            self.loads += 1
+            logger.info("Loaded namespace %s v%d (%.1f MB) in %.2fs", name, resident.version,
+                        resident.memory_bytes / (1024 * 1024), time.perf_counter() - started)
+            return resident
+
+    def put(self, vectorstore, embeddings, manifest: Dict[str, Any], lexical_index=None) -> ResidentIndex:
+        """Makes a committed version resident, e.g. right after it was built or updated."""
+        memory = measure_memory(self.index_store, vectorstore, manifest, lexical_index)
+        resident = ResidentIndex(vectorstore, embeddings, manifest, lexical_index, memory)
+        with self._lock:
+            self._resident[resident.name] = resident
+            self._resident.move_to_end(resident.name)
+            self._measured[resident.name] = {"version": resident.version, "memory": dict(resident.memory)}
+            evicted = self._evict_over_budget()
+
+        for name in evicted:
+            self._notify(name)
+        return resident
+
+    def _evict_over_budget(self) -> List[str]:
+        evicted = []
+        total = sum(resident.memory_bytes for resident in self._resident.values())
+        while total > self.budget_bytes and len(self._resident) > 1:
+            name, resident = self._resident.popitem(last=False)
+            total -= resident.memory_bytes
+            evicted.append(name)
+            self.evictions += 1
+            logger.info("Evicted namespace %s (%.1f MB)", name, resident.memory_bytes / (1024 * 1024))
+        return evicted
+
+    def evict(self, name: str) -> bool:
+        with self._lock:
+            resident = self._resident.pop(name, None)
+            if resident is not None:
+                self.evictions += 1
+        if resident is None:
+            return False
+        self._notify(name)
+        return True
+
+    def _notify(self, name: str):
+        for listener in self._listeners:
+            try:
+                listener(name)
+            except Exception as e:
+                logger.warning("Eviction listener failed for %s: %s", name, e)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Per-namespace memory of every namespace on disk; sizes of non-resident ones are from their last load."""
+        with self._lock:
+            resident = dict(self._resident)
+            measured = dict(self._measured)
+
+        rows = []
+        for name in sorted(set(self.index_store.list_indexes()) | set(resident)):
+            entry = resident.get(name)
+            last = measured.get(name)
+            memory = entry.memory if entry is not None else (last["memory"] if last else None)
+            rows.append({
+                "name": name,
+                "resident": entry is not None,
+                "version": entry.version if entry is not None else (last["version"] if last else None),
+                "memory_bytes": sum(memory.values()) if memory else None,
+                "memory": memory,
+                "hits": entry.hits if entry is not None else 0,
+                "last_used": entry.last_used if entry is not None else None
+            })
+        return rows
@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", os.path.join(".cache", "pages.sqlite3"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+Page = Tuple[str, Optional[int]]
+
+
+class PageCache:
+    """Parsed page text keyed by the sha256 of the uploaded file, with LRU eviction.
+
+    Pages are written per parse task as they arrive; a file only becomes visible to `get`
+    once `complete` has recorded that all of its tasks were stored.
+    """
+
+    def __init__(self, path: str = PAGE_CACHE_PATH, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_hash TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_last_access ON files (last_access);
+
+            CREATE TABLE IF NOT EXISTS pages (
+                file_hash TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                pages TEXT NOT NULL,
+                UNIQUE (file_hash, start)
+            );
+        """)
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def get(self, digest: str) -> Optional[List[Page]]:
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM files WHERE file_hash = ?", (digest,)).fetchone() is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT pages FROM pages WHERE file_hash = ? ORDER BY start", (digest,)
+            ).fetchall()
+            self._conn.execute("UPDATE files SET last_access = ? WHERE file_hash = ?", (time.time(), digest))
+
+        return [(text, page) for row in rows for text, page in json.loads(row[0])]
+
+    def get_tasks(self, digest: str) -> Dict[int, List[Page]]:
+        """Pages stored so far per task start, also for files whose parse has not completed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT start, pages FROM pages WHERE file_hash = ?", (digest,)).fetchall()
+        return {start: [(text, page) for text, page in json.loads(pages)] for start, pages in rows}
+
+    def put_task(self, digest: str, start: int, pages: List[Page]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (file_hash, start, pages) VALUES (?, ?, ?)",
+                (digest, start, json.dumps(pages, ensure_ascii=False))
+            )
+
+    def complete(self, digest: str, kind: str):
+        with self._lock:
+            size = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(pages AS BLOB))), 0) FROM pages WHERE file_hash = ?", (digest,)
+            ).fetchone()[0]
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO files (file_hash, kind, size, last_access) VALUES (?, ?, ?, ?)",
+                (digest, kind, size, time.time())
+            )
+            if cursor.rowcount:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def discard(self, digest: str):
+        """Drops the partial pages of a file whose parse failed."""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM files WHERE file_hash = ?", (digest,)).fetchone() is None:
+                self._conn.execute("DELETE FROM pages WHERE file_hash = ?", (digest,))
+
+    def _evict(self):
+        # Free down to 90% of the budget so eviction does not run on every insert.
+        target = int(self.max_bytes * 0.9)
+        victims = []
+        freed = 0
+
+        for digest, size in self._conn.execute("SELECT file_hash, size FROM files ORDER BY last_access"):
+            if self._total_bytes - freed <= target:
+                break
+            victims.append((digest,))
+            freed += size
+
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany("DELETE FROM files WHERE file_hash = ?", victims)
+            self._conn.executemany("DELETE FROM pages WHERE file_hash = ?", victims)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._total_bytes -= freed
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM pages")
+            self._total_bytes = 0
@@ -0,0 +1,624 @@
+import copy
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_scheduler import (ScheduledEmbeddings, get_rate_limiter, EMBEDDING_RPM, EMBEDDING_TPM,
+                                 EMBEDDING_LOCAL_WORKERS)
+from index_store import IndexStore, VectorstoreWriter
+from ingest import IngestFile, IngestionPipeline, IngestStats, spool_upload
+from bm25 import BM25Index
+from text_splitter import StructuredTextSplitter
+from retrievers import (HybridRetriever, PackedRetriever, ScopedRetriever, batch_similarity_search, fuse_hybrid,
+                        pack_documents, CONTEXT_FETCH_K, CONTEXT_TOKEN_BUDGET, RETRIEVER_FETCH_K)
+from metadata_filter import RetrievalScope, ScopeFilter
+from reranker import get_reranker, RERANK_FETCH_K, RERANK_TOP_N
+from answer_cache import ANSWER_CACHE_THRESHOLD
+from vector_engines import delete_vectors
+from tracing import Tracer, get_span_exporter
+
+logger = logging.getLogger(__name__)
+
+# Tokens (cl100k_base); roughly the 1000/200 characters used before chunking by tokens.
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+TEMPERATURE = 0.7
+# "Window": recent turns up to MEMORY_TOKEN_LIMIT tokens plus a background summary of older ones;
+# "Buffer": the whole conversation verbatim.
+MEMORY_TYPE = os.getenv("MEMORY_TYPE", "Window")
+# Concurrent LLM calls of a question batch; set it near the backend's rate limit.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+HUGGINGFACE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_huggingface_models = {}
+_huggingface_lock = threading.Lock()
+
+# Backends (OpenAI, HuggingFace/torch, FAISS, Chroma, chains) are imported where they are first used,
+# so starting the app or a worker only pays for the ones the selected settings need.
+
+
+def get_huggingface_embeddings(model_name: str = HUGGINGFACE_MODEL):
+    # Loading the model takes seconds and hundreds of MB, so one instance serves the whole process.
+    with _huggingface_lock:
+        embeddings = _huggingface_models.get(model_name)
+        if embeddings is None:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            embeddings = _huggingface_models[model_name] = HuggingFaceEmbeddings(model_name=model_name)
+        return embeddings
+
+
+def build_embeddings(embedding_type: str, embedding_cache: EmbeddingCache = None, api_key: str = None):
+    if embedding_type == "OpenAI":
+        from langchain_openai import OpenAIEmbeddings
+        # Without `api_key`, OPENAI_API_KEY from the environment.
+        embeddings = OpenAIEmbeddings(api_key=api_key) if api_key else OpenAIEmbeddings()
+        model_key = f"openai:{embeddings.model}"
+        embeddings = ScheduledEmbeddings(
+            embeddings, rate_limiter=get_rate_limiter(model_key, EMBEDDING_RPM, EMBEDDING_TPM)
+        )
+    elif embedding_type == "Fake":
+        from fake_models import FakeEmbeddings
+        embeddings = FakeEmbeddings()
+        model_key = f"fake:{embeddings.dimensions}"
+        embeddings = ScheduledEmbeddings(embeddings, local_workers=EMBEDDING_LOCAL_WORKERS)
+    else:
+        embeddings = get_huggingface_embeddings()
+        model_key = f"huggingface:{HUGGINGFACE_MODEL}"
+        embeddings = ScheduledEmbeddings(embeddings, local_workers=EMBEDDING_LOCAL_WORKERS)
+
+    if embedding_cache is not None:
+        embeddings = CachedEmbeddings(embeddings, model_key, embedding_cache)
+    return embeddings, model_key
+
+
+def make_llm(model_name: str, temperature: float, http_client=None):
+    if model_name == "fake":
+        from fake_models import make_fake_llm
+        return make_fake_llm()
+    if model_name.startswith("gpt-3.5") or model_name.startswith("gpt-4"):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model_name=model_name,
+            temperature=temperature,
+            streaming=True,
+            http_client=http_client
+        )
+    from langchain_openai import OpenAI
+    return OpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        streaming=True,
+        http_client=http_client
+    )
+
+
+class DocumentQASystem:
+    def __init__(self):
+        self.vectorstore = None
+        self.qa_chain = None
+        self.memory = None
+        self.embeddings = None
+        self.embedding_model = None
+        self.embedding_type = None
+        self.vectorstore_type = None
+        self.index_engine = "Flat"
+        self.exact_rerank = False
+        self.active_index = None
+        self.indexed_files = {}
+        self.lexical_index = None
+        self.hybrid_search = True
+        self.context_token_budget = CONTEXT_TOKEN_BUDGET
+        self.reranker = None
+        self.model_name = None
+        self.answer_cache = None
+        self.page_cache = None
+        self.answer_cache_threshold = ANSWER_CACHE_THRESHOLD
+        self.verbose = True
+        self.tracer = Tracer(get_span_exporter())
+        self.llm = None
+        self.memory_type = MEMORY_TYPE
+        self.scope = None
+
+    def spool_uploads(self, uploaded_files: List) -> Tuple[List[IngestFile], List[Tuple[str, str]],
+                                                           List[Tuple[str, str]]]:
+        """Streams uploads to disk while hashing them; byte-identical uploads are dropped before parsing.
+
+        Returns the files to ingest (with cached pages attached when the page cache knows the content),
+        (name, identical earlier upload) pairs for the dropped duplicates and (name, error) pairs.
+        """
+        files = []
+        duplicates = []
+        errors = []
+        seen = {}
+        try:
+            for uploaded_file in uploaded_files:
+                if not uploaded_file.name.endswith(('.pdf', '.txt')):
+                    errors.append((uploaded_file.name, "Unsupported file format"))
+                    continue
+
+                path, digest, owned = spool_upload(uploaded_file)
+                if digest in seen:
+                    if owned:
+                        os.unlink(path)
+                    duplicates.append((uploaded_file.name, seen[digest]))
+                    continue
+                seen[digest] = uploaded_file.name
+
+                pages = self.page_cache.get(digest) if self.page_cache is not None else None
+                files.append(IngestFile(path, uploaded_file.name, {
+                    'source_file': uploaded_file.name,
+                    'upload_time': datetime.now().isoformat(),
+                    'file_hash': digest
+                }, owned=owned, pages=pages))
+        except BaseException:
+            for ingest_file in files:
+                ingest_file.release()
+            raise
+        return files, duplicates, errors
+
+    def load_documents(self, uploaded_files: List) -> List[Document]:
+        from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+        documents = []
+        files, duplicates, errors = self.spool_uploads(uploaded_files)
+        for name, error in errors:
+            logger.warning("%s: %s", error, name)
+        for name, original in duplicates:
+            logger.info("Skipping %s: identical to %s", name, original)
+
+        for ingest_file in files:
+            try:
+                if ingest_file.pages is not None:
+                    file_documents = [
+                        Document(page_content=text, metadata={"source": ingest_file.path, "page": page}
+                                 if page is not None else {"source": ingest_file.path})
+                        for text, page in ingest_file.pages
+                    ]
+                else:
+                    if ingest_file.kind == 'pdf':
+                        loader = PyPDFLoader(ingest_file.path)
+                    else:
+                        loader = TextLoader(ingest_file.path, encoding='utf-8')
+                    file_documents = loader.load()
+
+                    if self.page_cache is not None:
+                        digest = ingest_file.metadata['file_hash']
+                        self.page_cache.put_task(digest, 0, [(doc.page_content, doc.metadata.get('page'))
+                                                             for doc in file_documents])
+                        self.page_cache.complete(digest, ingest_file.kind)
+
+                for doc in file_documents:
+                    doc.metadata.update(ingest_file.metadata)
+
+                documents.extend(file_documents)
+
+            except Exception as e:
+                logger.error("Error loading file: %s - %s", ingest_file.name, e)
+            finally:
+                ingest_file.release()
+
+        return documents
+
+    def ingest_files(self, files: List[IngestFile], writer: VectorstoreWriter, chunk_size: int, chunk_overlap: int,
+                     on_progress=None) -> IngestStats:
+        try:
+            pipeline = IngestionPipeline(self.make_text_splitter(chunk_size, chunk_overlap), writer.embeddings,
+                                         page_cache=self.page_cache)
+            stats = pipeline.run(files, writer, on_progress)
+            writer.close()
+        finally:
+            for ingest_file in files:
+                ingest_file.release()
+        return stats
+
+    def make_text_splitter(self, chunk_size: int, chunk_overlap: int):
+        return StructuredTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def split_documents(self, documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
+        text_splitter = self.make_text_splitter(chunk_size, chunk_overlap)
+
+        split_docs = text_splitter.split_documents(documents)
+        return split_docs
+
+    def build_vectorstore(self, uploaded_files: List, embedding_type: str, vectorstore_type: str,
+                          chunk_size: int, chunk_overlap: int, embedding_cache: EmbeddingCache = None,
+                          persist_directory: str = None, on_progress=None, index_engine: str = "Flat",
+                          exact_rerank: bool = False, api_key: str = None) -> IngestStats:
+        embeddings, embedding_model = build_embeddings(embedding_type, embedding_cache, api_key)
+        writer = VectorstoreWriter(vectorstore_type, embeddings, persist_directory=persist_directory,
+                                   lexical_index=BM25Index(), index_engine=index_engine, exact_rerank=exact_rerank)
+        files, duplicates, errors = self.spool_uploads(uploaded_files)
+        stats = self.ingest_files(files, writer, chunk_size, chunk_overlap, on_progress)
+        stats.errors.extend(errors)
+        stats.duplicates.extend(duplicates)
+
+        if writer.vectorstore is not None:
+            self.vectorstore = writer.vectorstore
+            self.embeddings = embeddings
+            self.embedding_model = embedding_model
+            self.embedding_type = embedding_type
+            self.vectorstore_type = vectorstore_type
+            self.index_engine = index_engine if vectorstore_type == "FAISS" else "Flat"
+            self.exact_rerank = exact_rerank and vectorstore_type == "FAISS"
+            if writer.engine_used not in (None, index_engine):
+                logger.info("Too few vectors for %s, built a %s index instead", index_engine, writer.engine_used)
+            self.indexed_files = writer.files
+            self.lexical_index = writer.lexical_index
+        return stats
+
+    def attach_vectorstore(self, vectorstore, embeddings, manifest: Dict[str, Any], lexical_index=None):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.embeddings = embeddings
+        self.embedding_model = manifest["embedding_model"]
+        self.embedding_type = manifest["embedding_type"]
+        self.vectorstore_type = manifest["vectorstore_type"]
+        self.index_engine = manifest.get("index_engine", "Flat")
+        self.exact_rerank = manifest.get("exact_rerank", False)
+        self.active_index = (manifest["name"], manifest["version"])
+        self.indexed_files = manifest.get("files", {})
+        self._refresh_retriever()
+
+    def swap_index(self, vectorstore, embeddings, manifest: Dict[str, Any], lexical_index=None):
+        """Switches to a version committed elsewhere, e.g. by the ingestion worker, keeping the conversation.
+
+        The chain's retriever is replaced by one assignment, so a question is answered wholly from the old
+        or wholly from the new version; cached answers of other versions of the index are dropped.
+        """
+        self.attach_vectorstore(vectorstore, embeddings, manifest, lexical_index)
+        if self.answer_cache is not None:
+            index_name, version = self.active_index
+            self.answer_cache.invalidate(lambda scope: scope[0] == index_name and scope[1] != version)
+
+    def release_index(self):
+        """Drops this system's references to its index so an evicted namespace can be freed.
+
+        The conversation memory is kept; attaching an index again rebuilds the chain around it.
+        """
+        self.vectorstore = None
+        self.lexical_index = None
+        self.indexed_files = {}
+        self.active_index = None
+        self.qa_chain = None
+
+    def _refresh_retriever(self):
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+        elif self.memory is not None and self.llm is not None:
+            self._build_chain(keep_memory=True)
+
+    def save_vectorstore(self, index_store: IndexStore, index_name: str, version: int) -> Dict[str, Any]:
+        manifest = index_store.commit(
+            index_name, version, self.vectorstore, self.vectorstore_type,
+            self.embedding_type, self.embedding_model, extra=self._manifest_extra(self.indexed_files),
+            lexical_index=self.lexical_index
+        )
+        self.active_index = (manifest["name"], manifest["version"])
+        return manifest
+
+    def _manifest_extra(self, indexed_files: Dict[str, Any]) -> Dict[str, Any]:
+        return {"files": indexed_files, "index_engine": self.index_engine, "exact_rerank": self.exact_rerank}
+
+    def update_vectorstore(self, uploaded_files: List, removed_files: List[str], index_store: IndexStore,
+                           chunk_size: int, chunk_overlap: int, on_progress=None) -> Dict[str, Any]:
+        index_name, source_version = self.active_index
+
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "errors": [], "duplicates": []}
+        pending = []
+        stale_files = set()
+
+        for name in removed_files:
+            if name in self.indexed_files:
+                stale_files.add(name)
+                stats["removed"] += 1
+
+        files, stats["duplicates"], stats["errors"] = self.spool_uploads(uploaded_files)
+        indexed_hashes = {entry["hash"]: name for name, entry in self.indexed_files.items()}
+        for ingest_file in files:
+            entry = self.indexed_files.get(ingest_file.name)
+            digest = ingest_file.metadata.get('file_hash')
+            if entry is not None and entry["hash"] == digest:
+                stats["unchanged"] += 1
+                ingest_file.release()
+                continue
+            if indexed_hashes.get(digest) not in (None, ingest_file.name, *stale_files):
+                # The same bytes are already indexed under another name.
+                stats["duplicates"].append((ingest_file.name, indexed_hashes[digest]))
+                ingest_file.release()
+                continue
+            if entry is None:
+                stats["added"] += 1
+            else:
+                stats["updated"] += 1
+                stale_files.add(ingest_file.name)
+            pending.append(ingest_file)
+
+        if not pending and not stale_files:
+            return stats
+
+        version = None
+        try:
+            # Only the delta is loaded and embedded, into a clone; the live index keeps answering meanwhile.
+            version = index_store.allocate_version(index_name)
+            updated = index_store.clone(
+                self.vectorstore, self.vectorstore_type, self.embeddings, index_name, source_version, version
+            )
+
+            lexical_index = self.lexical_index.copy() if self.lexical_index is not None else None
+
+            stale_ids = [chunk_id for name in stale_files for chunk_id in self.indexed_files[name]["chunk_ids"]]
+            if stale_ids:
+                if self.vectorstore_type == "FAISS":
+                    delete_vectors(updated, stale_ids)
+                else:
+                    updated.delete(stale_ids)
+                if lexical_index is not None:
+                    lexical_index.remove(stale_ids)
+
+            writer = VectorstoreWriter(self.vectorstore_type, self.embeddings, vectorstore=updated,
+                                       lexical_index=lexical_index)
+            if pending:
+                ingest_stats = self.ingest_files(pending, writer, chunk_size, chunk_overlap, on_progress)
+                stats["errors"].extend(ingest_stats.errors)
+
+            indexed_files = {name: entry for name, entry in self.indexed_files.items() if name not in stale_files}
+            indexed_files.update(writer.files)
+
+            manifest = index_store.commit(
+                index_name, version, updated, self.vectorstore_type,
+                self.embedding_type, self.embedding_model, extra=self._manifest_extra(indexed_files),
+                lexical_index=lexical_index
+            )
+        except BaseException:
+            # A failed or cancelled update leaves no half-written version behind.
+            if version is not None:
+                index_store.discard_version(index_name, version)
+            raise
+        finally:
+            # Spooled copies of files that never reached the pipeline.
+            for ingest_file in pending:
+                ingest_file.release()
+
+        self.vectorstore = updated
+        self.lexical_index = lexical_index
+        self.indexed_files = indexed_files
+        self.active_index = (manifest["name"], manifest["version"])
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(lambda scope: scope[0] == index_name and scope[1] != manifest["version"])
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+        return stats
+
+    def set_hybrid_search(self, enabled: bool):
+        self.hybrid_search = enabled
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+
+    def set_context_token_budget(self, token_budget: int):
+        self.context_token_budget = token_budget
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+
+    def set_reranking(self, enabled: bool):
+        # Loading the cross-encoder is slow, so it happens here rather than on the first question.
+        self.reranker = get_reranker() if enabled else None
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+
+    def set_scope(self, scope: Optional[RetrievalScope]):
+        """Restricts retrieval to some files, upload dates or pages; None or an empty scope searches everything."""
+        self.scope = scope or None
+        if self.qa_chain:
+            self.qa_chain.retriever = self._make_retriever()
+
+    def _scope_filter(self) -> Optional[ScopeFilter]:
+        if self.scope is None or self.vectorstore is None:
+            return None
+        return ScopeFilter(self.scope, self.vectorstore, self.lexical_index, self.indexed_files)
+
+    def _make_retriever(self):
+        fetch_k = RERANK_FETCH_K if self.reranker is not None else CONTEXT_FETCH_K
+        scope_filter = self._scope_filter()
+        if self.hybrid_search and self.lexical_index is not None:
+            retriever = HybridRetriever(vectorstore=self.vectorstore, lexical_index=self.lexical_index,
+                                        k=fetch_k, fetch_k=max(fetch_k, RETRIEVER_FETCH_K), scope_filter=scope_filter)
+        elif scope_filter is not None:
+            retriever = ScopedRetriever(vectorstore=self.vectorstore, scope_filter=scope_filter, k=fetch_k)
+        else:
+            retriever = self.vectorstore.as_retriever(search_kwargs={"k": fetch_k})
+        return PackedRetriever(retriever=retriever, token_budget=self.context_token_budget,
+                               count_tokens=self.tracer.count_tokens, reranker=self.reranker,
+                               rerank_top_n=RERANK_TOP_N)
+
+    def setup_qa_chain(self, model_name: str, temperature: float, memory_type: str, llm=None):
+        self.model_name = model_name
+        self.memory_type = memory_type
+        self.llm = llm if llm is not None else make_llm(model_name, temperature)
+        self._build_chain()
+
+    def _make_memory(self):
+        from langchain.memory import ConversationBufferMemory
+        from conversation_memory import RollingSummaryMemory
+
+        if self.memory_type == "Buffer":
+            return ConversationBufferMemory(
+                memory_key="chat_history",
+                return_messages=True,
+                output_key="answer"
+            )
+        return RollingSummaryMemory(
+            llm=self.llm,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer",
+            count_tokens=self.tracer.count_tokens
+        )
+
+    def _build_chain(self, keep_memory: bool = False):
+        from langchain.chains import ConversationalRetrievalChain
+        from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+        from langchain.chains.question_answering import load_qa_chain
+        from conversation_memory import CondenseQuestionChain, get_condense_cache
+
+        if not keep_memory or self.memory is None:
+            self.memory = self._make_memory()
+
+        # What from_llm builds, except that the question generator skips or caches condensation.
+        self.qa_chain = ConversationalRetrievalChain(
+            combine_docs_chain=load_qa_chain(self.llm, chain_type="stuff", verbose=self.verbose),
+            question_generator=CondenseQuestionChain(llm=self.llm, prompt=CONDENSE_QUESTION_PROMPT,
+                                                     cache=get_condense_cache(), verbose=self.verbose),
+            retriever=self._make_retriever(),
+            memory=self.memory,
+            return_source_documents=True,
+            return_generated_question=True,
+            verbose=self.verbose
+        )
+
+    def fork(self) -> "DocumentQASystem":
+        # A new conversation over the same index, embeddings and LLM client, with its own memory.
+        conversation = copy.copy(self)
+        if self.qa_chain:
+            conversation._build_chain()
+        return conversation
+
+    def share_index_from(self, other: "DocumentQASystem"):
+        self.vectorstore = other.vectorstore
+        self.lexical_index = other.lexical_index
+        self.embeddings = other.embeddings
+        self.embedding_model = other.embedding_model
+        self.embedding_type = other.embedding_type
+        self.vectorstore_type = other.vectorstore_type
+        self.index_engine = other.index_engine
+        self.exact_rerank = other.exact_rerank
+        self.active_index = other.active_index
+        self.indexed_files = other.indexed_files
+        self._refresh_retriever()
+
+    def ask_question(self, question: str, callbacks: List = None) -> Dict[str, Any]:
+        from conversation_memory import is_self_contained
+
+        if not self.qa_chain:
+            return {"error": "QA system not initialized"}
+
+        trace = self.tracer.start(question, self.model_name, self.embedding_model)
+        try:
+            scope = self._answer_cache_scope()
+            vector = None
+
+            # A first question, or a follow-up that does not lean on the conversation, is standalone as asked.
+            if scope is not None and (not self.memory.chat_memory.messages or is_self_contained(question)):
+                with trace.span("answer_cache") as span:
+                    vector = self.embeddings.embed_query(question)
+                    cached = self.answer_cache.lookup(scope, vector, self.answer_cache_threshold)
+                    span["hit"] = cached is not None
+                if cached is not None:
+                    self.memory.save_context({"question": question}, {"answer": cached["answer"]})
+                    trace.finish(cached=True)
+                    return {"question": question, "cached": True, "trace_id": trace.trace_id, **cached}
+
+            result = self.qa_chain(
+                {"question": question},
+                callbacks=list(callbacks or []) + [trace]
+            )
+
+            if scope is not None:
+                with trace.span("answer_cache.store"):
+                    standalone = result.get("generated_question") or question
+                    if vector is None or standalone != question:
+                        vector = self.embeddings.embed_query(standalone)
+                    self.answer_cache.store(scope, standalone, vector, result)
+            trace.finish()
+            return {**result, "trace_id": trace.trace_id}
+        except Exception as e:
+            trace.finish(error=str(e))
+            return {"error": f"Error asking question: {str(e)}"}
+
+    def ask_batch(self, questions: List[str], concurrency: int = BATCH_CONCURRENCY) -> Iterator[Dict[str, Any]]:
+        """Answers standalone questions, without conversation memory, yielding each result as it completes.
+
+        All questions are embedded in one batched call and searched with one matrix search; lexical fusion,
+        re-ranking, packing and the LLM call of each question then run on up to `concurrency` threads.
+        Each result carries the position of its question as `index`.
+        """
+        if not self.qa_chain:
+            raise RuntimeError("QA system not initialized")
+        if not questions:
+            return
+
+        fetch_k = RERANK_FETCH_K if self.reranker is not None else CONTEXT_FETCH_K
+        hybrid = self.hybrid_search and self.lexical_index is not None
+        search_k = max(fetch_k, RETRIEVER_FETCH_K) if hybrid else fetch_k
+        vectors = np.asarray(self.embeddings.embed_documents(questions), dtype=np.float32)
+        scope_filter = self._scope_filter()
+        dense_docs = batch_similarity_search(self.vectorstore, vectors, search_k, scope_filter)
+        lexical_mask = scope_filter.lexical_mask() if hybrid and scope_filter is not None else None
+        scope = self._answer_cache_scope()
+        combine_docs_chain = self.qa_chain.combine_docs_chain
+
+        def answer(index: int) -> Dict[str, Any]:
+            question = questions[index]
+            vector = vectors[index].tolist()
+            trace = self.tracer.start(question, self.model_name, self.embedding_model)
+            try:
+                if scope is not None:
+                    with trace.span("answer_cache") as span:
+                        cached = self.answer_cache.lookup(scope, vector, self.answer_cache_threshold)
+                        span["hit"] = cached is not None
+                    if cached is not None:
+                        trace.finish(cached=True)
+                        return {"index": index, "question": question, "cached": True, "trace_id": trace.trace_id,
+                                **cached}
+
+                with trace.span("retrieval", query=question) as span:
+                    docs = dense_docs[index]
+                    if hybrid:
+                        lexical_hits = self.lexical_index.search(question, search_k, mask=lexical_mask)
+                        lexical_ids = [chunk_id for chunk_id, _ in lexical_hits]
+                        docs = fuse_hybrid(self.vectorstore, docs, lexical_ids, fetch_k)
+                    if self.reranker is not None and docs:
+                        docs = self.reranker.rerank(question, docs, RERANK_TOP_N)
+                    docs = pack_documents(docs, self.context_token_budget, self.tracer.count_tokens)
+                    span["documents"] = len(docs)
+
+                output = combine_docs_chain.invoke(
+                    {"input_documents": docs, "question": question, "chat_history": ""},
+                    config={"callbacks": [trace]}
+                )
+                result = {"question": question, "answer": output[combine_docs_chain.output_key],
+                          "source_documents": docs}
+                if scope is not None:
+                    self.answer_cache.store(scope, question, vector, result)
+                trace.finish()
+                return {"index": index, "trace_id": trace.trace_id, **result}
+            except Exception as e:
+                trace.finish(error=str(e))
+                return {"index": index, "question": question, "error": f"Error asking question: {str(e)}"}
+
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        futures = [executor.submit(answer, index) for index in range(len(questions))]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # A consumer that stops early leaves nothing queued behind it.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _answer_cache_scope(self):
+        if self.answer_cache is None or self.active_index is None:
+            return None
+        index_name, index_version = self.active_index
+        retrieval = "hybrid" if self.hybrid_search and self.lexical_index is not None else "dense"
+        if self.reranker is not None:
+            retrieval += "+rerank"
+        scope = self.scope.key() if self.scope is not None else None
+        return index_name, index_version, self.model_name, retrieval, self.context_token_budget, scope
@@ -0,0 +1,85 @@
+import logging
+import os
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L6-v2")
+# torch, onnx or onnx-int8 (dynamically quantized ONNX export shipped with the model).
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "6"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+
+RERANKER_BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+def _int8_model_file() -> str:
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def load_cross_encoder(model_name: str, backend: str):
+    from sentence_transformers import CrossEncoder
+
+    if backend == "torch":
+        return CrossEncoder(model_name, device="cpu")
+
+    model_kwargs = {"file_name": _int8_model_file()} if backend == "onnx-int8" else {}
+    try:
+        return CrossEncoder(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    except TypeError:
+        # sentence-transformers before 4.1 has no backend argument for cross-encoders.
+        logger.warning("This sentence-transformers version cannot run cross-encoders on ONNX, using torch")
+        return CrossEncoder(model_name, device="cpu")
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a local cross-encoder, in batches spread over a small thread pool."""
+
+    def __init__(self, model_name: str = RERANKER_MODEL, backend: str = RERANKER_BACKEND,
+                 batch_size: int = RERANK_BATCH_SIZE, workers: int = RERANK_WORKERS):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.model = load_cross_encoder(model_name, backend)
+        # Inference releases the GIL, so batches run in parallel on separate cores.
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.score("warm up", ["warm up"])
+
+    def _predict(self, pairs: List[List[str]]) -> np.ndarray:
+        return np.asarray(self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False),
+                          dtype=np.float32).reshape(-1)
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        pairs = [[query, text] for text in texts]
+        batches = [pairs[start:start + self.batch_size] for start in range(0, len(pairs), self.batch_size)]
+        if not batches:
+            return np.zeros(0, dtype=np.float32)
+        if self.executor is None or len(batches) == 1:
+            return np.concatenate([self._predict(batch) for batch in batches])
+        return np.concatenate(list(self.executor.map(self._predict, batches)))
+
+    def rerank(self, query: str, docs: List[Document], top_n: int = RERANK_TOP_N) -> List[Document]:
+        scores = self.score(query, [doc.page_content for doc in docs])
+        return [docs[i] for i in np.argsort(-scores, kind="stable")[:top_n]]
+
+
+def get_reranker(model_name: str = RERANKER_MODEL, backend: str = RERANKER_BACKEND) -> CrossEncoderReranker:
+    # One warm model per process, shared by every conversation.
+    with _rerankers_lock:
+        reranker = _rerankers.get((model_name, backend))
+        if reranker is None:
+            reranker = _rerankers[(model_name, backend)] = CrossEncoderReranker(model_name, backend)
+        return reranker
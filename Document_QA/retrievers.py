@@ -0,0 +1,222 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from bm25 import BM25Index
+from vector_engines import search_positions
+
+RETRIEVER_K = 4
+RETRIEVER_FETCH_K = 20
+RRF_K = 60
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "12"))
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+
+
+def chunk_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or f"{doc.metadata.get('source_file')}:{hash(doc.page_content)}"
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def fetch_documents(vectorstore, ids: List[str]) -> Dict[str, Document]:
+    if not ids:
+        return {}
+
+    if hasattr(vectorstore, "docstore"):
+        found = {}
+        for chunk_id in ids:
+            doc = vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                found[chunk_id] = doc
+        return found
+
+    result = vectorstore.get(ids=ids)
+    return {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses dense vector hits with BM25 hits using reciprocal rank fusion.
+
+    With a `scope_filter` both searches only consider the chunks in its scope.
+    """
+
+    vectorstore: Any
+    lexical_index: BM25Index
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    rrf_k: int = RRF_K
+    scope_filter: Any = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.scope_filter is None:
+            dense_docs = self.vectorstore.similarity_search(query, k=self.fetch_k)
+            lexical_hits = self.lexical_index.search(query, self.fetch_k)
+        else:
+            dense_docs = scoped_similarity_search(self.vectorstore, query, self.fetch_k, self.scope_filter)
+            lexical_hits = self.lexical_index.search(query, self.fetch_k, mask=self.scope_filter.lexical_mask())
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_hits]
+        return fuse_hybrid(self.vectorstore, dense_docs, lexical_ids, self.k, self.rrf_k)
+
+
+class ScopedRetriever(BaseRetriever):
+    """Dense retrieval restricted to the scope of a ScopeFilter, filtered before the vector search."""
+
+    vectorstore: Any
+    scope_filter: Any
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return scoped_similarity_search(self.vectorstore, query, self.k, self.scope_filter)
+
+
+def scoped_similarity_search(vectorstore, query: str, k: int, scope_filter) -> List[Document]:
+    vector = np.asarray([vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+    return batch_similarity_search(vectorstore, vector, k, scope_filter)[0]
+
+
+def fuse_hybrid(vectorstore, dense_docs: List[Document], lexical_ids: List[str], k: int,
+                rrf_k: int = RRF_K) -> List[Document]:
+    docs = {chunk_key(doc): doc for doc in dense_docs}
+    docs.update(fetch_documents(vectorstore, [i for i in lexical_ids if i not in docs]))
+
+    fused = reciprocal_rank_fusion([[chunk_key(doc) for doc in dense_docs], lexical_ids], rrf_k)
+    return [docs[key] for key in fused if key in docs][:k]
+
+
+def batch_similarity_search(vectorstore, vectors: np.ndarray, k: int, scope_filter=None) -> List[List[Document]]:
+    """The k nearest chunks for every row of `vectors`, in one search call (a single matrix search on FAISS).
+
+    A `scope_filter` (metadata_filter.ScopeFilter) restricts the search to the chunks in its scope.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return []
+
+    if hasattr(vectorstore, "index_to_docstore_id"):
+        if getattr(vectorstore, "_normalize_L2", False):
+            import faiss
+            faiss.normalize_L2(vectors)
+        if scope_filter is not None:
+            positions = scope_filter.search_faiss(vectorstore.index, vectors, k)
+        else:
+            # Skips the positions of deleted chunks that an HNSW/IVF index still holds.
+            _, positions = search_positions(vectorstore.index, vectors, k, vectorstore.index_to_docstore_id.alive())
+        results = []
+        for row in positions.tolist():
+            ids = [vectorstore.index_to_docstore_id[p] for p in row if p != -1]
+            found = fetch_documents(vectorstore, ids)
+            results.append([found[chunk_id] for chunk_id in ids if chunk_id in found])
+        return results
+
+    where = scope_filter.where() if scope_filter is not None else None
+    result = vectorstore._collection.query(query_embeddings=vectors.tolist(), n_results=k, where=where,
+                                           include=["documents", "metadatas"])
+    return [[Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(result["documents"], result["metadatas"])]
+
+
+def overlap_length(earlier: str, later: str, max_overlap: int = MAX_OVERLAP_CHARS) -> int:
+    """Length of the longest suffix of `earlier` that `later` starts with, as left by chunk_overlap."""
+    probe = later[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+
+    position = earlier.find(probe, max(0, len(earlier) - max_overlap))
+    while position != -1:
+        if later.startswith(earlier[position:]):
+            return len(earlier) - position
+        position = earlier.find(probe, position + 1)
+    return 0
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _passage(doc: Document):
+    return doc.metadata.get("source_file", doc.metadata.get("source")), doc.metadata.get("page")
+
+
+def pack_documents(docs: List[Document], token_budget: int, count_tokens: Callable[[str], int],
+                   duplicate_threshold: float = DUPLICATE_THRESHOLD) -> List[Document]:
+    """Fills the token budget with the best-ranked chunks, cutting text shared with chunks already taken.
+
+    Overlap with a neighbouring chunk of the same page is trimmed off, and a chunk whose word shingles are
+    mostly contained in one already taken is dropped. The top chunk is always kept.
+    """
+    packed: List[Document] = []
+    packed_shingles: List[set] = []
+    used = 0
+
+    for doc in docs:
+        text = doc.page_content
+        for kept in packed:
+            if _passage(kept) != _passage(doc):
+                continue
+            text = text[overlap_length(kept.page_content, text):]
+            cut = overlap_length(text, kept.page_content)
+            if cut:
+                text = text[:-cut]
+
+        text = text.strip()
+        if len(text) < MIN_OVERLAP_CHARS:
+            continue
+
+        doc_shingles = shingles(text)
+        if any(len(doc_shingles & other) >= duplicate_threshold * len(doc_shingles) for other in packed_shingles):
+            continue
+
+        tokens = count_tokens(text)
+        if packed and used + tokens > token_budget:
+            continue
+
+        packed.append(doc if text == doc.page_content else Document(page_content=text, metadata=doc.metadata))
+        packed_shingles.append(doc_shingles)
+        used += tokens
+    return packed
+
+
+class PackedRetriever(BaseRetriever):
+    """Over-fetches from another retriever and packs the de-duplicated results into a token budget.
+
+    With a reranker, candidates are re-scored first and only the best `rerank_top_n` are packed.
+    """
+
+    retriever: BaseRetriever
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    count_tokens: Callable[[str], int]
+    reranker: Any = None
+    rerank_top_n: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Child callbacks are not passed on, so tracing sees one retrieval per question.
+        docs = self.retriever.invoke(query)
+
+        if self.reranker is not None and docs:
+            started = time.time_ns()
+            candidates = len(docs)
+            docs = self.reranker.rerank(query, docs, self.rerank_top_n)
+            run_manager.get_child().on_custom_event("rerank", {
+                "start_time_unix_nano": started, "candidates": candidates, "kept": len(docs),
+                "model": self.reranker.model_name, "backend": self.reranker.backend
+            })
+        return pack_documents(docs, self.token_budget, self.count_tokens)
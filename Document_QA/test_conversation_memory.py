@@ -0,0 +1,65 @@
+import pytest
+from langchain.memory import ConversationBufferMemory
+from langchain_community.llms.fake import FakeListLLM
+from langchain_core.prompts import PromptTemplate
+
+from conversation_memory import CondenseQuestionChain, CondensedQuestionCache, is_self_contained
+from fake_models import FakeEmbeddings
+from qa_system import DocumentQASystem
+
+FOLLOW_UPS = [
+    "What does that clause say about termination?",
+    "Which fees are listed there for late payment?",
+    "Is the warranty period described here the same?",
+]
+STANDALONE = "What does the termination clause of the lease say about notice periods?"
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_follow_ups_are_not_self_contained(question):
+    assert not is_self_contained(question)
+
+
+def test_standalone_question_is_self_contained():
+    assert is_self_contained(STANDALONE)
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_follow_up_is_condensed(question):
+    chain = CondenseQuestionChain(llm=FakeListLLM(responses=[STANDALONE]), cache=CondensedQuestionCache(),
+                                  prompt=PromptTemplate.from_template("{chat_history}\n{question}"))
+    output = chain.invoke({"question": question, "chat_history": "Human: Summarize the lease.\nAI: ..."})
+
+    assert output[chain.output_key] == STANDALONE
+
+
+class RecordingAnswerCache:
+    def __init__(self):
+        self.lookups = []
+        self.stored = []
+
+    def lookup(self, scope, vector, threshold):
+        self.lookups.append(scope)
+        return {"answer": "another conversation's answer", "source_documents": []}
+
+    def store(self, scope, question, vector, result):
+        self.stored.append(question)
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_follow_up_skips_answer_cache_lookup(question):
+    system = DocumentQASystem()
+    system.verbose = False
+    system.embeddings = FakeEmbeddings(call_latency=0)
+    system.active_index = ("lease", 1)
+    system.answer_cache = RecordingAnswerCache()
+    system.memory = ConversationBufferMemory(memory_key="chat_history", output_key="answer", return_messages=True)
+    system.memory.save_context({"question": "Summarize the lease."}, {"answer": "It runs for two years."})
+    system.qa_chain = lambda inputs, callbacks=None: {"answer": "fresh", "generated_question": STANDALONE,
+                                                      "source_documents": []}
+
+    result = system.ask_question(question)
+
+    assert system.answer_cache.lookups == []
+    assert result["answer"] == "fresh"
+    assert system.answer_cache.stored == [STANDALONE]
@@ -0,0 +1,56 @@
+import pytest
+from langchain.schema import Document
+
+from text_splitter import StructuredTextSplitter
+
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+
+
+def byte_encoding():
+    """One token per byte, so multi-byte characters span several tokens; needs no download."""
+    import tiktoken
+    return tiktoken.Encoding("bytes", pat_str=r"\S+|\s+", mergeable_ranks={bytes([i]): i for i in range(256)},
+                             special_tokens={})
+
+
+@pytest.fixture(params=["bytes", "characters"])
+def splitter(request):
+    splitter = StructuredTextSplitter(CHUNK_SIZE, CHUNK_OVERLAP)
+    splitter._encoding = byte_encoding() if request.param == "bytes" else None
+    return splitter
+
+
+def token_count(splitter, text: str) -> int:
+    return int(splitter._token_counts([text])[0])
+
+
+def split(splitter, text: str):
+    chunks = splitter.split_documents([Document(page_content=text, metadata={})])
+    for chunk in chunks:
+        assert text[chunk.metadata["start_index"]:chunk.metadata["end_index"]] == chunk.page_content
+    return chunks
+
+
+def overlapping_pairs(chunks) -> int:
+    return sum(later.metadata["start_index"] < earlier.metadata["end_index"]
+               for earlier, later in zip(chunks, chunks[1:]))
+
+
+def test_text_without_whitespace_is_cut_by_tokens(splitter):
+    text = "intro line\n" + "ağç" * 5000 + "\n" + "x" * 50000
+    chunks = split(splitter, text)
+
+    assert len(chunks) > 1
+    # A little slack: pieces are counted one by one, and a token may straddle two of them.
+    assert max(token_count(splitter, chunk.page_content) for chunk in chunks) <= CHUNK_SIZE + 2
+    assert overlapping_pairs(chunks) == len(chunks) - 1
+    assert "".join(chunk.page_content for chunk in chunks).count("x") >= 50000
+
+
+def test_word_runs_overlap(splitter):
+    text = " ".join(f"w{i % 10}" for i in range(20000))
+    chunks = split(splitter, text)
+
+    assert max(token_count(splitter, chunk.page_content) for chunk in chunks) <= CHUNK_SIZE
+    assert overlapping_pairs(chunks) == len(chunks) - 1
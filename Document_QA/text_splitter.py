@@ -0,0 +1,203 @@
+import codecs
+import re
+from bisect import bisect_left, bisect_right
+from itertools import compress
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+TOKENIZER_ENCODING = "cl100k_base"
+TOKENIZER_THREADS = 4
+MAX_HEADING_CHARS = 100
+
+# Lines too long for one chunk are cut at sentence ends first, then into runs of words.
+_SENTENCE = re.compile(r"\S[^\n]*?(?:[.!?](?=\s)|$)")
+_WORDS = re.compile(r"\S+")
+_NUMBERED_HEADING = re.compile(r"\d+(?:\.\d+)*\.?\s+\w[^\n]*")
+_THREE_LETTERS = re.compile(r"(?:[^\W\d_].*){3}")
+
+
+def is_heading(line: str) -> bool:
+    """Markdown headings, numbered headings ("2.", "3.1 Kurulum") and short all-caps lines."""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_CHARS:
+        return False
+    if line.isupper():
+        return bool(_THREE_LETTERS.search(line))
+    if line[0] == "#":
+        return True
+    return line[0].isdigit() and bool(_NUMBERED_HEADING.fullmatch(line)) and not line.endswith((".", ",", ";"))
+
+
+class StructuredTextSplitter:
+    """Splits pages into chunks of at most `chunk_size` tokens along line (then sentence) boundaries.
+
+    A heading always starts a new chunk and is recorded as the chunk's `section`; chunks never cross
+    page boundaries. `start_index`/`end_index` are character offsets of the chunk in its page, so
+    `page_content == page_text[start_index:end_index]`. All pages passed to `split_documents` are
+    processed as one batch: line offsets are computed with numpy and token counts come from one
+    batched tiktoken call.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, encoding_name: str = TOKENIZER_ENCODING):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            self._encoding = None
+
+    def _token_counts(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros(0, dtype=np.int64)
+        if self._encoding is None:
+            return np.maximum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) // 4, 1)
+        encoded = self._encoding.encode_ordinary_batch(texts, num_threads=TOKENIZER_THREADS)
+        return np.fromiter(map(len, encoded), dtype=np.int64, count=len(texts))
+
+    @staticmethod
+    def _lines(documents: List[Document]):
+        """Non-blank lines of all pages, with their page number and character offsets within the page."""
+        lines = []
+        line_counts = []
+        for doc in documents:
+            page_lines = doc.page_content.split("\n")
+            lines.extend(page_lines)
+            line_counts.append(len(page_lines))
+
+        pages = np.repeat(np.arange(len(documents)), line_counts)
+        lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+        # Offsets in the pages laid end to end, then made relative to the first line of each page.
+        starts = np.cumsum(lengths + 1) - lengths - 1
+        first_lines = np.cumsum(line_counts, dtype=np.int64) - line_counts
+        starts -= starts[first_lines][pages]
+
+        keep = (lengths > 0) & ~np.fromiter(map(str.isspace, lines), dtype=bool, count=len(lines))
+        return list(compress(lines, keep)), pages[keep], starts[keep], starts[keep] + lengths[keep]
+
+    def _split_long_units(self, documents: List[Document], units: Dict[str, np.ndarray],
+                          pattern=_SENTENCE) -> Dict[str, np.ndarray]:
+        long_units = np.flatnonzero(units["counts"] > self.chunk_size)
+        if not len(long_units):
+            return units
+
+        # Word runs and token cuts are at most chunk_overlap tokens, so _chunk_bounds can step back over
+        # whole pieces and consecutive chunks overlap as they do at line and sentence boundaries.
+        piece_tokens = self.chunk_overlap or self.chunk_size
+        spans = []
+        for i in long_units:
+            text = documents[units["pages"][i]].page_content
+            if pattern is None:
+                matches = self._token_spans(text, units["starts"][i], units["ends"][i], piece_tokens)
+            else:
+                matches = [match.span() for match in pattern.finditer(text, units["starts"][i], units["ends"][i])]
+            if pattern is _WORDS:
+                per_piece = max(1, int(len(matches) * piece_tokens / units["counts"][i] * 0.9))
+                matches = [(matches[n][0], matches[min(n + per_piece, len(matches)) - 1][1])
+                           for n in range(0, len(matches), per_piece)]
+            spans.extend((i, start, end) for start, end in matches)
+
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 3)
+        pieces = {
+            "pages": units["pages"][spans[:, 0]],
+            "starts": spans[:, 1],
+            "ends": spans[:, 2],
+            "headings": np.zeros(len(spans), dtype=bool)
+        }
+        pieces["counts"] = self._token_counts([
+            documents[page].page_content[start:end]
+            for page, start, end in zip(pieces["pages"], pieces["starts"], pieces["ends"])
+        ])
+
+        kept = np.ones(len(units["counts"]), dtype=bool)
+        kept[long_units] = False
+        order = np.argsort(np.concatenate((np.flatnonzero(kept), spans[:, 0])), kind="stable")
+        units = {key: np.concatenate((units[key][kept], pieces[key]))[order] for key in units}
+
+        if pattern is _SENTENCE:
+            # Sentences that are still too long fall back to word runs.
+            return self._split_long_units(documents, units, _WORDS)
+        if pattern is _WORDS:
+            # Runs without whitespace (URLs, base64, tables of digits) are cut by token count, since a chunk
+            # over the embedding model's input limit fails the whole ingestion.
+            return self._split_long_units(documents, units, None)
+        return units
+
+    def _token_spans(self, text: str, start: int, end: int, max_tokens: int) -> List[Tuple[int, int]]:
+        """text[start:end] cut into pieces of at most `max_tokens` tokens, at character boundaries."""
+        if self._encoding is None:
+            step = max_tokens * 4
+            return [(position, min(position + step, end)) for position in range(start, end, step)]
+
+        token_bytes = self._encoding.decode_tokens_bytes(self._encoding.encode_ordinary(text[start:end]))
+        # A token may end inside a multi-byte character; the decoder holds such bytes back for the next piece.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        spans = []
+        position = start
+        for first in range(0, len(token_bytes), max_tokens):
+            piece_end = position + len(decoder.decode(b"".join(token_bytes[first:first + max_tokens])))
+            if piece_end > position:
+                spans.append((position, piece_end))
+                position = piece_end
+        if position < end:
+            spans.append((position, end))
+        return spans
+
+    def _chunk_bounds(self, units: Dict[str, np.ndarray]) -> Iterable[Tuple[int, int, int]]:
+        """Yields ([first, last) unit range, tokens): greedy fill up to chunk_size, stepping back chunk_overlap."""
+        # Plain lists: bisect on a list is several times cheaper per call than numpy.searchsorted.
+        totals = np.concatenate(([0], np.cumsum(units["counts"]))).tolist()
+        page_starts = np.flatnonzero(np.diff(units["pages"], prepend=-1))
+        section_starts = np.union1d(page_starts, np.flatnonzero(units["headings"])).tolist()
+        section_ends = section_starts[1:] + [len(units["counts"])]
+
+        for section_start, section_end in zip(section_starts, section_ends):
+            first = section_start
+            while first < section_end:
+                last = bisect_right(totals, totals[first] + self.chunk_size) - 1
+                last = min(max(last, first + 1), section_end)
+                yield first, last, totals[last] - totals[first]
+                if last >= section_end:
+                    break
+                first = min(max(bisect_left(totals, totals[last] - self.chunk_overlap), first + 1), last)
+
+    def split_documents(self, documents: List[Document], sections: Dict[str, str] = None) -> List[Document]:
+        """`sections` maps each source to its open section and is updated in place, so a caller splitting a
+        file in several calls, in page order, keeps the heading of the previous call's last section."""
+        if not documents:
+            return []
+        lines, pages, starts, ends = self._lines(documents)
+        units = {
+            "pages": pages,
+            "starts": starts,
+            "ends": ends,
+            "counts": self._token_counts(lines),
+            "headings": np.fromiter(map(is_heading, lines), dtype=bool, count=len(lines))
+        }
+        units = self._split_long_units(documents, units)
+
+        pages, starts, ends, headings = (units[key].tolist() for key in ("pages", "starts", "ends", "headings"))
+        chunks = []
+        sections = sections if sections is not None else {}
+        for first, last, tokens in self._chunk_bounds(units):
+            doc = documents[pages[first]]
+            text = doc.page_content
+            # The section carries over to later pages of the same source until the next heading.
+            source = doc.metadata.get("source_file", doc.metadata.get("source"))
+            if headings[first]:
+                sections[source] = text[starts[first]:ends[first]].strip().lstrip("#").strip()
+
+            start, end = starts[first], ends[last - 1]
+            metadata = {**doc.metadata, "start_index": start, "end_index": end, "tokens": tokens}
+            if sections.get(source):
+                metadata["section"] = sections[source]
+            # construct() skips pydantic validation, which costs more than the splitting itself.
+            chunks.append(Document.construct(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        return [doc.page_content for doc in self.split_documents([Document(page_content=text)])]
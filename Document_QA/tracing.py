@@ -0,0 +1,303 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+from embedding_scheduler import make_token_counter
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join(".cache", "traces.jsonl"))
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "200"))
+
+# USD per million tokens (input, output).
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+STAGES = ["answer_cache", "condense_question", "retrieval", "rerank", "prompt_assembly", "llm.time_to_first_token",
+          "llm.completion", "memory_summary", "answer_cache.store", "question"]
+
+
+def estimate_cost(model: Optional[str], input_tokens: int, output_tokens: int = 0) -> float:
+    if not model:
+        return 0.0
+    model = model.split(":", 1)[-1]
+    # Longest prefix wins, so "gpt-4o-mini-2024-07-18" is priced as gpt-4o-mini rather than gpt-4.
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            input_price, output_price = MODEL_PRICES[name]
+            return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+    return 0.0
+
+
+class JsonlSpanExporter:
+    """Appends one OpenTelemetry-shaped span per line."""
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, spans: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class OtelSpanExporter:
+    """Replays finished spans through the configured OpenTelemetry tracer provider."""
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("document_qa")
+
+    def export(self, spans: List[Dict[str, Any]]):
+        started = {}
+        for span in sorted(spans, key=lambda s: s["start_time_unix_nano"]):
+            parent = started.get(span["parent_span_id"])
+            context = self._trace.set_span_in_context(parent) if parent is not None else None
+            started[span["span_id"]] = self._tracer.start_span(
+                span["name"], context=context, start_time=span["start_time_unix_nano"],
+                attributes={k: v for k, v in span["attributes"].items() if v is not None}
+            )
+        for span in spans:
+            started[span["span_id"]].end(end_time=span["end_time_unix_nano"])
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_span_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None and TRACE_EXPORTER == "otel":
+            try:
+                _exporter = OtelSpanExporter()
+            except ImportError:
+                logger.warning("opentelemetry is not installed, writing spans to %s instead", TRACE_PATH)
+        if _exporter is None and TRACE_EXPORTER in ("otel", "jsonl"):
+            _exporter = JsonlSpanExporter()
+        return _exporter
+
+
+class TraceHandler(BaseCallbackHandler):
+    """Turns the callbacks of one ask_question call into timing spans.
+
+    LLM calls are told apart by position: before retrieval they condense the question,
+    after it they answer, and after the answer they belong to summary memory.
+    """
+
+    def __init__(self, tracer: "Tracer", question: str, model_name: str = None, embedding_model: str = None):
+        self.tracer = tracer
+        self.model_name = model_name
+        self.embedding_model = embedding_model
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Dict[str, Any]] = []
+        self._runs: Dict[Any, Dict[str, Any]] = {}
+        self._prompt_span = None
+        self._retrieved = False
+        self._answered = False
+        self._finished = False
+        self.root = self._start("question", None, question=question, model=model_name)
+
+    def _start(self, name: str, parent: Optional[Dict[str, Any]] = "root", **attributes) -> Dict[str, Any]:
+        parent = self.root if parent == "root" else parent
+        return {
+            "trace_id": self.trace_id,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_span_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start_time_unix_nano": time.time_ns(),
+            "end_time_unix_nano": None,
+            "attributes": attributes
+        }
+
+    def _end(self, span: Dict[str, Any], **attributes) -> Dict[str, Any]:
+        span["end_time_unix_nano"] = time.time_ns()
+        span["attributes"].update(attributes)
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self._start(name, **attributes)
+        try:
+            yield span["attributes"]
+        finally:
+            self._end(span)
+
+    def on_retriever_start(self, serialized, query: str, *, run_id, **kwargs):
+        tokens = self.tracer.count_tokens(query)
+        self._runs[run_id] = self._start("retrieval", query=query, embedding_model=self.embedding_model,
+                                         embedding_tokens=tokens,
+                                         cost_usd=estimate_cost(self.embedding_model, tokens))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        span = self._runs.pop(run_id, None)
+        if span is not None:
+            self._end(span, documents=len(documents))
+        self._retrieved = True
+        self._prompt_span = self._start("prompt_assembly", documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        span = self._runs.pop(run_id, None)
+        if span is not None:
+            self._end(span, error=str(error))
+
+    def on_custom_event(self, name: str, data: Any, *, run_id, **kwargs):
+        if name != "rerank":
+            return
+        attributes = dict(data)
+        started = attributes.pop("start_time_unix_nano")
+        span = self._start("rerank", **attributes)
+        span["start_time_unix_nano"] = started
+        self._end(span)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._llm_start(run_id, "\n".join(str(m.content) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._llm_start(run_id, "\n".join(prompts))
+
+    def _llm_start(self, run_id, prompt: str):
+        prompt_tokens = self.tracer.count_tokens(prompt)
+        if self._answered:
+            name = "memory_summary"
+        elif self._retrieved:
+            name = "llm.completion"
+            if self._prompt_span is not None:
+                self._end(self._prompt_span, context_tokens=prompt_tokens)
+                self._prompt_span = None
+        else:
+            name = "condense_question"
+        self._runs[run_id] = self._start(name, model=self.model_name, prompt_tokens=prompt_tokens)
+        self._runs[run_id]["_text"] = []
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        span = self._runs.get(run_id)
+        if span is None:
+            return
+        if not span["_text"] and span["name"] == "llm.completion":
+            first_token = self._start("llm.time_to_first_token")
+            first_token["start_time_unix_nano"] = span["start_time_unix_nano"]
+            self._end(first_token)
+        span["_text"].append(token)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._runs.pop(run_id, None)
+        if span is None:
+            return
+
+        text = "".join(span.pop("_text"))
+        if not text and response.generations and response.generations[0]:
+            text = response.generations[0][0].text
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or span["attributes"]["prompt_tokens"]
+        completion_tokens = usage.get("completion_tokens") or self.tracer.count_tokens(text)
+        self._end(span, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                  cost_usd=estimate_cost(self.model_name, prompt_tokens, completion_tokens))
+        if span["name"] == "llm.completion":
+            self._answered = True
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._runs.pop(run_id, None)
+        if span is not None:
+            span.pop("_text", None)
+            self._end(span, error=str(error))
+
+    def finish(self, cached: bool = False, error: str = None) -> Dict[str, Any]:
+        if self._finished:
+            return self.root
+        self._finished = True
+
+        if self._prompt_span is not None:
+            self._end(self._prompt_span)
+        for span in self._runs.values():
+            span.pop("_text", None)
+            self._end(span, error="unfinished")
+        self._runs.clear()
+
+        attributes = {"cached": cached, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+        for span in self.spans:
+            for key in ("prompt_tokens", "completion_tokens", "cost_usd"):
+                attributes[key] += span["attributes"].get(key) or 0
+        if error:
+            attributes["error"] = error
+        self._end(self.root, **attributes)
+        self.tracer.record(self)
+        return self.root
+
+
+def span_duration_ms(span: Dict[str, Any]) -> float:
+    return (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6
+
+
+class Tracer:
+    """Collects question traces, exports their spans and keeps rolling per-stage latency and cost figures."""
+
+    def __init__(self, exporter=None, window: int = TRACE_WINDOW):
+        self.exporter = exporter
+        self.count_tokens = make_token_counter()
+        self.traces = deque(maxlen=window)
+        self.total_cost = 0.0
+        self.total_tokens = 0
+        self._durations: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def start(self, question: str, model_name: str = None, embedding_model: str = None) -> TraceHandler:
+        return TraceHandler(self, question, model_name, embedding_model)
+
+    def record(self, handler: TraceHandler):
+        with self._lock:
+            for span in handler.spans:
+                self._durations.setdefault(span["name"], deque(maxlen=self._window)).append(span_duration_ms(span))
+            root = handler.root["attributes"]
+            self.total_cost += root["cost_usd"]
+            self.total_tokens += root["prompt_tokens"] + root["completion_tokens"]
+            self.traces.append({
+                "trace_id": handler.trace_id,
+                "stages": {span["name"]: round(span_duration_ms(span), 1) for span in handler.spans},
+                **root
+            })
+
+        if self.exporter is not None:
+            try:
+                self.exporter.export(handler.spans)
+            except Exception as e:
+                logger.warning("Could not export trace %s: %s", handler.trace_id, e)
+
+    @property
+    def last_trace(self) -> Optional[Dict[str, Any]]:
+        return self.traces[-1] if self.traces else None
+
+    def stage_summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            durations = {name: np.array(values) for name, values in self._durations.items() if values}
+
+        return [{
+            "stage": name,
+            "count": len(durations[name]),
+            "last_ms": round(float(durations[name][-1]), 1),
+            "p50_ms": round(float(np.percentile(durations[name], 50)), 1),
+            "p95_ms": round(float(np.percentile(durations[name], 95)), 1)
+        } for name in STAGES if name in durations]
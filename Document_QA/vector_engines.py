@@ -0,0 +1,178 @@
+import math
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+INDEX_ENGINES = ["Flat", "HNSW", "HNSW-SQ8", "IVF-SQ8", "IVF-PQ"]
+INDEX_ENGINE_LABELS = {
+    "Flat": "Flat (exact)",
+    "HNSW": "HNSW",
+    "HNSW-SQ8": "HNSW + int8",
+    "IVF-SQ8": "IVF + int8",
+    "IVF-PQ": "IVF + PQ",
+}
+
+# Enough training vectors for IVF centroids and 256-entry PQ codebooks.
+TRAIN_SIZE = int(os.getenv("INDEX_TRAIN_SIZE", "20000"))
+HNSW_M = 32
+HNSW_EF_SEARCH = int(os.getenv("INDEX_HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("INDEX_IVF_NPROBE", "16"))
+RERANK_K_FACTOR = int(os.getenv("INDEX_RERANK_K_FACTOR", "4"))
+
+QUANTIZED_ENGINES = {"HNSW-SQ8", "IVF-SQ8", "IVF-PQ"}
+
+# Selections of at most this many vectors are searched exactly over just those vectors: a graph search (HNSW)
+# loses recall when nearly every node it walks is filtered out.
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", "4096"))
+# Cap for the efSearch of a filtered HNSW search, which is widened as the selection gets narrower.
+FILTER_MAX_EF_SEARCH = 1024
+
+# Rebuild an HNSW/IVF index once this share of its positions belongs to deleted chunks.
+_COMPACT_RATIO = 0.25
+
+_MIN_IVF_POINTS = 39
+_MIN_PQ_POINTS = 256 * _MIN_IVF_POINTS
+
+
+def requires_training(engine: str) -> bool:
+    return engine.startswith("IVF")
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    # Four dimensions per one-byte code: 16x smaller than float32.
+    m = max(1, dimension // 4)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def factory_string(engine: str, dimension: int, num_vectors: int) -> Tuple[str, str]:
+    """Returns the faiss factory string and the engine actually used for this many vectors."""
+    if engine == "HNSW":
+        return f"HNSW{HNSW_M}", engine
+    if engine == "HNSW-SQ8":
+        return f"HNSW{HNSW_M},SQ8", engine
+    if engine.startswith("IVF"):
+        if num_vectors < _MIN_IVF_POINTS:
+            return "Flat", "Flat"
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // _MIN_IVF_POINTS, 65536))
+        if engine == "IVF-PQ" and num_vectors >= _MIN_PQ_POINTS:
+            return f"IVF{nlist},PQ{_pq_subquantizers(dimension)}x8", engine
+        return f"IVF{nlist},SQ8", "IVF-SQ8"
+    return "Flat", "Flat"
+
+
+def tune_index(index):
+    import faiss
+
+    params = faiss.ParameterSpace()
+    base = faiss.downcast_index(index.base_index) if isinstance(index, faiss.IndexRefine) else index
+    if isinstance(base, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", IVF_NPROBE)
+    elif isinstance(base, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", HNSW_EF_SEARCH)
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = RERANK_K_FACTOR
+    return index
+
+
+def make_faiss_index(engine: str, training_vectors: np.ndarray, exact_rerank: bool = False):
+    import faiss
+
+    training_vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    num_vectors, dimension = training_vectors.shape
+    factory, used_engine = factory_string(engine, dimension, num_vectors)
+
+    index = faiss.index_factory(dimension, factory)
+    if isinstance(index, faiss.IndexIVFPQ):
+        # Polysemous codes only help Hamming-filtered search and triple the training time.
+        index.do_polysemous_training = False
+    if exact_rerank and used_engine in QUANTIZED_ENGINES:
+        # Approximate search picks k * k_factor candidates, exact distances pick the final k.
+        index = faiss.IndexRefineFlat(index)
+    if not index.is_trained:
+        index.train(training_vectors[:TRAIN_SIZE])
+    return tune_index(index), used_engine
+
+
+def search_positions(index, vectors: np.ndarray, k: int,
+                     allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """index.search restricted to the positions set in the `allowed` bitmap; missing results are -1."""
+    import faiss
+
+    if allowed is None:
+        return index.search(vectors, k)
+
+    selected = np.flatnonzero(allowed)
+    distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+    positions = np.full((len(vectors), k), -1, dtype=np.int64)
+    if not len(selected):
+        return distances, positions
+
+    refine = isinstance(index, faiss.IndexRefine)
+    base = faiss.downcast_index(index.base_index if refine else index)
+    if len(selected) <= FILTER_EXACT_MAX and (refine or not isinstance(base, faiss.IndexIVF)):
+        # IVF lists cannot be reconstructed without a direct map; everything else decodes its vectors.
+        subset = faiss.IndexFlat(index.d, index.metric_type)
+        subset.add(index.reconstruct_batch(selected))
+        found_distances, found = subset.search(vectors, min(k, len(selected)))
+        distances[:, :found.shape[1]] = found_distances
+        positions[:, :found.shape[1]] = np.where(found >= 0, selected[np.maximum(found, 0)], -1)
+        return distances, positions
+
+    bits = np.packbits(allowed, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bits))
+    selectivity = len(selected) / len(allowed)
+    # Explicit parameters replace the tuned ones, and a narrow selection needs a wider search to fill k.
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector,
+                                           nprobe=min(base.nlist, math.ceil(base.nprobe / selectivity)))
+    elif isinstance(base, faiss.IndexHNSW):
+        ef_search = base.hnsw.efSearch
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=max(ef_search, min(FILTER_MAX_EF_SEARCH, math.ceil(ef_search / selectivity))))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    if refine:
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=params)
+    return index.search(vectors, k, params=params)
+
+
+def delete_vectors(vectorstore, ids: List[str]):
+    """FAISS delete. Flat indexes compact in place; HNSW and IVF, whose remove_ids is missing or keeps the
+    old labels, only tombstone the chunks, which searches skip, until compact_vectors rebuilds them."""
+    import faiss
+
+    index_to_docstore_id = vectorstore.index_to_docstore_id
+    positions = index_to_docstore_id.positions(ids)
+    vectorstore.docstore.delete([chunk_id for chunk_id in ids if vectorstore.docstore.row_of(chunk_id) is not None])
+    if isinstance(faiss.downcast_index(vectorstore.index), faiss.IndexFlatCodes):
+        vectorstore.index.remove_ids(positions)
+        index_to_docstore_id.remove(positions)
+    elif index_to_docstore_id.dead_count() > _COMPACT_RATIO * len(index_to_docstore_id):
+        compact_vectors(vectorstore)
+
+
+def compact_vectors(vectorstore):
+    """Rebuilds the index from the vectors of live chunks, dropping the positions of deleted ones."""
+    import faiss
+
+    alive = vectorstore.index_to_docstore_id.alive()
+    if alive is None:
+        return
+    index = vectorstore.index
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        faiss.downcast_index(index).make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    rebuilt.add(vectors[alive])
+    vectorstore.index = tune_index(rebuilt)
+    vectorstore.index_to_docstore_id.remove(np.flatnonzero(~alive))
+
+
+def index_memory_bytes(index) -> int:
+    import faiss
+
+    return int(faiss.serialize_index(index).nbytes)